@@ -1,104 +1,111 @@
-import arcgis
+import hashlib
+import hmac
 import os
-import zipfile
+import queue
+import threading
+import agol_publish
+import run_metrics
 import tkinter as tk
-from tkinter import messagebox
-from arcgis.gis import GIS
+from tkinter import filedialog, messagebox
 
-# Function to log messages to the debugging window
+# Messages from publishing threads, drained into debug_output by the Tk main loop
+log_queue = queue.Queue()
+
+# Logged-in portal sessions by username, with a salted hash of the password they were opened with,
+# reused by every upload of this window
+sessions = {}
+sessions_lock = threading.Lock()
+session_salt = os.urandom(16)
+
+# Function to log messages to the debugging window (safe to call from any thread)
 def log_message(message, level="INFO"):
-    if 'debug_output' in globals():  # Check if debug_output is defined
-        debug_output.insert(tk.END, f"[{level}] {message}\n")
+    log_queue.put(f"[{level}] {message}")
+
+# Function to move queued messages into the debug window, rescheduling itself on the Tk main loop
+def poll_log_queue():
+    while True:
+        try:
+            message = log_queue.get_nowait()
+        except queue.Empty:
+            break
+        debug_output.insert(tk.END, f"{message}\n")
         debug_output.see(tk.END)  # Automatically scroll to the latest message
-    else:
-        print(f"[{level}] {message}")  # Fallback to console if debug_output is undefined
+    root.after(100, poll_log_queue)
+
+# Function to hash a password for comparing it with the one a session was opened with
+def password_digest(password):
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), session_salt, 100000)
+
+# Function to get the session of a user, logging in again only when there is none or the password differs
+def get_session(username, password):
+    digest = password_digest(password)
+    with sessions_lock:
+        digest_and_session = sessions.get(username)
+        if digest_and_session is not None and hmac.compare_digest(digest_and_session[0], digest):
+            return digest_and_session[1]
+        log_message("Connecting to ArcGIS Online...")
+        session = agol_publish.PortalSession(username, password, log=log_message)
+        sessions[username] = (digest, session)
+        log_message("Successfully connected to ArcGIS Online.")
+        return session
 
-# Function to zip the geodatabase and upload it
+# Function to show an error dialog from any thread, on the Tk main loop
+def show_error(message):
+    root.after(0, lambda: messagebox.showerror("Error", message))
+
+# Function to zip the geodatabase and upload it in the background, so the debug window keeps updating
 def zip_and_upload():
     # Retrieve user inputs
     username = username_entry.get()
     password = password_entry.get()
-    fgdb_path = fgdb_path_entry.get()
-    zip_name = zip_name_entry.get()
-    folder_name = folder_name_entry.get()
+    job = {'gdb': fgdb_path_entry.get(), 'name': zip_name_entry.get(), 'folder': folder_name_entry.get()}
+    threading.Thread(target=run_upload, args=(username, password, job), daemon=True).start()
 
+# Function to connect, upload and publish one geodatabase (runs on a worker thread)
+def run_upload(username, password, job):
     log_message("Initializing upload process...")
 
-    # Create the full path for the zip file
-    zip_path = os.path.join(os.path.dirname(fgdb_path), f"{zip_name}.zip")
-
-    log_message("Connecting to ArcGIS Online...")
     # Connect to your ArcGIS Online account
     try:
-        g = GIS("https://www.arcgis.com", username, password)
-        log_message("Successfully connected to ArcGIS Online.")
+        session = get_session(username, password)
     except Exception as e:
         log_message(f"Failed to connect to ArcGIS Online: {e}", "ERROR")
-        messagebox.showerror("Error", f"Failed to connect to ArcGIS Online: {e}")
-        return
-
-    # Check if geodatabase path exists
-    if not os.path.exists(fgdb_path):
-        log_message(f"Geodatabase path not found: {fgdb_path}", "ERROR")
-        messagebox.showerror("Error", f"Geodatabase path not found: {fgdb_path}")
+        show_error(f"Failed to connect to ArcGIS Online: {e}")
         return
 
-    # Zip the geodatabase
-    if not os.path.exists(zip_path):
-        try:
-            log_message(f"Zipping geodatabase at {fgdb_path}...")
-            with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for root, _, files in os.walk(fgdb_path):
-                    for file in files:
-                        file_path = os.path.join(root, file)
-                        zipf.write(file_path, os.path.relpath(file_path, os.path.dirname(fgdb_path)))
-            log_message(f"Geodatabase successfully zipped at {zip_path}")
-        except Exception as e:
-            log_message(f"Failed to zip the geodatabase: {e}", "ERROR")
-            messagebox.showerror("Error", f"Failed to zip the geodatabase: {e}")
-            return
-
-    # Find the folder object based on user input folder name
-    log_message(f"Searching for folder '{folder_name}'...")
-    folder_obj = None
-    for folder in g.users.me.folders:
-        if folder['title'] == folder_name:
-            folder_obj = folder
-            log_message(f"Folder found: {folder_name} (ID: {folder['id']})")
-            break
-    if not folder_obj:
-        log_message(f"Folder '{folder_name}' not found.", "ERROR")
-        messagebox.showerror("Error", f"Folder '{folder_name}' not found.")
-        return
-
-    # Define properties for the item
-    serviceProp = {
-        'type': 'File Geodatabase',
-        'tags': 'sometag',
-        'title': zip_name  # Use the user-defined name for the item
-    }
-
-    # Define publish properties
-    pubProps = {
-        "hasStaticData": 'true',
-        "name": zip_name,
-        "maxRecordCount": 2000,
-        "layerInfo": {"capabilities": "Query"}
-    }
-
-    # Add the zipped geodatabase to the specified folder
+    # Package and upload the geodatabase, then publish the uploaded item, recording the time of each stage
     try:
-        log_message(f"Uploading zipped geodatabase to folder '{folder_name}'...")
-        fgdb_item = g.content.add(item_properties=serviceProp, data=zip_path, folder=folder_obj['id'])
-        log_message(f"Uploaded item: {fgdb_item.title} (Type: {fgdb_item.type})")
-
-        # Publish the item
-        log_message("Publishing the uploaded item...")
-        fgdb_layer = fgdb_item.publish(publish_parameters=pubProps, file_type='filegeodatabase', overwrite=True)
-        log_message(f"[Finished] Published item(s)!")
+        log_message(f"Uploading geodatabase {job['gdb']} to folder '{job['folder']}'...")
+        metrics_path = run_metrics.default_metrics_path('gdb_to_agol')
+        with run_metrics.RunRecorder('gdb_to_agol', metrics_path, jobs=1):
+            item_id = agol_publish.upload_job(session, job, log=log_message)
+            agol_publish.publish_job(session, job, item_id, log=log_message)
+        log_message(f"[Finished] Published item(s)! Run metrics written to {metrics_path}")
     except Exception as e:
         log_message(f"Error uploading or publishing the geodatabase: {e}", "ERROR")
-        messagebox.showerror("Error", f"Error uploading or publishing the geodatabase: {e}")
+        show_error(f"Error uploading or publishing the geodatabase: {e}")
+
+# Function to publish every job of a jobs file in the background with one session
+def run_batch_publish(username, password, jobs_path):
+    try:
+        jobs = agol_publish.load_publish_jobs(jobs_path)
+        session = get_session(username, password)
+        log_message(f"Publishing {len(jobs)} geodatabase(s) from '{jobs_path}'...")
+        metrics_path = run_metrics.default_metrics_path('gdb_to_agol_batch')
+        with run_metrics.RunRecorder('gdb_to_agol_batch', metrics_path, jobs=len(jobs)):
+            results = agol_publish.run_publish_jobs(session, jobs, log=log_message)
+        failed = sum(1 for result in results if result['status'] == 'failed')
+        log_message(f"Batch publish finished: {len(results) - failed} published, {failed} failed")
+        log_message(f"Run metrics written to {metrics_path}")
+    except Exception as e:
+        log_message(f"Batch publish failed: {e}", "ERROR")
+
+# Function to pick a jobs file (CSV or JSON of gdb, name, folder rows) and publish it as a batch
+def start_batch_publish():
+    jobs_path = filedialog.askopenfilename(filetypes=[("Publish jobs", "*.csv *.json"), ("All files", "*.*")])
+    if not jobs_path:
+        return
+    threading.Thread(target=run_batch_publish, args=(username_entry.get(), password_entry.get(), jobs_path), daemon=True).start()
 
 # Create the main GUI window
 root = tk.Tk()
@@ -129,6 +136,10 @@ folder_name_entry.pack()
 upload_button = tk.Button(root, text="Upload", command=zip_and_upload)
 upload_button.pack()
 
+# Batch publishing: a CSV or JSON jobs file of (gdb, name, folder) rows, sharing one login
+batch_button = tk.Button(root, text="Publish Batch From File...", command=start_batch_publish)
+batch_button.pack()
+
 # Debugging output window
 debug_frame = tk.Frame(root)
 debug_frame.pack(fill=tk.BOTH, expand=True)
@@ -136,5 +147,8 @@ tk.Label(debug_frame, text="Debugging Output:").pack(anchor=tk.W)
 debug_output = tk.Text(debug_frame, height=10, wrap="word")
 debug_output.pack(fill=tk.BOTH, expand=True)
 
+# Start draining messages into the debug window
+root.after(100, poll_log_queue)
+
 # Run the GUI
 root.mainloop()
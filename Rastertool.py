@@ -1,8 +1,68 @@
-import requests
 import tkinter as tk
 from tkinter import filedialog
 import os
 import datetime
+import queue
+import threading
+import disk_cache
+import raster_batch
+import raster_tiles
+
+# Default export extent and spatial reference
+DEFAULT_BBOX = '-2271872.583082739,1386016.2667604391,-60872.5830827388,3783016.266760439'
+DEFAULT_BBOX_SR = '102002'
+
+# Local cache of export responses, so repeated identical exports are served from disk
+EXPORT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.arcbridge', 'export_cache')
+EXPORT_CACHE_MAX_BYTES = 2 * 1024 ** 3  # Least recently used exports are evicted past this size
+EXPORT_CACHE_TTL = None  # Seconds before an export is re-requested; None keeps it until evicted or revalidated
+export_cache = disk_cache.DiskCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_BYTES, EXPORT_CACHE_TTL)
+
+# Messages from export threads, drained into debug_text by the Tk main loop
+log_queue = queue.Queue()
+
+
+# Function to report a message on the console and in the debug window (safe to call from any thread)
+def log_message(message):
+    print(message)
+    log_queue.put(message)
+
+# Function to move queued messages into the debug window, rescheduling itself on the Tk main loop
+def poll_log_queue():
+    while True:
+        try:
+            message = log_queue.get_nowait()
+        except queue.Empty:
+            break
+        debug_text.insert(tk.END, f"{message}\n")
+        debug_text.see(tk.END)
+    root.after(100, poll_log_queue)
+
+# Function to export a tiled mosaic in the background
+def run_tiled_export(base_url, layer_selection, bbox, bbox_sr, resolution, save_path, cache=None):
+    try:
+        log_message(f"Starting tiled export at {resolution} units per pixel...")
+        image_path, world_path, width, height = raster_tiles.export_tiled(
+            base_url, layer_selection, bbox, bbox_sr, resolution, save_path,
+            progress=lambda done, total: log_message(f"Tile {done} of {total} done"),
+            cache=cache,
+        )
+        log_message(f"Mosaic saved as '{image_path}' ({width}x{height} pixels) with world file '{world_path}'")
+    except Exception as e:
+        log_message(f"Error: Tiled export failed due to {e}")
+
+# Function to export a single image in the background
+def run_single_export(base_url, job, save_path, cache=None):
+    log_message(f"Making request to: {base_url} with params {raster_batch.export_params(job)}")
+
+    # Stream the image to the file (identical requests are answered from the local cache)
+    try:
+        raster_batch.export_image(base_url, job, save_path, cache)
+        log_message(f"Image saved as '{save_path}'")
+    except PermissionError:
+        log_message(f"Error: Permission denied when trying to save image to '{save_path}'.")
+    except Exception as e:
+        log_message(f"Error: {e}")
 
 
 # Function to fetch layers and save images to a folder
@@ -10,64 +70,88 @@ def fetch_layers():
     base_url = api_entry.get()  # Get the API link from the entry widget
     selected_format = format_var.get()  # Get the selected format from dropdown
     layer_selection = layers_entry.get()
+    bbox_text = bbox_entry.get() or DEFAULT_BBOX
+    bbox_sr = sr_entry.get() or DEFAULT_BBOX_SR
+    resolution_text = resolution_entry.get().strip()
+    cache = export_cache if cache_var.get() == 1 else None
+
+    # A ground resolution switches to a tiled export mosaicked into one TIFF with a world file
+    if resolution_text:
+        save_folder = os.path.normpath(output_entry.get())
+        try:
+            bbox = raster_batch.normalize_bbox(bbox_text)
+            resolution = float(resolution_text)
+            os.makedirs(save_folder, exist_ok=True)
+        except (ValueError, OSError) as e:
+            log_message(f"Error: {e}")
+            return
+        if selected_format.lower() not in raster_batch.MOSAIC_FORMATS:
+            log_message(f"Tiled exports are always saved as GeoTIFF; the {selected_format} format applies to single images only")
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        save_path = os.path.join(save_folder, f"{outputname_entry.get()}_mosaic_{timestamp}.tif")
+        threading.Thread(target=run_tiled_export, args=(base_url, layer_selection, bbox, bbox_sr, resolution, save_path, cache), daemon=True).start()
+        return
 
+    save_folder = os.path.normpath(output_entry.get()) if output_entry.get() else ''  # Folder path from the entry widget
 
+    # Ensure the save folder is valid
+    if not save_folder:
+        log_message("Error: No folder path selected.")
+        return
 
-    # Request parameters
-    params = {
-        'f': 'image',  # Response format (image)
-        'bbox': '-2271872.583082739,1386016.2667604391,-60872.5830827388,3783016.266760439',  # Bounding box
-        'layers': f'show:{layer_selection}',  # Uses the input layers from the GUI
-        'bboxSR': '102002',   # Spatial reference system
-        'size': '800,600',  # Image size
-        'format': selected_format.lower(),  # Image format based on user selection
-        'transparent': True  # enables transparency for the image background
-    }
-
-    print(f"Making request to: {base_url} with params {params}")
-    response = requests.get(base_url, params=params)
-
-    if response.status_code == 200:
-        print("Request successful.")
-        save_folder = os.path.normpath(output_entry.get())  # Folder path from the entry widget
-
-        # Ensure the save folder is valid
-        if not save_folder:
-            print("Error: No folder path selected.")
-            debug_text.insert(tk.END, "Error: No folder path selected.\n")
+    # Ensure the directory exists
+    if not os.path.exists(save_folder):
+        log_message(f"Directory '{save_folder}' does not exist, creating it...")
+        try:
+            os.makedirs(save_folder)
+        except PermissionError:
+            log_message(f"Error: Permission denied when trying to create directory '{save_folder}'.")
             return
 
-        # Ensure the directory exists
-        if not os.path.exists(save_folder):
-            print(f"Directory '{save_folder}' does not exist, creating it...")
-            try:
-                os.makedirs(save_folder)
-            except PermissionError:
-                print(f"Error: Permission denied when trying to create directory '{save_folder}'.")
-                debug_text.insert(tk.END, f"Error: Permission denied when trying to create directory '{save_folder}'.\n")
-                return
-
-        # Generate a filename (e.g., using the current timestamp or an incremental approach)
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename_input = outputname_entry.get()
-        filename = filename = f"{filename_input}_image_{timestamp}.{selected_format.lower()}"
-        save_path = os.path.join(save_folder, filename)
+    # Generate a filename (e.g., using the current timestamp or an incremental approach)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename_input = outputname_entry.get()
+    filename = f"{filename_input}_image_{timestamp}.{selected_format.lower()}"
+    save_path = os.path.join(save_folder, filename)
 
-        # Save the image to the file
-        try:
-            with open(save_path, 'wb') as file:
-                file.write(response.content)
-            print(f"Image saved as '{save_path}'")
-            debug_text.insert(tk.END, f"Image saved as '{save_path}'\n")
-        except PermissionError:
-            print(f"Error: Permission denied when trying to save image to '{save_path}'.")
-            debug_text.insert(tk.END, f"Error: Permission denied when trying to save image to '{save_path}'.\n")
-        except Exception as e:
-            print(f"Error: Failed to save image due to {e}")
-            debug_text.insert(tk.END, f"Error: Failed to save image due to {e}\n")
-    else:
-        print(f"Error: Failed to fetch image. Status code: {response.status_code}")
-        debug_text.insert(tk.END, f"Error: Failed to fetch image. Status code: {response.status_code}\n")
+    try:
+        bbox = raster_batch.normalize_bbox(bbox_text)
+    except ValueError as e:
+        log_message(f"Error: {e}")
+        return
+    job = {
+        'name': filename_input,
+        'layers': layer_selection,
+        'bbox': bbox,
+        'bbox_sr': bbox_sr,
+        'size': '800,600',
+        'format': selected_format,
+    }
+    threading.Thread(target=run_single_export, args=(base_url, job, save_path, cache), daemon=True).start()
+
+# Function to run a jobs file of exports in the background
+def run_batch_export(base_url, jobs_path, save_folder, max_workers, cache=None):
+    try:
+        jobs = raster_batch.load_export_jobs(jobs_path)
+        log_message(f"Running {len(jobs)} export job(s) from '{jobs_path}', {max_workers} at a time...")
+        results = raster_batch.run_export_jobs(base_url, jobs, save_folder, max_workers, cache, log=log_message)
+        failed = sum(1 for result in results if result['status'] == 'failed')
+        log_message(f"Batch export finished: {len(results) - failed} saved, {failed} failed")
+    except Exception as e:
+        log_message(f"Error: Batch export failed due to {e}")
+
+# Function to pick a jobs file (CSV or JSON) and run it as a batch export
+def start_batch_export():
+    base_url = api_entry.get()
+    save_folder = os.path.normpath(output_entry.get()) if output_entry.get() else ''
+    if not save_folder:
+        log_message("Error: No folder path selected.")
+        return
+    jobs_path = filedialog.askopenfilename(filetypes=[("Export jobs", "*.csv *.json"), ("All files", "*.*")])
+    if not jobs_path:
+        return
+    cache = export_cache if cache_var.get() == 1 else None
+    threading.Thread(target=run_batch_export, args=(base_url, jobs_path, save_folder, int(workers_spinbox.get()), cache), daemon=True).start()
 
 # Function to browse and select a save location (folder)
 def browse_gdb():
@@ -84,6 +168,10 @@ def browse_gdb():
     output_entry.delete(0, tk.END)
     output_entry.insert(0, folder_path)
 
+# Function to disable the format menu while a ground resolution is set, since tiled exports are always GeoTIFF
+def update_format_state(*args):
+    format_menu.config(state=tk.DISABLED if resolution_var.get().strip() else tk.NORMAL)
+
 # GUI Setup
 root = tk.Tk()
 root.title("Imagery_to_Desktop")
@@ -118,13 +206,48 @@ format_var = tk.StringVar(value="PNG")  # Default format
 format_menu = tk.OptionMenu(root, format_var, "PDF", "PNG32", "PNG24", "PNG", "JPG", "DIB", "TIFF", "EMF", "PS", "GIF", "SVG", "SVGZ", "BMP")
 format_menu.pack()
 
+# Extent and spatial reference of the export
+tk.Label(root, text="Bounding Box (xmin,ymin,xmax,ymax):").pack()
+bbox_entry = tk.Entry(root, width=60)
+bbox_entry.insert(0, DEFAULT_BBOX)
+bbox_entry.pack()
+
+tk.Label(root, text="Spatial Reference (WKID):").pack()
+sr_entry = tk.Entry(root)
+sr_entry.insert(0, DEFAULT_BBOX_SR)
+sr_entry.pack()
+
+# Leave blank for a single 800x600 image; set it for a tiled high-resolution mosaic (.tif + .tfw)
+tk.Label(root, text="Ground Resolution (map units per pixel):").pack()
+resolution_var = tk.StringVar()
+resolution_var.trace_add('write', update_format_state)
+resolution_entry = tk.Entry(root, textvariable=resolution_var)
+resolution_entry.pack()
+
+# Serve repeated identical exports from the local disk cache
+cache_var = tk.IntVar(value=1)
+tk.Checkbutton(root, text="Use local export cache", variable=cache_var).pack()
+
 # Button to fetch layers based on the API link
 fetch_button = tk.Button(root, text="Fetch Layer", command=fetch_layers)
 fetch_button.pack()
 
+# Batch exports: a CSV or JSON jobs file of (name, layers, bbox, format) rows, several at a time
+tk.Label(root, text="Concurrent batch exports:").pack()
+workers_spinbox = tk.Spinbox(root, from_=1, to=16, width=5)
+workers_spinbox.delete(0, tk.END)
+workers_spinbox.insert(0, raster_batch.DEFAULT_EXPORT_WORKERS)
+workers_spinbox.pack()
+
+batch_button = tk.Button(root, text="Run Batch From File...", command=start_batch_export)
+batch_button.pack()
+
 # Debug Text Box
 debug_text = tk.Text(root, height=10, width=80)
 debug_text.pack()
 
+# Start draining export messages into the debug window
+root.after(100, poll_log_queue)
+
 # Run the GUI
 root.mainloop()
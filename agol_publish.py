@@ -0,0 +1,264 @@
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import chunked_upload
+import gdb_packager
+import run_metrics
+from arcgis.gis import GIS
+
+# Geodatabase publishing for GDB_to_AGOL3, without Tk.
+# A PortalSession logs in once and keeps the token and an index of the user's folders
+# and items in memory, so any number of publishes cost one login and one folder scan.
+# run_publish_jobs() takes a list of (gdb, name, folder) jobs and runs them as two
+# overlapping stages: package + upload (the zip is streamed to the upload as it is
+# written) and publish, so one job publishes while the next is still uploading.
+#
+# CSV jobs file:
+#   gdb,name,folder
+#   C:\Data\North.gdb,North_Region,Regions
+#
+# JSON jobs file:
+#   [{"gdb": "C:\\Data\\North.gdb", "name": "North_Region", "folder": "Regions"}]
+
+# Portal the geodatabases are uploaded to and published on
+PORTAL_URL = "https://www.arcgis.com"
+
+# Lifetime of a generated token in minutes; a new one is requested shortly before it runs out
+TOKEN_EXPIRATION = 120
+TOKEN_RENEW_MARGIN = 300
+
+# Default number of jobs packaging/uploading and publishing at the same time
+DEFAULT_UPLOAD_JOBS = 2
+DEFAULT_PUBLISH_JOBS = 2
+
+# Item type of the uploaded source data
+FGDB_ITEM_TYPE = 'File Geodatabase'
+
+
+# One authenticated connection to a portal, shared by every job of a run
+class PortalSession:
+    def __init__(self, username, password, portal_url=PORTAL_URL, log=print):
+        self.portal_url = portal_url
+        self.log = log
+        self._password = password
+        self.gis = GIS(portal_url, username, password)
+        self.user = self.gis.users.me
+        self.username = self.user.username
+        self._token = None
+        self._token_expires = 0
+        self._folders = None
+        self._items = {}
+        self._lock = threading.Lock()
+        # Held while an index is first built, so concurrent jobs wait for one scan instead of each making one
+        self._index_lock = threading.Lock()
+
+    # Function to get a valid token, requesting a new one when the current one is about to expire
+    def token(self):
+        with self._lock:
+            if self._token is None or time.time() > self._token_expires - TOKEN_RENEW_MARGIN:
+                self._token = chunked_upload.generate_token(self.portal_url, self.username, self._password,
+                                                            expiration=TOKEN_EXPIRATION)
+                self._token_expires = time.time() + TOKEN_EXPIRATION * 60
+            return self._token
+
+    # Function to read the user's folders into the title index
+    def refresh_folders(self):
+        folders = {folder['title']: folder for folder in self.user.folders}
+        with self._lock:
+            self._folders = folders
+        self.log(f"Indexed {len(folders)} folder(s) of {self.username}")
+        return folders
+
+    # Function to look up a folder by title; the index is re-read once before giving up
+    # An empty name means the user's root folder (returns None)
+    def folder(self, title):
+        if not title:
+            return None
+        with self._index_lock:
+            folders = self._folders if self._folders is not None else self.refresh_folders()
+        if title not in folders:
+            folders = self.refresh_folders()
+        if title not in folders:
+            raise ValueError(f"Folder '{title}' not found.")
+        return folders[title]
+
+    # Function to read the items of one folder (None for the root folder) into the item index
+    def refresh_items(self, folder=None):
+        folder_id = folder['id'] if folder else None
+        items = {}
+        for item in self.user.items(folder=folder['title'] if folder else None, max_items=10000):
+            items[(item.title, item.type)] = item
+        with self._lock:
+            self._items[folder_id] = items
+        return items
+
+    # Function to look up an item by title and type in a folder; the folder's index is built on first use
+    def find_item(self, title, item_type, folder=None):
+        folder_id = folder['id'] if folder else None
+        with self._index_lock:
+            items = self._items.get(folder_id)
+            if items is None:
+                items = self.refresh_items(folder)
+        return items.get((title, item_type))
+
+    # Function to add or replace an item in the index after it was uploaded or published
+    def remember(self, item, folder=None):
+        with self._lock:
+            items = self._items.get(folder['id'] if folder else None)
+            if items is not None:
+                items[(item.title, item.type)] = item
+
+    # Function to build a multipart upload endpoint for a folder with this session's token
+    def upload_endpoint(self, folder=None):
+        return chunked_upload.ArcGISUploadEndpoint(self.portal_url, self.username, self.token,
+                                                   folder['id'] if folder else None)
+
+
+# Function to load publish jobs from a CSV or JSON file
+def load_publish_jobs(path):
+    with open(path, newline='') as f:
+        if path.lower().endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+        row = {key.strip().lower(): value for key, value in row.items() if key}
+        if not row.get('gdb') or not row.get('name'):
+            raise ValueError(f"Job {number} in {path} needs at least a gdb and a name")
+        if row['name'] in seen:
+            raise ValueError(f"Job {number} in {path} repeats name '{row['name']}'")
+        seen.add(row['name'])
+        jobs.append({'gdb': row['gdb'], 'name': row['name'], 'folder': (row.get('folder') or '').strip()})
+    return jobs
+
+
+# Function to build the item properties of a job's uploaded geodatabase
+def item_properties(job):
+    return {
+        'type': FGDB_ITEM_TYPE,
+        'tags': 'sometag',
+        'title': job['name'],  # Use the user-defined name for the item
+    }
+
+
+# Function to build the publish parameters of a job
+def publish_parameters(job):
+    return {
+        "hasStaticData": 'true',
+        "name": job['name'],
+        "maxRecordCount": 2000,
+        "layerInfo": {"capabilities": "Query"}
+    }
+
+
+# Function to package a job's geodatabase and upload it; returns the id of the uploaded item
+# An existing geodatabase item with the same title in the folder is updated rather than duplicated
+def upload_job(session, job, log=print):
+    with run_metrics.span('upload', job=job['name']) as upload_span:
+        item_id, sent_bytes = _upload_job(session, job, log)
+        upload_span.add(bytes=sent_bytes)
+    return item_id
+
+
+# Function doing the work of upload_job; returns the item id and the number of bytes sent
+def _upload_job(session, job, log):
+    fgdb_path = job['gdb']
+    if not os.path.exists(fgdb_path):
+        raise ValueError(f"Geodatabase path not found: {fgdb_path}")
+    zip_path = os.path.join(os.path.dirname(os.path.abspath(fgdb_path)), f"{job['name']}.zip")
+
+    folder = session.folder(job['folder'])
+    existing = session.find_item(job['name'], FGDB_ITEM_TYPE, folder)
+    if existing is not None:
+        log(f"{job['name']}: updating existing item {existing.id}")
+
+    # Start the chunked upload first, so finished parts go out while the geodatabase is still being packaged;
+    # the journal next to the zip lets an interrupted upload resume with the missing parts
+    upload = chunked_upload.ChunkedUpload(
+        session.upload_endpoint(folder), f"{zip_path}.upload.json", os.path.basename(zip_path),
+        item_properties(job), log=log, item_id=existing.id if existing is not None else None,
+    )
+    upload.begin()
+    try:
+        # The archive is only rebuilt when the geodatabase changed, and then only the changed files are compressed
+        # (parts go out while packaging runs, so the package span also covers most of the upload)
+        with run_metrics.span('package') as package_span:
+            package = gdb_packager.package_gdb(fgdb_path, zip_path, log=log, sink=upload.feed)
+            package_span.add(bytes=package['size'], files=package['members'], compressed=package['compressed'],
+                             stored=package['stored'])
+        if package['rebuilt']:
+            log(f"{job['name']}: zipped at {zip_path} "
+                f"({package['compressed']} file(s) compressed, {package['stored']} stored, {package['reused']} reused)")
+        else:
+            log(f"{job['name']}: geodatabase unchanged since the last package; reusing {zip_path}")
+            upload.feed_file(zip_path)
+    except Exception:
+        upload.close()
+        raise
+    with run_metrics.span('upload_commit') as commit_span:
+        item_id = upload.finish()
+        commit_span.add(parts=upload.uploaded, resumed_parts=upload.skipped)
+    return item_id, upload.sent_bytes
+
+
+# Function to publish an uploaded geodatabase item; returns the published item
+def publish_job(session, job, item_id, log=print):
+    folder = session.folder(job['folder'])
+    fgdb_item = session.gis.content.get(item_id)
+    session.remember(fgdb_item, folder)
+    log(f"{job['name']}: uploaded item {fgdb_item.title} (Type: {fgdb_item.type}); publishing...")
+    with run_metrics.span('publish', job=job['name']):
+        published = fgdb_item.publish(publish_parameters=publish_parameters(job), file_type='filegeodatabase', overwrite=True)
+    session.remember(published, folder)
+    return published
+
+
+# Function to run publish jobs as overlapping upload and publish stages
+# log(message) is called as each job moves on; results come back in job order
+def run_publish_jobs(session, jobs, upload_workers=DEFAULT_UPLOAD_JOBS, publish_workers=DEFAULT_PUBLISH_JOBS, log=print):
+    started = [time.time()] * len(jobs)
+    results = [None] * len(jobs)
+
+    def result(index, status, item_id=None, service_id=None, error=None):
+        job = jobs[index]
+        return {
+            'name': job['name'], 'gdb': job['gdb'], 'folder': job['folder'], 'status': status,
+            'item_id': item_id, 'service_id': service_id, 'error': error,
+            'seconds': round(time.time() - started[index], 3),
+        }
+
+    def timed_upload(index):
+        started[index] = time.time()
+        return upload_job(session, jobs[index], log)
+
+    with ThreadPoolExecutor(max_workers=max(1, publish_workers)) as publisher:
+        publish_futures = {}
+        with ThreadPoolExecutor(max_workers=max(1, upload_workers)) as uploader:
+            upload_futures = {uploader.submit(timed_upload, index): index for index in range(len(jobs))}
+            for future in as_completed(upload_futures):
+                index = upload_futures[future]
+                try:
+                    item_id = future.result()
+                except Exception as e:
+                    results[index] = result(index, 'failed', error=str(e))
+                    log(f"Error: {jobs[index]['name']} failed to upload: {e}")
+                    continue
+                publish_futures[publisher.submit(publish_job, session, jobs[index], item_id, log)] = (index, item_id)
+
+        for done, future in enumerate(as_completed(publish_futures), start=1):
+            index, item_id = publish_futures[future]
+            try:
+                published = future.result()
+                results[index] = result(index, 'published', item_id, published.id)
+                log(f"[Finished] {jobs[index]['name']} published ({done}/{len(publish_futures)})")
+            except Exception as e:
+                results[index] = result(index, 'failed', item_id, error=str(e))
+                log(f"Error: {jobs[index]['name']} failed to publish: {e}")
+    return results
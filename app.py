@@ -1,44 +1,67 @@
-import requests
-import subprocess
-import threading
+import json
 import os
-from flask import Flask, render_template, redirect, url_for
+import job_scheduler
+import script_cache
+import warm_pool
+from flask import Flask, Response, abort, jsonify, render_template, redirect, request, url_for
 
 app = Flask(__name__)
 
 # Base URL for raw content of scripts in the GitHub repository (main branch)
 GITHUB_REPO = "https://raw.githubusercontent.com/Gedco45/ArcBridge.github.io/main/"
 
-# Directory where scripts will be temporarily stored
+# Directory where scripts fetched from GitHub are cached
 TEMP_SCRIPT_DIR = "Scripts"
 
-# Ensure the Scripts directory exists locally (temporary storage for scripts fetched from GitHub)
-os.makedirs(TEMP_SCRIPT_DIR, exist_ok=True)
+# Helper modules imported by each script, fetched alongside it
+SCRIPT_DEPENDENCIES = {
+    "API_to_GDB.py": ["http_client.py", "feature_stream.py", "geometry_engine.py", "rest_engine.py", "run_metrics.py", "query_profile.py", "pbf_features.py", "output_sinks.py", "disk_cache.py", "service_catalog.py"],
+    "Rastertool.py": ["http_client.py", "disk_cache.py", "raster_tiles.py", "raster_batch.py"],
+    "GDB_to_AGOL3.py": ["http_client.py", "gdb_packager.py", "chunked_upload.py", "agol_publish.py", "run_metrics.py"],
+}
 
-# Function to fetch and save a script from GitHub
+# Scripts are revalidated against GitHub with their ETag, and the cached copy is used when GitHub is unreachable
+scripts = script_cache.ScriptCache(GITHUB_REPO, TEMP_SCRIPT_DIR)
+
+# Python processes with the heavy imports already loaded, waiting for a script to run;
+# their output is piped back so it can be streamed to the page
+workers = warm_pool.WarmPool(job_scheduler.DEFAULT_MAX_RUNNING, capture_output=True)
+
+# Queue of script runs, at most DEFAULT_MAX_RUNNING at a time
+scheduler = job_scheduler.JobScheduler()
+
+# Function to fetch a script from GitHub (or the local cache) and return its local path
 def fetch_script_from_github(script_name):
-    url = f"{GITHUB_REPO}{script_name}"
-    local_script_path = f"{TEMP_SCRIPT_DIR}/{script_name}"
-
-    # Download the script from GitHub if not already present or if we want the latest version
-    response = requests.get(url)
-
-    # Check if request is successful
-    if response.status_code == 200:
-        with open(local_script_path, 'wb') as f:
-            f.write(response.content)
-        print(f"{script_name} downloaded successfully from GitHub.")
-        return local_script_path
-    else:
-        print(f"Failed to download {script_name} from GitHub.")
-        return None
+    return scripts.fetch(script_name)
 
-# Function to run the script (generic function for all scripts)
-def run_script(script_name):
+# Function to fetch a script with its helpers and start it on a warm worker (run by the scheduler)
+def start_script(script_name, job):
+    for dependency in SCRIPT_DEPENDENCIES.get(script_name, []):
+        if not fetch_script_from_github(dependency):
+            raise RuntimeError(f"Failed to fetch {dependency}")
     script_path = fetch_script_from_github(script_name)
-    if script_path:
-        # Run the script in a new thread to not block the Flask server
-        threading.Thread(target=lambda: subprocess.run(["python", script_path])).start()
+    if not script_path:
+        raise RuntimeError(f"Failed to fetch {script_name}")
+    job.output(f"Starting {script_name}...")
+    return workers.run(script_path)
+
+# Function to queue the script (generic function for all scripts); returns the job, or None when the queue is full
+def run_script(script_name, priority=job_scheduler.DEFAULT_PRIORITY):
+    try:
+        return scheduler.submit(script_name, lambda job: start_script(script_name, job), priority)
+    except job_scheduler.QueueFull as e:
+        app.logger.warning("Not starting %s: %s", script_name, e)
+        return None
+
+# Function to answer a run request: the job as JSON for the page's script, a redirect for plain form posts
+# A full queue is answered with a 503 error body either way, so a form post doesn't look like it started a job
+def job_started(script_name):
+    job = run_script(script_name, request.args.get('priority', job_scheduler.DEFAULT_PRIORITY, type=int))
+    if job is None:
+        return jsonify({'error': 'Too many jobs are waiting; try again later'}), 503
+    if request.args.get('format') != 'json':
+        return redirect(url_for('home'))
+    return jsonify(job.to_dict()), 202
 
 # Route for the home page
 @app.route('/')
@@ -48,20 +71,52 @@ def home():
 # Route to start the first script (API to GDB)
 @app.route('/run_script1')
 def run_script1():
-    run_script("API_to_GDB.py")
-    return redirect(url_for('home'))
+    return job_started("API_to_GDB.py")
 
 # Route to start the second script (GDB to AGOL)
 @app.route('/run_script2')
 def run_script2():
-    run_script("GDB_to_AGOL.py")
-    return redirect(url_for('home'))
+    return job_started("GDB_to_AGOL3.py")
 
 # Route to start the third script (Raster Tool)
 @app.route('/run_script3')
 def run_script3():
-    run_script("Rastertool.py")
-    return redirect(url_for('home'))
+    return job_started("Rastertool.py")
+
+# Route listing every known job with its state, exit code and duration
+@app.route('/jobs')
+def list_jobs():
+    return jsonify([job.to_dict() for job in scheduler.jobs()])
+
+# Route returning one job's state
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    job = scheduler.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+# Route streaming a job's output ('output' events) and state changes ('state' events) as server-sent events
+@app.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+    job = scheduler.get(job_id)
+    if job is None:
+        abort(404)
+    since = request.args.get('since', 0, type=int)
+
+    def events():
+        for event in job.follow(since):
+            if event is None:
+                yield ": keep-alive\n\n"
+            elif event[0] == 'line':
+                yield f"event: output\ndata: {json.dumps(event[1])}\n\n"
+            else:
+                yield f"event: state\ndata: {json.dumps(event[1])}\n\n"
+
+    return Response(events(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
 if __name__ == '__main__':
+    # Warm the workers in the process that serves requests (not in the debug reloader's watcher)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        workers.fill()
     app.run(debug=True)
@@ -0,0 +1,388 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import chunked_upload
+import gdb_packager
+import http_client
+import mock_arcgis_server
+import raster_batch
+import raster_tiles
+import rest_engine
+import run_metrics
+import service_catalog
+from geometry_engine import add_measures
+
+# Reproducible benchmarks for the ArcBridge pipelines, run against a local mock ArcGIS server.
+# The harness starts mock_arcgis_server with fixed seeds and runs every scenario in a fresh
+# Python process, so each run's peak memory is its own. A scenario reports its throughput,
+# the latency percentiles of its HTTP requests (time to response headers) and its peak RSS.
+# Results are written as a JSON baseline; --compare checks a run against an earlier baseline
+# and exits with status 1 when throughput or memory regressed by more than --tolerance.
+#
+#   python benchmarks.py --out baseline.json
+#   python benchmarks.py --scenario download_json download_pbf --compare baseline.json
+#   python benchmarks.py --features 200000 --latency 0.05 --error-rate 0.01 --out slow_server.json
+
+# Prefix of the line a scenario process prints its result on
+RESULT_PREFIX = 'BENCH_RESULT '
+
+# Default size of the synthetic workload
+DEFAULTS = {
+    'features': 20000,
+    'geometry': 'polygon',
+    'vertices': 32,
+    'parts': 1,
+    'fields': 8,
+    'page_size': 2000,
+    'latency': 0.0,
+    'jitter': 0.0,
+    'error_rate': 0.0,
+    'images': 16,
+    'image_size': 1024,
+    'mosaic_size': 4096,
+    'package_mb': 64,
+    'seed': 42,
+}
+
+# Throughput or memory changes past this share count as regressions in --compare
+DEFAULT_TOLERANCE = 0.10
+
+
+# Function to log scenario progress to stderr so stdout stays free for the result
+def log_to_stderr(message, level="INFO"):
+    print(f"[{level}] {message}", file=sys.stderr, flush=True)
+
+
+# Function to process the synthetic layer into a GeoPackage (download, decode, measures and insert)
+def bench_download(config, workdir, transport):
+    output = os.path.join(workdir, f'download_{transport}.gpkg')
+    result = rest_engine.process_layer(0, 'Bench', output, config['feature_service'], staging_dir=workdir,
+                                       service_units='esriMeters', transport=transport)
+    if result['status'] != 'done':
+        raise RuntimeError(f"Layer ended {result['status']}: {result['error']}")
+    return {'items': result['features'], 'bytes': os.path.getsize(output)}
+
+
+# Function to stream the synthetic layer into an Esri JSON staging file
+def bench_staging(config, workdir):
+    url = config['feature_service']
+    metadata = service_catalog.get_catalog().layer_definition(url, 0)
+    params = {'where': '1=1', 'outFields': '*', 'returnGeometry': True, 'f': 'json'}
+    json_path = os.path.join(workdir, 'staging.json')
+    feature_count, _ = rest_engine.download_features_to_file(f'{url}/0/query', params, metadata, json_path)
+    return {'items': feature_count, 'bytes': os.path.getsize(json_path)}
+
+
+# Function to time area and length computation over pages of the synthetic layer (generation is not timed)
+def bench_geometry(config, workdir):
+    layer = mock_arcgis_server.LayerSpec(0, 'Bench', config['geometry'], config['features'], config['vertices'],
+                                         config['parts'], config['fields'], seed=config['seed'])
+    page_size = config['page_size']
+    pages = [layer.feature_set(range(start, min(start + page_size, layer.features + 1)))
+             for start in range(1, layer.features + 1, page_size)]
+    started = time.perf_counter()
+    for page in pages:
+        add_measures(page, 1.0)
+    return {'items': layer.features, 'seconds': time.perf_counter() - started}
+
+
+# Function to run a batch of single-image exports
+def bench_raster_export(config, workdir):
+    size = config['image_size']
+    extent = mock_arcgis_server.EXTENT
+    jobs = [
+        {'name': f'bench{index}', 'layers': '', 'format': 'PNG', 'size': f'{size},{size}', 'bbox_sr': '3857',
+         'bbox': [extent['xmin'] + index, extent['ymin'], extent['xmax'] + index, extent['ymax']], 'resolution': None}
+        for index in range(config['images'])
+    ]
+    folder = os.path.join(workdir, 'exports')
+    results = raster_batch.run_export_jobs(f"{config['map_service']}/export", jobs, folder, log=log_to_stderr)
+    failed = [result for result in results if result['status'] != 'done']
+    if failed:
+        raise RuntimeError(f"{len(failed)} export(s) failed: {failed[0]['error']}")
+    return {'items': len(results), 'bytes': sum(os.path.getsize(result['path']) for result in results)}
+
+
+# Function to run a tiled mosaic export (needs Pillow)
+def bench_raster_tiled(config, workdir):
+    if raster_tiles.Image is None:
+        return {'skipped': 'Pillow is not installed'}
+    extent = mock_arcgis_server.EXTENT
+    resolution = (extent['xmax'] - extent['xmin']) / config['mosaic_size']
+    out_path = os.path.join(workdir, 'mosaic.tif')
+    _, _, width, height = raster_tiles.export_tiled(
+        f"{config['map_service']}/export", '', (extent['xmin'], extent['ymin'], extent['xmax'], extent['ymax']),
+        '3857', resolution, out_path, max_tile_size=1024)
+    return {'items': width * height, 'bytes': os.path.getsize(out_path)}
+
+
+# Function to build a synthetic file geodatabase folder: compressible tables and incompressible blobs
+def make_geodatabase(folder, size_mb, seed):
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    remaining = size_mb * 1024 * 1024
+    index = 0
+    while remaining > 0:
+        size = min(remaining, rng.choice((256 * 1024, 1024 * 1024, 4 * 1024 * 1024)))
+        with open(os.path.join(folder, f'a{index:08x}.gdbtable'), 'wb') as f:
+            if index % 3 == 2:
+                f.write(rng.randbytes(size))
+            else:
+                record = b''.join(f'{rng.randrange(10 ** 9):>12}|FEATURE|{rng.random():.6f}\n'.encode() for _ in range(64))
+                f.write((record * (size // len(record) + 1))[:size])
+        remaining -= size
+        index += 1
+    return folder
+
+
+# Function to time packaging a geodatabase into a zip from scratch (building the geodatabase is not timed)
+def bench_packaging(config, workdir):
+    fgdb = make_geodatabase(os.path.join(workdir, 'bench.gdb'), config['package_mb'], config['seed'])
+    started = time.perf_counter()
+    package = gdb_packager.package_gdb(fgdb, os.path.join(workdir, 'bench.zip'), log=log_to_stderr)
+    return {'items': package['members'], 'bytes': config['package_mb'] * 1024 * 1024, 'seconds': time.perf_counter() - started}
+
+
+# Function to time packaging with the archive streamed to a chunked upload, as the publisher does
+def bench_package_upload(config, workdir):
+    fgdb = make_geodatabase(os.path.join(workdir, 'bench.gdb'), config['package_mb'], config['seed'])
+    zip_path = os.path.join(workdir, 'bench.zip')
+    started = time.perf_counter()
+    token = chunked_upload.generate_token(config['portal'], 'bench', 'bench')
+    endpoint = chunked_upload.ArcGISUploadEndpoint(config['portal'], 'bench', token)
+    upload = chunked_upload.ChunkedUpload(endpoint, f'{zip_path}.upload.json', 'bench.zip',
+                                          {'title': 'bench', 'type': 'File Geodatabase'}, log=log_to_stderr)
+    upload.begin()
+    try:
+        package = gdb_packager.package_gdb(fgdb, zip_path, log=log_to_stderr, sink=upload.feed)
+    except Exception:
+        upload.close()
+        raise
+    upload.finish()
+    return {'items': package['members'], 'bytes': config['package_mb'] * 1024 * 1024, 'seconds': time.perf_counter() - started}
+
+
+# Scenario name -> (function, description)
+SCENARIOS = {
+    'download_json': (lambda config, workdir: bench_download(config, workdir, 'json'),
+                      "features/s into a GeoPackage over f=json"),
+    'download_pbf': (lambda config, workdir: bench_download(config, workdir, 'pbf'),
+                     "features/s into a GeoPackage over f=pbf"),
+    'staging': (bench_staging, "features/s streamed into an Esri JSON staging file"),
+    'geometry': (bench_geometry, "features/s through area/length computation"),
+    'raster_export': (bench_raster_export, "images/s from MapServer export"),
+    'raster_tiled': (bench_raster_tiled, "pixels/s into a tiled TIFF mosaic"),
+    'packaging': (bench_packaging, "MB/s zipping a geodatabase"),
+    'package_upload': (bench_package_upload, "MB/s zipping while uploading in parts"),
+}
+
+
+# Function to time the HTTP requests a scenario makes (until the response headers arrive)
+def record_request_latency():
+    timings = []
+    send = http_client.request
+
+    def timed_request(method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            return send(method, url, **kwargs)
+        finally:
+            timings.append(time.perf_counter() - started)
+
+    http_client.request = timed_request
+    return timings
+
+
+# Function run in the scenario process: run one scenario and print its measurements
+def run_child(name, config, workdir):
+    rest_engine.set_log_handler(log_to_stderr)
+    service_catalog.set_catalog(service_catalog.ServiceCatalog(os.path.join(workdir, 'catalog')))
+    timings = record_request_latency()
+    function = SCENARIOS[name][0]
+    started = time.perf_counter()
+    measured = function(config, workdir)
+    measured.setdefault('seconds', time.perf_counter() - started)
+    measured['latencies'] = timings
+    measured['peak_rss'] = run_metrics.peak_rss()
+    print(RESULT_PREFIX + json.dumps(measured), flush=True)
+
+
+# Function to run one scenario in a fresh process; returns its measurements
+def run_scenario_process(name, config):
+    workdir = tempfile.mkdtemp(prefix=f'arcbridge_bench_{name}_')
+    try:
+        completed = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--child', name, '--config', json.dumps(config), '--workdir', workdir],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Scenario {name} failed (exit code {completed.returncode}): {completed.stderr.strip()[-2000:]}")
+
+
+# Function to read a percentile from sorted values
+def percentile(values, share):
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, round(share * (len(values) - 1))))
+    return values[index]
+
+
+# Function to combine the runs of a scenario into its baseline entry (medians across runs)
+def summarize(runs, server_stats):
+    seconds = [run['seconds'] for run in runs]
+    median_seconds = statistics.median(seconds)
+    items = runs[-1]['items']
+    size = runs[-1].get('bytes', 0)
+    latencies = sorted(latency * 1000 for run in runs for latency in run['latencies'])
+    peaks = [run['peak_rss'] for run in runs if run.get('peak_rss')]
+    return {
+        'runs': len(runs),
+        'seconds': round(median_seconds, 4),
+        'seconds_min': round(min(seconds), 4),
+        'seconds_max': round(max(seconds), 4),
+        'items': items,
+        'items_per_second': round(items / median_seconds, 2) if median_seconds else None,
+        'bytes': size,
+        'mb_per_second': round(size / 1024 ** 2 / median_seconds, 3) if median_seconds and size else None,
+        'requests': len(latencies) // len(runs),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 3) if latencies else None,
+            'p90': round(percentile(latencies, 0.90), 3) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 3) if latencies else None,
+            'max': round(latencies[-1], 3) if latencies else None,
+        },
+        'peak_rss_mb': round(max(peaks) / 1024 ** 2, 1) if peaks else None,
+        'server': server_stats,
+    }
+
+
+# Function to run the selected scenarios against a fresh mock server and build the baseline document
+def run_benchmarks(names, config, repeat=3, warmup=1, log=log_to_stderr):
+    layer = mock_arcgis_server.LayerSpec(0, 'Bench', config['geometry'], config['features'], config['vertices'],
+                                         config['parts'], config['fields'], config['page_size'], seed=config['seed'])
+    server = mock_arcgis_server.MockArcGISServer([layer], config['latency'], config['jitter'], config['error_rate'],
+                                                 seed=config['seed'])
+    results = {}
+    with server:
+        config = dict(config, feature_service=server.service_url('FeatureServer'),
+                      map_service=server.service_url('MapServer'), portal=server.url)
+        for name in names:
+            log(f"{name}: {SCENARIOS[name][1]}")
+            try:
+                # Warm-up runs fill the server's response cache, so timed runs measure the client
+                for _ in range(warmup):
+                    run_scenario_process(name, config)
+                server.reset_stats()
+                runs = []
+                for number in range(repeat):
+                    runs.append(run_scenario_process(name, config))
+                    if runs[-1].get('skipped'):
+                        break
+                    log(f"  run {number + 1}/{repeat}: {runs[-1]['seconds']:.3f}s")
+            except RuntimeError as e:
+                log(str(e), "ERROR")
+                results[name] = {'error': str(e)}
+                continue
+            if runs[-1].get('skipped'):
+                log(f"  skipped: {runs[-1]['skipped']}", "WARNING")
+                results[name] = {'skipped': runs[-1]['skipped']}
+                continue
+            stats = server.stats()
+            results[name] = summarize(runs, {key: value // len(runs) for key, value in stats.items()})
+
+    return {
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'host': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'config': {key: config[key] for key in DEFAULTS},
+        'repeat': repeat,
+        'scenarios': results,
+    }
+
+
+# Function to compare a run with a baseline; returns (lines of the report, regressions)
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    lines = []
+    regressions = []
+    if current['config'] != baseline.get('config'):
+        lines.append("Note: the workload differs from the baseline's; the numbers are not directly comparable")
+    lines.append(f"{'scenario':<16}{'items/s':>14}{'baseline':>14}{'change':>9}{'p90 ms':>10}{'peak MB':>10}{'change':>9}")
+    for name, entry in current['scenarios'].items():
+        old = (baseline.get('scenarios') or {}).get(name)
+        if 'items_per_second' not in entry or not old or not old.get('items_per_second'):
+            lines.append(f"{name:<16}{'(no comparison)':>14}")
+            continue
+        speed_change = entry['items_per_second'] / old['items_per_second'] - 1
+        memory_change = (entry['peak_rss_mb'] / old['peak_rss_mb'] - 1) if entry.get('peak_rss_mb') and old.get('peak_rss_mb') else 0.0
+        lines.append(f"{name:<16}{entry['items_per_second']:>14.1f}{old['items_per_second']:>14.1f}{speed_change:>+9.1%}"
+                     f"{entry['latency_ms']['p90'] or 0:>10.2f}{entry['peak_rss_mb'] or 0:>10.1f}{memory_change:>+9.1%}")
+        if speed_change < -tolerance:
+            regressions.append(f"{name}: throughput {speed_change:+.1%}")
+        if memory_change > tolerance:
+            regressions.append(f"{name}: peak memory {memory_change:+.1%}")
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ArcBridge pipelines against a local mock ArcGIS server.")
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), help="scenarios to run (default: all)")
+    parser.add_argument('--out', help="write the results to this JSON baseline file (default: stdout)")
+    parser.add_argument('--compare', help="baseline file to compare the results with")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="share of lost throughput or extra memory reported as a regression")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per scenario (the median is reported)")
+    parser.add_argument('--warmup', type=int, default=1, help="untimed runs per scenario before the timed ones")
+    for key, value in DEFAULTS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value, help=f"default: {value}")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--config', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        run_child(args.child, json.loads(args.config), args.workdir)
+        return 0
+
+    config = {key: getattr(args, key) for key in DEFAULTS}
+    results = run_benchmarks(args.scenario or list(SCENARIOS), config, max(1, args.repeat), max(0, args.warmup))
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+        log_to_stderr(f"Results written to {args.out}")
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+    failed = [name for name, entry in results['scenarios'].items() if 'error' in entry]
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline, args.tolerance)
+        for line in lines:
+            print(line, file=sys.stderr)
+        for regression in regressions:
+            log_to_stderr(f"Regression: {regression}", "WARNING")
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+
+# Chunked, resumable item uploads for ArcGIS Online / Portal.
+# A file is added as a multipart item (addItem with multipart=true), sent as numbered
+# parts (addPart) several at a time, and committed once every part is in. A journal
+# next to the file records the item id and the hash of each part that made it, so a
+# run that was interrupted resumes with the parts that are still missing. Parts can
+# be fed while the file is still being written, e.g. straight from the packager.
+
+# Size of each uploaded part
+PART_SIZE = 16 * 1024 * 1024
+
+# Default number of parts uploaded at the same time
+DEFAULT_UPLOAD_WORKERS = 4
+
+# The sharing API accepts at most this many parts per item
+MAX_PARTS = 10000
+
+# How long to wait for the portal to finish assembling a committed item
+COMMIT_TIMEOUT = 3600
+COMMIT_POLL_INTERVAL = 2
+
+
+# Function to get a token for a portal with a username and password
+# The token is bound to the referer, so every call made with it must send the same Referer header
+def generate_token(portal_url, username, password, expiration=120, referer=None):
+    response = http_client.post(
+        f"{portal_url.rstrip('/')}/sharing/rest/generateToken",
+        data={
+            'username': username,
+            'password': password,
+            'client': 'referer',
+            'referer': referer or portal_url,
+            'expiration': expiration,
+            'f': 'json',
+        },
+    )
+    data = response.json()
+    if 'token' not in data:
+        raise RuntimeError(f"Token request failed: {data.get('error', {}).get('message', data)}")
+    return data['token']
+
+
+# Multipart upload calls of the sharing REST API for one user (and optionally one folder)
+# Anything with the same methods can stand in for it, e.g. a local test server
+# token is a string, or a callable returning a current one for sessions that outlive a token;
+# referer must match the one the token was generated for (generate_token uses the portal URL)
+class ArcGISUploadEndpoint:
+    def __init__(self, portal_url, username, token, folder_id=None, referer=None):
+        self.rest_url = f"{portal_url.rstrip('/')}/sharing/rest"
+        self.username = username
+        self.token = token
+        self.folder_id = folder_id
+        self.referer = referer or portal_url
+
+    # Function to get the token for the next call
+    def _token(self):
+        return self.token() if callable(self.token) else self.token
+
+    # Function to build a URL under the user's content
+    def _url(self, *path):
+        return '/'.join([self.rest_url, 'content', 'users', self.username] + [part for part in path if part])
+
+    # Function to make a call and raise on errors reported in the JSON body
+    # The Referer header is what the portal checks a referer-bound token against
+    def _call(self, method, url, **kwargs):
+        response = http_client.request(method, url, headers={'Referer': self.referer}, **kwargs)
+        try:
+            data = response.json()
+        except ValueError:
+            raise RuntimeError(f"Unexpected response from {url} (Status Code: {response.status_code})")
+        if 'error' in data or data.get('success') is False:
+            error = data.get('error', data)
+            raise RuntimeError(f"Upload request failed: {error.get('message', error) if isinstance(error, dict) else error}")
+        return data
+
+    # Function to create an empty multipart item and return its id
+    def add_item(self, filename, properties):
+        data = dict(properties, multipart='true', filename=filename, f='json', token=self._token())
+        return self._call('post', self._url(self.folder_id, 'addItem'), data=data)['id']
+
+    # Function to start replacing an existing item's file with a multipart upload
+    def update_item(self, item_id, filename, properties):
+        data = dict(properties, multipart='true', filename=filename, f='json', token=self._token())
+        self._call('post', self._url('items', item_id, 'update'), data=data)
+
+    # Function to upload one part (numbered from 1)
+    # Sending a part number again replaces that part, so parts are retried like idempotent requests
+    def add_part(self, item_id, part_number, data):
+        self._call(
+            'post', self._url('items', item_id, 'addPart'),
+            data={'partNum': part_number, 'f': 'json', 'token': self._token()},
+            files={'file': (f'part{part_number}', data, 'application/octet-stream')},
+            idempotent=True,
+        )
+
+    # Function to assemble the uploaded parts into the item
+    def commit(self, item_id, properties):
+        data = dict(properties, f='json', token=self._token())
+        self._call('post', self._url('items', item_id, 'commit'), data=data)
+
+    # Function to read an item's upload status ('partial', 'processing', 'completed' or 'failed')
+    def status(self, item_id):
+        return self._call('get', self._url('items', item_id, 'status'), params={'f': 'json', 'token': self._token()})
+
+
+# A resumable multipart upload; feed() the bytes in order, then finish()
+# With an item_id the upload replaces that item's file instead of adding a new item
+class ChunkedUpload:
+    def __init__(self, endpoint, journal_path, filename, item_properties,
+                 part_size=PART_SIZE, max_workers=DEFAULT_UPLOAD_WORKERS, log=print, item_id=None):
+        self.endpoint = endpoint
+        self.item_id = item_id
+        self.journal_path = journal_path
+        self.filename = filename
+        self.item_properties = item_properties
+        self.part_size = part_size
+        self.max_workers = max(1, max_workers)
+        self.log = log
+        self.journal = None
+        self.uploaded = 0
+        self.skipped = 0
+        self.sent_bytes = 0
+        self._buffer = bytearray()
+        self._next_part = 1
+        self._futures = []
+        self._error = None
+        self._lock = threading.Lock()
+        # One part waiting per worker at most, so memory stays at a few parts
+        self._slots = threading.BoundedSemaphore(self.max_workers * 2)
+        self._executor = None
+
+    # Function to write the journal atomically
+    def _save_journal(self):
+        temp_path = f"{self.journal_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.journal, f)
+        os.replace(temp_path, self.journal_path)
+
+    # Function to resume the journaled item, or create (or start updating) one
+    def begin(self):
+        try:
+            with open(self.journal_path) as f:
+                journal = json.load(f)
+        except (OSError, ValueError):
+            journal = None
+
+        if (journal and journal.get('part_size') == self.part_size and journal.get('filename') == self.filename
+                and self.item_id in (None, journal['item_id'])):
+            try:
+                self.endpoint.status(journal['item_id'])
+                self.journal = journal
+                self.log(f"Resuming upload of item {journal['item_id']} ({len(journal['parts'])} part(s) already uploaded)")
+            except Exception as e:
+                self.log(f"Previous upload of item {journal['item_id']} can't be resumed ({e}); starting over")
+
+        if self.journal is None:
+            if self.item_id is not None:
+                self.endpoint.update_item(self.item_id, self.filename, self.item_properties)
+                item_id = self.item_id
+            else:
+                item_id = self.endpoint.add_item(self.filename, self.item_properties)
+            self.journal = {'item_id': item_id, 'filename': self.filename, 'part_size': self.part_size, 'parts': {}}
+            self._save_journal()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self.journal['item_id']
+
+    # Function to add bytes to the upload; full parts are sent in the background
+    def feed(self, data):
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            part = bytes(self._buffer[:self.part_size])
+            del self._buffer[:self.part_size]
+            self._submit(part)
+
+    # Function to feed a whole file
+    def feed_file(self, path):
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.part_size), b''):
+                self.feed(chunk)
+
+    # Function to queue one part unless the journal shows it was already uploaded
+    def _submit(self, data):
+        part_number = self._next_part
+        self._next_part += 1
+        if part_number > MAX_PARTS:
+            raise RuntimeError(f"File needs more than {MAX_PARTS} parts; raise the part size")
+        digest = hashlib.sha256(data).hexdigest()
+        if self.journal['parts'].get(str(part_number)) == digest:
+            self.skipped += 1
+            return
+
+        # Stop feeding early if a part already failed
+        if self._error is not None:
+            raise self._error
+        self._slots.acquire()
+        future = self._executor.submit(self._upload_part, part_number, data, digest)
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+
+    # Function to upload a part and record it in the journal
+    def _upload_part(self, part_number, data, digest):
+        try:
+            self.endpoint.add_part(self.journal['item_id'], part_number, data)
+        except Exception as e:
+            self._error = self._error or e
+            raise
+        with self._lock:
+            self.journal['parts'][str(part_number)] = digest
+            self.uploaded += 1
+            self.sent_bytes += len(data)
+            self._save_journal()
+
+    # Function to send the last part, wait for all parts, and commit the item
+    # Returns the item id; on failure the journal is kept so the next run resumes
+    def finish(self):
+        try:
+            if self._buffer or self._next_part == 1:
+                self._submit(bytes(self._buffer))
+                self._buffer = bytearray()
+            for future in self._futures:
+                future.result()
+        finally:
+            self.close()
+
+        part_count = self._next_part - 1
+        stale = [number for number in self.journal['parts'] if int(number) > part_count]
+        if stale:
+            # The file shrank since the interrupted run; the item still holds parts past its new end
+            os.remove(self.journal_path)
+            raise RuntimeError("The file changed since the interrupted upload; run the upload again to start over")
+
+        item_id = self.journal['item_id']
+        self.log(f"All {part_count} part(s) uploaded ({self.uploaded} sent, {self.skipped} resumed); committing item {item_id}...")
+        self.endpoint.commit(item_id, self.item_properties)
+
+        deadline = time.time() + COMMIT_TIMEOUT
+        while True:
+            status = self.endpoint.status(item_id).get('status')
+            if status == 'completed':
+                break
+            if status == 'failed':
+                os.remove(self.journal_path)
+                raise RuntimeError(f"Portal failed to assemble item {item_id}")
+            if time.time() > deadline:
+                raise RuntimeError(f"Timed out waiting for item {item_id} to be assembled")
+            time.sleep(COMMIT_POLL_INTERVAL)
+
+        os.remove(self.journal_path)
+        return item_id
+
+    # Function to stop the upload threads (waits for parts in flight)
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
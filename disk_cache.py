@@ -0,0 +1,275 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlsplit, urlunsplit
+
+import http_client
+
+# Content-addressed on-disk cache for HTTP responses.
+# Each entry is stored as <key>.bin with a <key>.json sidecar holding its size and
+# validators (ETag / Last-Modified). Entries expire after an optional TTL and are
+# revalidated with conditional requests. An in-memory LRU index with a running byte
+# total (built once from the data files, whose modification time marks the last use)
+# decides when the least recently used entries are evicted past the size budget.
+# Entries being read are pinned, so eviction skips them until the reader is done.
+
+# Default size budget for a cache directory
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Size of the chunks streamed from the network into the cache
+CHUNK_SIZE = 1024 * 1024
+
+
+# Parameters (lowercase) whose values are lists of numbers or names, where spacing does not matter
+SPACE_INSENSITIVE_PARAMS = ('bbox', 'size', 'layers', 'outfields')
+
+
+# Function to normalize one parameter value; spaces inside values such as where or text are kept
+def _normalize_value(name, value):
+    value = str(value).strip()
+    if name in SPACE_INSENSITIVE_PARAMS:
+        value = value.replace(' ', '')
+    return value
+
+
+# Function to normalize a URL and its query parameters into a cache key
+# Parameter names are case-insensitive on ArcGIS REST
+def cache_key(url, params=None):
+    parts = urlsplit(url.strip())
+    normalized_url = urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path.rstrip('/'), parts.query, ''))
+    normalized_params = sorted(
+        (str(name).lower(), _normalize_value(str(name).lower(), value))
+        for name, value in (params or {}).items()
+        if value is not None
+    )
+    payload = json.dumps([normalized_url, normalized_params], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# On-disk cache with a size budget, LRU eviction and optional TTL
+class DiskCache:
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> size, least recently used first; None until the directory is first scanned
+        self._index = None
+        self._total = 0
+        # key -> number of readers holding the entry; pinned entries are never evicted
+        self._pins = {}
+        os.makedirs(directory, exist_ok=True)
+
+    # Function to get the data and metadata paths for a key
+    def _paths(self, key):
+        folder = os.path.join(self.directory, key[:2])
+        return os.path.join(folder, f"{key}.bin"), os.path.join(folder, f"{key}.json")
+
+    # Function to write an entry's metadata atomically
+    def _write_meta(self, meta_path, meta):
+        temp_path = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(temp_path, meta_path)
+
+    # Function to build the LRU index from the data files on disk (called with the lock held)
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+        entries = []
+        for folder, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.bin'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(folder, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-len('.bin')], stat.st_size))
+        self._index = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self._total = sum(self._index.values())
+        return self._index
+
+    # Function to return (data_path, metadata) for a key, or None on a miss; marks the entry as used
+    def lookup(self, key):
+        data_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            # The data file's modification time records the last use, so a hit costs no sidecar rewrite
+            os.utime(data_path)
+        except (OSError, ValueError):
+            return None
+        with self._lock:
+            index = self._load_index()
+            if key in index:
+                index.move_to_end(key)
+        return data_path, meta
+
+    # Function to tell whether an entry is still within its TTL (or max_age seconds, when given)
+    def is_fresh(self, meta, max_age=None):
+        ttl = self.ttl if max_age is None else max_age
+        if ttl is None:
+            return True
+        return time.time() - meta.get('validated_at', 0) < ttl
+
+    # Function to store an entry from an iterable of byte chunks; returns the data path
+    def store(self, key, chunks, meta=None):
+        data_path, meta_path = self._paths(key)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        temp_path = f"{data_path}.{uuid.uuid4().hex}.tmp"
+        size = 0
+        try:
+            with open(temp_path, 'wb') as f:
+                for chunk in chunks:
+                    if chunk:
+                        f.write(chunk)
+                        size += len(chunk)
+            now = time.time()
+            meta = dict(meta or {}, size=size, stored_at=now, validated_at=now)
+            with self._lock:
+                index = self._load_index()
+                os.replace(temp_path, data_path)
+                self._write_meta(meta_path, meta)
+                self._total += size - index.pop(key, 0)
+                index[key] = size
+                over_budget = self._total > self.max_bytes
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        if over_budget:
+            self.evict()
+        return data_path
+
+    # Function to record that an entry was revalidated with the server
+    def mark_validated(self, key, meta):
+        _, meta_path = self._paths(key)
+        meta = dict(meta, validated_at=time.time())
+        with self._lock:
+            self._write_meta(meta_path, meta)
+        return meta
+
+    # Function to remove one entry
+    def delete(self, key):
+        with self._lock:
+            if self._index is not None:
+                self._total -= self._index.pop(key, 0)
+        for path in self._paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    # Function to keep an entry from being evicted while the with block reads its data file
+    # Pins are counted, so concurrent readers of the same key each hold the entry
+    @contextmanager
+    def pinned(self, key):
+        with self._lock:
+            self._pins[key] = self._pins.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._pins[key] -= 1
+                if not self._pins[key]:
+                    del self._pins[key]
+                # Evictions skipped while the entry was pinned are caught up now
+                over_budget = self._index is not None and self._total > self.max_bytes
+            if over_budget:
+                self.evict()
+
+    # Function to evict least recently used entries until the cache fits its size budget
+    # Entries are taken out of the index and renamed aside under the lock (so a concurrent store of the
+    # same key can't lose its new file); the files are deleted after the lock is released
+    def evict(self):
+        doomed = []
+        with self._lock:
+            index = self._load_index()
+            for key in list(index):
+                if self._total <= self.max_bytes:
+                    break
+                if key in self._pins:
+                    continue
+                size = index.pop(key)
+                self._total -= size
+                for path in self._paths(key):
+                    doomed_path = f"{path}.{uuid.uuid4().hex}.evicted"
+                    try:
+                        os.replace(path, doomed_path)
+                        doomed.append(doomed_path)
+                    except OSError:
+                        pass
+        for path in doomed:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+# Function to GET a URL through a disk cache and keep the entry pinned while the with block reads result['path']
+@contextmanager
+def cached_response(cache, url, params=None, **kwargs):
+    with cache.pinned(cache_key(url, params)):
+        yield cached_get(cache, url, params, **kwargs)
+
+
+# Function to GET a URL through a disk cache, streaming misses straight into it
+# The returned path can be evicted by another thread at any time; read it inside cached_response instead
+# cacheable(response) decides whether a 200 response may be stored (e.g. only images, not error pages)
+# max_age overrides the cache's TTL for this call, e.g. 0 to always revalidate
+# Returns a dict with status_code, path (None unless the body is available on disk), content_type,
+# cache ('hit', 'revalidated', 'miss', 'stale' or 'bypass') and, for uncached errors, text
+def cached_get(cache, url, params=None, cacheable=None, max_age=None, **kwargs):
+    key = cache_key(url, params)
+    cached = cache.lookup(key)
+    headers = dict(kwargs.pop('headers', None) or {})
+
+    if cached is not None:
+        data_path, meta = cached
+        has_validators = meta.get('etag') or meta.get('last_modified')
+        ttl = cache.ttl if max_age is None else max_age
+        if cache.is_fresh(meta, max_age) and not (ttl is None and has_validators):
+            return {'status_code': 200, 'path': data_path, 'content_type': meta.get('content_type'), 'cache': 'hit'}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+    try:
+        response = http_client.get(url, params=params, headers=headers, stream=True, **kwargs)
+    except Exception:
+        if cached is not None:
+            # Keep serving the last good copy while the server is unreachable
+            return {'status_code': 200, 'path': cached[0], 'content_type': cached[1].get('content_type'), 'cache': 'stale'}
+        raise
+
+    with response:
+        if response.status_code == 304 and cached is not None:
+            meta = cache.mark_validated(key, cached[1])
+            return {'status_code': 200, 'path': cached[0], 'content_type': meta.get('content_type'), 'cache': 'revalidated'}
+
+        if response.status_code == 200 and (cacheable is None or cacheable(response)):
+            meta = {
+                'url': response.url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'content_type': response.headers.get('Content-Type'),
+            }
+            data_path = cache.store(key, response.iter_content(chunk_size=CHUNK_SIZE), meta)
+            return {'status_code': 200, 'path': data_path, 'content_type': meta['content_type'], 'cache': 'miss'}
+
+        if response.status_code != 200 and cached is not None:
+            return {'status_code': 200, 'path': cached[0], 'content_type': cached[1].get('content_type'), 'cache': 'stale'}
+
+        return {
+            'status_code': response.status_code,
+            'path': None,
+            'content_type': response.headers.get('Content-Type'),
+            'cache': 'bypass',
+            'text': response.text[:1000],
+        }
@@ -0,0 +1,261 @@
+import json
+import os
+import re
+
+# Streaming helpers for Esri JSON query responses.
+# A response body is written to disk chunk by chunk while a small scanner tracks
+# just enough of the JSON structure to count features, find the top-level keys
+# (error, fields, exceededTransferLimit, ...) and remember where the features
+# array starts and ends. Memory use stays constant whatever the response size.
+
+# Size of the chunks read from the HTTP response
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Structural characters that matter at the top level of the response object
+_TOP_LEVEL_TOKENS = re.compile(rb'["{}\[\],:]')
+# Characters that matter inside a nested value other than the features array
+_NESTED_TOKENS = re.compile(rb'["{}\[\]]')
+# Between features only the next feature or the end of the array matter
+_BETWEEN_FEATURES_TOKENS = re.compile(rb'["{\]]')
+# Inside a feature only objects and strings can change the nesting that matters
+_IN_FEATURE_TOKENS = re.compile(rb'["{}]')
+# Inside a string only the closing quote and escapes matter
+_STRING_TOKENS = re.compile(rb'["\\]')
+
+_QUOTE = ord('"')
+_BACKSLASH = ord('\\')
+_OPEN_BRACE = ord('{')
+_CLOSE_BRACE = ord('}')
+_OPEN_BRACKET = ord('[')
+_CLOSE_BRACKET = ord(']')
+_COLON = ord(':')
+_COMMA = ord(',')
+
+
+# Incremental scanner for a single Esri JSON response body
+class FeatureStreamScanner:
+    def __init__(self):
+        self.offset = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.expect_key = False
+        self.key_parts = None
+        self.current_key = None
+        self.value_start = None
+        self.in_features = False
+        self.feature_depth = 0
+        self.feature_count = 0
+        self.features_start = None
+        self.features_end = None
+        self.values = {}
+
+    # Function to feed the next chunk of the body to the scanner
+    def feed(self, chunk):
+        pos = 0
+        length = len(chunk)
+        while pos < length:
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                    if self.key_parts is not None:
+                        self.key_parts.append(chunk[pos:pos + 1])
+                    pos += 1
+                    continue
+                match = _STRING_TOKENS.search(chunk, pos)
+                if match is None:
+                    if self.key_parts is not None:
+                        self.key_parts.append(chunk[pos:])
+                    break
+                index = match.start()
+                if self.key_parts is not None:
+                    self.key_parts.append(chunk[pos:index + 1])
+                pos = index + 1
+                if chunk[index] == _BACKSLASH:
+                    self.escape = True
+                    continue
+                self.in_string = False
+                if self.key_parts is not None:
+                    self.current_key = json.loads(b'"' + b''.join(self.key_parts))
+                    self.key_parts = None
+                continue
+
+            if self.in_features:
+                pattern = _IN_FEATURE_TOKENS if self.feature_depth else _BETWEEN_FEATURES_TOKENS
+            else:
+                pattern = _NESTED_TOKENS if self.depth >= 2 else _TOP_LEVEL_TOKENS
+            match = pattern.search(chunk, pos)
+            if match is None:
+                break
+            index = match.start()
+            token = chunk[index]
+            pos = index + 1
+
+            if token == _QUOTE:
+                self.in_string = True
+                if self.depth == 1 and self.expect_key:
+                    self.key_parts = []
+                    self.expect_key = False
+            elif self.in_features:
+                if token == _OPEN_BRACE:
+                    if self.feature_depth == 0:
+                        self.feature_count += 1
+                    self.feature_depth += 1
+                elif token == _CLOSE_BRACE:
+                    self.feature_depth -= 1
+                else:
+                    # Closing bracket of the features array
+                    self.in_features = False
+                    self.features_end = self.offset + index
+                    self.depth -= 1
+            elif token == _OPEN_BRACE or token == _OPEN_BRACKET:
+                if self.depth == 0 and token == _OPEN_BRACE:
+                    self.expect_key = True
+                if self.depth == 1 and token == _OPEN_BRACKET and self.current_key == 'features':
+                    self.in_features = True
+                    self.features_start = self.offset + index
+                self.depth += 1
+            elif token == _CLOSE_BRACE or token == _CLOSE_BRACKET:
+                self.depth -= 1
+                if self.depth == 0:
+                    self._end_value(self.offset + index)
+            elif token == _COLON:
+                if self.depth == 1:
+                    self.value_start = self.offset + index + 1
+            elif token == _COMMA:
+                if self.depth == 1:
+                    self._end_value(self.offset + index)
+                    self.expect_key = True
+        self.offset += length
+
+    # Function to record the byte range of the top-level value that just ended
+    def _end_value(self, end):
+        if self.current_key is not None and self.value_start is not None:
+            self.values[self.current_key] = (self.value_start, end)
+        self.current_key = None
+        self.value_start = None
+
+
+# Result of streaming one response to disk
+class StreamResult:
+    def __init__(self, path, scanner):
+        self.path = path
+        self.size = scanner.offset
+        self.feature_count = scanner.feature_count
+        self.features_start = scanner.features_start
+        self.features_end = scanner.features_end
+        self.header = read_header(path, scanner.values)
+
+    @property
+    def error(self):
+        return self.header.get('error')
+
+
+# Function to read every top-level value except the features array from a scanned file
+def read_header(path, values):
+    header = {}
+    with open(path, 'rb') as f:
+        for key, (start, end) in values.items():
+            if key == 'features':
+                continue
+            f.seek(start)
+            try:
+                header[key] = json.loads(f.read(end - start))
+            except ValueError:
+                continue
+    return header
+
+
+# Function to write a streamed HTTP response to a file while scanning it
+def stream_response_to_file(response, path, chunk_size=STREAM_CHUNK_SIZE):
+    scanner = FeatureStreamScanner()
+    with open(path, 'wb') as f:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if chunk:
+                f.write(chunk)
+                scanner.feed(chunk)
+    return StreamResult(path, scanner)
+
+
+# Function to scan a response that is already on disk
+def scan_file(path, chunk_size=STREAM_CHUNK_SIZE):
+    scanner = FeatureStreamScanner()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            scanner.feed(chunk)
+    return StreamResult(path, scanner)
+
+
+# Function to copy a byte range from one open file to another in chunks
+def _copy_range(src, dst, start, end, chunk_size=STREAM_CHUNK_SIZE):
+    src.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = src.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        dst.write(chunk)
+        remaining -= len(chunk)
+
+
+# Function to join the features of several scanned pages into one Esri JSON file
+# The header (fields, geometryType, spatialReference, ...) comes from the first page with features
+# Without a transform the features are copied byte for byte; with one, each page is parsed on its own,
+# passed through transform(page) and re-serialized, so memory stays bounded by the page size
+# Returns the total number of features written
+def assemble_feature_file(results, out_path, transform=None, chunk_size=STREAM_CHUNK_SIZE):
+    if transform is not None:
+        return _assemble_transformed(results, out_path, transform)
+
+    if len(results) == 1 and results[0].features_start is not None:
+        os.replace(results[0].path, out_path)
+        return results[0].feature_count
+
+    header_result = _header_result(results)
+    total = 0
+    with open(out_path, 'wb') as out, open(header_result.path, 'rb') as header_file:
+        _copy_range(header_file, out, 0, header_result.features_start + 1, chunk_size)
+        for result in results:
+            if not result.feature_count:
+                continue
+            if total:
+                out.write(b',')
+            with open(result.path, 'rb') as page_file:
+                _copy_range(page_file, out, result.features_start + 1, result.features_end, chunk_size)
+            total += result.feature_count
+        _copy_range(header_file, out, header_result.features_end, header_result.size, chunk_size)
+    return total
+
+
+# Function to pick the page whose header describes the assembled file
+def _header_result(results):
+    header_result = next((r for r in results if r.feature_count and r.features_start is not None), results[0])
+    if header_result.features_start is None:
+        raise ValueError(f"No features array found in {header_result.path}")
+    return header_result
+
+
+# Function to assemble pages through a per-page transform
+def _assemble_transformed(results, out_path, transform):
+    header_result = _header_result(results)
+    header = None
+    total = 0
+    with open(out_path, 'w') as out:
+        for result in [header_result] + [r for r in results if r is not header_result]:
+            if result is not header_result and not result.feature_count:
+                continue
+            with open(result.path) as page_file:
+                page = transform(json.load(page_file))
+            features = page.pop('features', None) or []
+            if header is None:
+                header = page
+                # Write the header object with an opening features array in place of its closing brace
+                header_json = json.dumps(header)
+                out.write(header_json[:-1] + (', ' if len(header_json) > 2 else '') + '"features": [')
+            for feature in features:
+                if total:
+                    out.write(',')
+                json.dump(feature, out)
+                total += 1
+        out.write(']}')
+    return total
@@ -0,0 +1,420 @@
+import hashlib
+import json
+import os
+import struct
+import time
+import uuid
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Parallel, change-aware zip packaging for file geodatabases.
+# Large files are split into blocks that are deflated on several threads and
+# stitched back into one deflate stream. A manifest next to the archive records
+# each member's content hash and where its compressed bytes sit in the archive,
+# so an unchanged geodatabase reuses the archive as is, and a changed one only
+# recompresses the files that changed while the rest are copied over raw.
+
+# Size of the blocks files are hashed and compressed in
+BLOCK_SIZE = 16 * 1024 * 1024
+
+# Default number of compression threads
+DEFAULT_PACKAGE_WORKERS = os.cpu_count() or 4
+
+# Deflate level used for members
+COMPRESS_LEVEL = 6
+
+# Files up to this size are stored; deflating them saves next to nothing
+STORE_MAX_BYTES = 1024
+
+# Extensions of data that is already compressed and is stored as is
+STORED_EXTENSIONS = {'.zip', '.gz', '.7z', '.png', '.jpg', '.jpeg', '.jp2', '.sid', '.ecw', '.tif', '.tiff'}
+
+# Lock files come and go while a geodatabase is open; they are never packaged
+SKIPPED_EXTENSIONS = {'.lock'}
+
+# Bumped whenever the manifest layout changes, invalidating older manifests
+MANIFEST_VERSION = 1
+
+_STORED = 0
+_DEFLATED = 8
+_ZIP64_LIMIT = (1 << 32) - 1
+_ZIP64_COUNT_LIMIT = 0xFFFF
+
+
+# Function to get the manifest path for an archive
+def manifest_path(zip_path):
+    return f"{zip_path}.manifest.json"
+
+
+# Function to load an archive's manifest, or an empty one if it is missing or outdated
+def load_manifest(zip_path):
+    try:
+        with open(manifest_path(zip_path)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {'members': {}}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {'members': {}}
+    return manifest
+
+
+# Function to list the files of a geodatabase as (arcname, path, stat) sorted by arcname
+def list_members(fgdb_path):
+    fgdb_path = os.path.normpath(fgdb_path)
+    base = os.path.dirname(fgdb_path)
+    members = []
+    for folder, _, files in os.walk(fgdb_path):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in SKIPPED_EXTENSIONS:
+                continue
+            path = os.path.join(folder, name)
+            arcname = os.path.relpath(path, base).replace(os.sep, '/')
+            members.append((arcname, path, os.stat(path)))
+    members.sort()
+    return members
+
+
+# Function to combine the CRC-32 of two byte runs given the length of the second (as zlib's crc32_combine)
+def crc32_combine(crc1, crc2, length2):
+    if length2 == 0:
+        return crc1
+
+    def times(matrix, vector):
+        total = 0
+        index = 0
+        while vector:
+            if vector & 1:
+                total ^= matrix[index]
+            vector >>= 1
+            index += 1
+        return total
+
+    def square(matrix):
+        return [times(matrix, row) for row in matrix]
+
+    odd = [0xEDB88320] + [1 << index for index in range(31)]
+    even = square(odd)
+    odd = square(even)
+    while True:
+        even = square(odd)
+        if length2 & 1:
+            crc1 = times(even, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+        odd = square(even)
+        if length2 & 1:
+            crc1 = times(odd, crc1)
+        length2 >>= 1
+        if not length2:
+            break
+    return crc1 ^ crc2
+
+
+# Function to split a file size into (offset, length) blocks
+def _blocks(size):
+    return [(offset, min(BLOCK_SIZE, size - offset)) for offset in range(0, size, BLOCK_SIZE)] or [(0, 0)]
+
+
+# Function to read one block of a file
+def _read_block(path, offset, length):
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+# Function to hash one block of a file
+def _hash_block(path, offset, length):
+    return hashlib.sha256(_read_block(path, offset, length)).digest()
+
+
+# Function to deflate one block of a file into a piece of a raw deflate stream
+# Returns (compressed bytes, crc32 of the block, block length); only the last block ends the stream
+def _compress_block(path, offset, length, last):
+    data = _read_block(path, offset, length)
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+    return compressed, zlib.crc32(data), len(data)
+
+
+# Function to hash files in parallel as a digest of their block digests
+# Returns {arcname: hex digest}
+def hash_files(files, executor):
+    futures = {
+        arcname: [executor.submit(_hash_block, path, offset, length) for offset, length in _blocks(size)]
+        for arcname, path, size in files
+    }
+    return {
+        arcname: hashlib.sha256(b''.join(future.result() for future in block_futures)).hexdigest()
+        for arcname, block_futures in futures.items()
+    }
+
+
+# Function to convert a modification time to a DOS (time, date) pair
+def _dos_time(mtime):
+    local = time.localtime(max(mtime, 315532800))  # DOS dates start in 1980
+    return (
+        (local.tm_hour << 11) | (local.tm_min << 5) | (local.tm_sec // 2),
+        ((local.tm_year - 1980) << 9) | (local.tm_mon << 5) | local.tm_mday,
+    )
+
+
+# Function to build a local file header; sizes go in a ZIP64 extra field when the member may be large
+# Members written with a data descriptor leave CRC and sizes zero here (the descriptor follows the data)
+def _local_header(arcname, entry, zip64):
+    name = arcname.encode('utf-8')
+    dos_time, dos_date = _dos_time(entry['mtime'])
+    flags = entry.get('flags', 0)
+    size, compressed_size = (0, 0) if flags & 0x08 else (entry['size'], entry['compressed_size'])
+    if zip64:
+        extra = struct.pack('<HHQQ', 1, 16, size, compressed_size)
+        sizes = (_ZIP64_LIMIT, _ZIP64_LIMIT)
+    else:
+        extra = b''
+        sizes = (compressed_size, size)
+    return struct.pack(
+        '<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, 0x800 | flags, entry['method'], dos_time, dos_date,
+        entry['crc'], sizes[0], sizes[1], len(name), len(extra),
+    ) + name + extra
+
+
+# Function to build a central directory record
+def _central_header(arcname, entry, offset):
+    name = arcname.encode('utf-8')
+    dos_time, dos_date = _dos_time(entry['mtime'])
+    values = []
+    size, compressed_size = entry['size'], entry['compressed_size']
+    if size >= _ZIP64_LIMIT:
+        values.append(size)
+        size = _ZIP64_LIMIT
+    if compressed_size >= _ZIP64_LIMIT:
+        values.append(compressed_size)
+        compressed_size = _ZIP64_LIMIT
+    if offset >= _ZIP64_LIMIT:
+        values.append(offset)
+        offset = _ZIP64_LIMIT
+    extra = struct.pack(f'<HH{len(values)}Q', 1, 8 * len(values), *values) if values else b''
+    version = 45 if values else 20
+    return struct.pack(
+        '<IHHHHHHIIIHHHHHII', 0x02014b50, version, version, 0x800 | entry.get('flags', 0), entry['method'], dos_time, dos_date,
+        entry['crc'], compressed_size, size, len(name), len(extra), 0, 0, 0, 0, offset,
+    ) + name + extra
+
+
+# Function to build the data descriptor that follows a member written in one pass
+def _data_descriptor(entry, zip64):
+    size_format = 'Q' if zip64 else 'I'
+    return struct.pack(f'<II{size_format}{size_format}', 0x08074b50, entry['crc'], entry['compressed_size'], entry['size'])
+
+
+# Function to write the end of central directory records, with ZIP64 records when needed
+def _write_end(f, count, directory_offset, directory_size):
+    if count > _ZIP64_COUNT_LIMIT or directory_offset >= _ZIP64_LIMIT or directory_size >= _ZIP64_LIMIT:
+        zip64_offset = f.tell()
+        f.write(struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, directory_size, directory_offset))
+        f.write(struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1))
+        count = min(count, _ZIP64_COUNT_LIMIT)
+        directory_offset = min(directory_offset, _ZIP64_LIMIT)
+        directory_size = min(directory_size, _ZIP64_LIMIT)
+    f.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, directory_size, directory_offset, 0))
+
+
+# Archive output that is only ever appended to, handing every written chunk to an optional sink
+# (so an upload can start on the first bytes while later members are still being compressed)
+class _ArchiveWriter:
+    def __init__(self, f, sink=None):
+        self.f = f
+        self.sink = sink
+
+    def write(self, data):
+        self.f.write(data)
+        if self.sink is not None:
+            self.sink(data)
+
+    def tell(self):
+        return self.f.tell()
+
+
+# Function to copy a byte range from an open file to a writer
+def _copy_range(source, target, offset, length):
+    source.seek(offset)
+    while length > 0:
+        chunk = source.read(min(BLOCK_SIZE, length))
+        if not chunk:
+            raise IOError("Previous archive is shorter than its manifest says")
+        target.write(chunk)
+        length -= len(chunk)
+
+
+# Function to package a geodatabase into zip_path, rebuilding only when its contents changed
+# sink(data), if given, receives the bytes of a rebuilt archive in order as they are written
+# Returns a dict with path, rebuilt, members, compressed (members deflated), stored (members written
+# uncompressed), reused (members copied from the previous archive), digest and size
+def package_gdb(fgdb_path, zip_path, max_workers=DEFAULT_PACKAGE_WORKERS, log=print, sink=None):
+    members = list_members(fgdb_path)
+    previous = load_manifest(zip_path)
+    old_members = previous.get('members', {})
+
+    # The previous archive can only be reused (or copied from) if it is the one the manifest describes
+    archive_valid = False
+    if os.path.exists(zip_path):
+        stat = os.stat(zip_path)
+        archive_valid = previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        # Files whose size and modification time match the manifest keep their recorded hash
+        to_hash = [
+            (arcname, path, stat.st_size)
+            for arcname, path, stat in members
+            if old_members.get(arcname, {}).get('size') != stat.st_size
+            or old_members.get(arcname, {}).get('mtime_ns') != stat.st_mtime_ns
+        ]
+        hashes = hash_files(to_hash, executor)
+        for arcname, _, _ in members:
+            if arcname not in hashes:
+                hashes[arcname] = old_members[arcname]['sha256']
+
+        digest = hashlib.sha256(
+            json.dumps([[arcname, hashes[arcname]] for arcname, _, _ in members]).encode('utf-8')
+        ).hexdigest()
+        if archive_valid and previous.get('digest') == digest:
+            if to_hash:
+                # Contents are unchanged but timestamps moved; remember the new stats
+                for arcname, path, stat in members:
+                    old_members[arcname].update(mtime_ns=stat.st_mtime_ns)
+                _save_manifest(zip_path, previous)
+            return {
+                'path': zip_path, 'rebuilt': False, 'members': len(members), 'compressed': 0, 'stored': 0,
+                'reused': len(members), 'digest': digest, 'size': previous['size'],
+            }
+
+        # Members whose content is already compressed in the previous archive are copied raw
+        reusable = {
+            arcname for arcname, _, _ in members
+            if archive_valid and arcname in old_members and old_members[arcname]['sha256'] == hashes[arcname]
+        }
+        # Small and already compressed files are written as they are instead of being deflated
+        stored = {
+            arcname for arcname, path, stat in members
+            if arcname not in reusable and _is_stored(path, stat.st_size)
+        }
+        deflated = len(members) - len(reusable) - len(stored)
+        log(f"Packaging {len(members)} file(s): {deflated} to compress, {len(stored)} to store, {len(reusable)} unchanged")
+
+        # Compression blocks are queued in archive order and kept a bounded distance ahead of the writer
+        def block_tasks():
+            for arcname, path, stat in members:
+                if arcname in reusable or arcname in stored:
+                    continue
+                blocks = _blocks(stat.st_size)
+                for index, (offset, length) in enumerate(blocks):
+                    yield path, offset, length, index == len(blocks) - 1
+
+        tasks = block_tasks()
+        pending = deque()
+
+        def fill():
+            while len(pending) < 2 * max(1, max_workers):
+                task = next(tasks, None)
+                if task is None:
+                    return
+                pending.append(executor.submit(_compress_block, *task))
+
+        temp_path = f"{zip_path}.{uuid.uuid4().hex}.tmp"
+        entries = {}
+        try:
+            old_archive = open(zip_path, 'rb') if reusable else None
+            try:
+                with open(temp_path, 'wb') as raw:
+                    f = _ArchiveWriter(raw, sink)
+                    fill()
+                    for arcname, path, stat in members:
+                        entry = {
+                            'size': stat.st_size,
+                            'mtime_ns': stat.st_mtime_ns,
+                            'mtime': stat.st_mtime,
+                            'sha256': hashes[arcname],
+                        }
+                        header_offset = f.tell()
+                        zip64 = stat.st_size * 1.05 + 1024 >= _ZIP64_LIMIT
+
+                        if arcname in reusable:
+                            old = old_members[arcname]
+                            entry.update(method=old['method'], crc=old['crc'], compressed_size=old['compressed_size'])
+                            f.write(_local_header(arcname, entry, zip64))
+                            entry['data_offset'] = f.tell()
+                            _copy_range(old_archive, f, old['data_offset'], old['compressed_size'])
+                        elif arcname in stored:
+                            # Stored members are small or rare, so their CRC is taken up front
+                            # rather than relying on a data descriptor, which some readers reject for stored data
+                            crc = 0
+                            with open(path, 'rb') as source:
+                                for chunk in iter(lambda: source.read(BLOCK_SIZE), b''):
+                                    crc = zlib.crc32(chunk, crc)
+                            entry.update(method=_STORED, crc=crc, compressed_size=stat.st_size)
+                            f.write(_local_header(arcname, entry, zip64))
+                            entry['data_offset'] = f.tell()
+                            with open(path, 'rb') as source:
+                                for chunk in iter(lambda: source.read(BLOCK_SIZE), b''):
+                                    f.write(chunk)
+                        else:
+                            entry.update(method=_DEFLATED, flags=0x08, crc=0, compressed_size=0)
+                            f.write(_local_header(arcname, entry, zip64))
+                            entry['data_offset'] = f.tell()
+                            crc = 0
+                            for _ in _blocks(stat.st_size):
+                                compressed, block_crc, block_length = pending.popleft().result()
+                                fill()
+                                crc = crc32_combine(crc, block_crc, block_length)
+                                f.write(compressed)
+                            entry['crc'] = crc
+                            entry['compressed_size'] = f.tell() - entry['data_offset']
+                            f.write(_data_descriptor(entry, zip64))
+
+                        entry['header_offset'] = header_offset
+                        entries[arcname] = entry
+
+                    directory_offset = f.tell()
+                    for arcname, _, _ in members:
+                        f.write(_central_header(arcname, entries[arcname], entries[arcname]['header_offset']))
+                    _write_end(f, len(members), directory_offset, f.tell() - directory_offset)
+            finally:
+                if old_archive is not None:
+                    old_archive.close()
+            os.replace(temp_path, zip_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    stat = os.stat(zip_path)
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'source': os.path.abspath(fgdb_path),
+        'digest': digest,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'members': {
+            arcname: {key: value for key, value in entry.items() if key not in ('mtime', 'header_offset')}
+            for arcname, entry in entries.items()
+        },
+    }
+    _save_manifest(zip_path, manifest)
+    return {
+        'path': zip_path, 'rebuilt': True, 'members': len(members), 'compressed': deflated, 'stored': len(stored),
+        'reused': len(reusable), 'digest': digest, 'size': stat.st_size,
+    }
+
+
+# Function to tell whether a file is stored rather than deflated
+def _is_stored(path, size):
+    return size <= STORE_MAX_BYTES or os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+
+
+# Function to write an archive's manifest atomically
+def _save_manifest(zip_path, manifest):
+    path = manifest_path(zip_path)
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(temp_path, path)
@@ -0,0 +1,253 @@
+import re
+from itertools import chain
+
+import numpy as np
+
+try:
+    import pyproj
+except ImportError:  # Without pyproj, units come from the WKT, well-known WKIDs and the service's units
+    pyproj = None
+
+# Bulk planar measurements for Esri JSON geometries.
+# All rings or paths of a batch of features are flattened into one coordinate
+# array, so area (shoelace formula) and length are computed with a handful of
+# NumPy operations instead of one arcpy geometry call per row. No arcpy needed.
+# Quantized query responses (integer, delta-encoded coordinates) are decoded the same way.
+
+# Attributes the measurements are written to, in square meters and meters
+# (Shape_Area and Shape_Length are kept by the geodatabase itself, so they can't be loaded as attributes)
+AREA_FIELD = 'Area_m2'
+LENGTH_FIELD = 'Length_m'
+
+# Meters per unit for the linear units a map or feature service can report
+LINEAR_UNIT_METERS = {
+    'esriMeters': 1.0,
+    'esriKilometers': 1000.0,
+    'esriFeet': 0.3048,
+    'esriUSFeet': 1200.0 / 3937.0,
+    'esriInternationalFeet': 0.3048,
+    'esriYards': 0.9144,
+    'esriMiles': 1609.344,
+    'esriNauticalMiles': 1852.0,
+}
+
+# Spatial reference IDs known to be in meters without a projection library (Web and World Mercator, Plate Carree)
+METER_WKIDS = {3857, 102100, 102113, 900913, 3395, 54004, 4087, 4088}
+
+_WKT_UNIT = re.compile(r'UNIT\[\s*"[^"]*"\s*,\s*([-+0-9.eE]+)')
+
+
+# Function to work out the linear units of a spatial reference (wkid, latestWkid and/or wkt)
+# Returns ('geographic', None), ('projected', meters per unit), or (None, None) when it can't be told
+def spatial_reference_units(reference):
+    reference = reference or {}
+    wkt = (reference.get('wkt') or '').strip()
+    if wkt.upper().startswith(('GEOGCS', 'GEOGCRS')):
+        return 'geographic', None
+    if wkt.upper().startswith('PROJCS'):
+        # The projection's linear unit is the last UNIT; the one inside GEOGCS is angular
+        units = _WKT_UNIT.findall(wkt)
+        if units:
+            return 'projected', float(units[-1])
+
+    wkid = reference.get('latestWkid') or reference.get('wkid')
+    if not wkid:
+        return None, None
+    if wkid in METER_WKIDS:
+        return 'projected', 1.0
+    if pyproj is not None:
+        try:
+            crs = pyproj.CRS.from_user_input(f"{'EPSG' if wkid < 100000 else 'ESRI'}:{wkid}")
+        except pyproj.exceptions.CRSError:
+            crs = None
+        if crs is not None and crs.is_geographic:
+            return 'geographic', None
+        if crs is not None and crs.is_projected:
+            return 'projected', crs.axis_info[0].unit_conversion_factor
+    # EPSG geographic systems are numbered 4000-4999 and Esri's 104000-104999
+    if 4000 <= wkid < 5000 or 104000 <= wkid < 105000:
+        return 'geographic', None
+    return None, None
+
+
+# Function to flatten the parts of a batch of geometries into one coordinate array
+# Returns (coords, part_lengths, part_features) where part_features maps each part to its geometry index
+def _flatten_parts(geometries, key):
+    parts = []
+    part_features = []
+    for index, geometry in enumerate(geometries):
+        if not geometry:
+            continue
+        for part in geometry.get(key) or []:
+            if len(part) >= 2:
+                parts.append(part)
+                part_features.append(index)
+
+    part_lengths = np.fromiter((len(part) for part in parts), dtype=np.int64, count=len(parts))
+    point_count = int(part_lengths.sum())
+    # Points may carry z and m values; only x and y are used
+    coords = np.fromiter(
+        chain.from_iterable((point[0], point[1]) for point in chain.from_iterable(parts)),
+        dtype=np.float64,
+        count=point_count * 2,
+    ).reshape(-1, 2)
+    return coords, part_lengths, np.asarray(part_features, dtype=np.int64)
+
+
+# Function to compute per-part signed area and length for flattened parts
+# Rings are closed implicitly, so open and explicitly closed rings give the same result
+def _part_measures(coords, part_lengths, closed):
+    part_count = len(part_lengths)
+    if part_count == 0:
+        return np.zeros(0), np.zeros(0)
+
+    part_ids = np.repeat(np.arange(part_count), part_lengths)
+    starts = np.concatenate(([0], np.cumsum(part_lengths)[:-1]))
+
+    # Work relative to each part's first vertex to keep precision with large projected coordinates
+    local = coords - coords[starts][part_ids]
+    nxt = np.roll(local, -1, axis=0)
+    if closed:
+        # The segment leaving each part's last vertex goes back to its first vertex
+        ends = starts + part_lengths - 1
+        nxt[ends] = local[starts]
+        valid = np.ones(len(local), dtype=bool)
+    else:
+        valid = np.ones(len(local), dtype=bool)
+        valid[starts + part_lengths - 1] = False
+
+    segment_lengths = np.hypot(nxt[:, 0] - local[:, 0], nxt[:, 1] - local[:, 1])
+    lengths = np.bincount(part_ids[valid], weights=segment_lengths[valid], minlength=part_count)
+    if not closed:
+        return np.zeros(part_count), lengths
+
+    cross = local[:, 0] * nxt[:, 1] - nxt[:, 0] * local[:, 1]
+    signed_areas = 0.5 * np.bincount(part_ids, weights=cross, minlength=part_count)
+    return signed_areas, lengths
+
+
+# Function to compute planar area and perimeter for a batch of Esri JSON polygons
+# Outer rings are clockwise and holes counter-clockwise, so holes are subtracted
+# Returns two float arrays; features without a measurable geometry get NaN
+def polygon_measures(geometries):
+    geometries = list(geometries)
+    areas = np.full(len(geometries), np.nan)
+    perimeters = np.full(len(geometries), np.nan)
+    coords, part_lengths, part_features = _flatten_parts(geometries, 'rings')
+    if len(part_lengths) == 0:
+        return areas, perimeters
+
+    signed_areas, lengths = _part_measures(coords, part_lengths, closed=True)
+    measured = np.unique(part_features)
+    # The shoelace formula is positive for counter-clockwise rings, so Esri outer rings come out negative
+    areas[measured] = np.abs(np.bincount(part_features, weights=-signed_areas, minlength=len(geometries))[measured])
+    perimeters[measured] = np.bincount(part_features, weights=lengths, minlength=len(geometries))[measured]
+    return areas, perimeters
+
+
+# Function to compute planar length for a batch of Esri JSON polylines
+def polyline_lengths(geometries):
+    geometries = list(geometries)
+    totals = np.full(len(geometries), np.nan)
+    coords, part_lengths, part_features = _flatten_parts(geometries, 'paths')
+    if len(part_lengths) == 0:
+        return totals
+
+    _, lengths = _part_measures(coords, part_lengths, closed=False)
+    measured = np.unique(part_features)
+    totals[measured] = np.bincount(part_features, weights=lengths, minlength=len(geometries))[measured]
+    return totals
+
+
+# Function to add the field definition a measurement is written to, unless the feature set already has it
+def _measure_field(fields, name):
+    if name not in {field.get('name') for field in fields}:
+        fields.append({'name': name, 'type': 'esriFieldTypeDouble', 'alias': name})
+    return name
+
+
+# Function to write area and length attributes into an Esri JSON feature set in bulk
+# unit_scale converts coordinate units to meters (see LINEAR_UNIT_METERS); curves are left unmeasured
+def add_measures(data, unit_scale=1.0):
+    geometry_type = data.get('geometryType')
+    if geometry_type not in ('esriGeometryPolygon', 'esriGeometryPolyline'):
+        return data
+
+    features = data.get('features') or []
+    fields = data.setdefault('fields', [])
+    geometries = [
+        None if not feature.get('geometry') or 'curveRings' in feature['geometry'] or 'curvePaths' in feature['geometry']
+        else feature['geometry']
+        for feature in features
+    ]
+
+    if geometry_type == 'esriGeometryPolygon':
+        areas, lengths = polygon_measures(geometries)
+        area_field = _measure_field(fields, AREA_FIELD)
+        areas = areas * unit_scale * unit_scale
+    else:
+        areas = None
+        lengths = polyline_lengths(geometries)
+    length_field = _measure_field(fields, LENGTH_FIELD)
+    lengths = lengths * unit_scale
+
+    for index, feature in enumerate(features):
+        attributes = feature.setdefault('attributes', {})
+        if areas is not None:
+            attributes[area_field] = None if np.isnan(areas[index]) else float(areas[index])
+        attributes[length_field] = None if np.isnan(lengths[index]) else float(lengths[index])
+    return data
+
+
+# Function to decode delta-encoded integer coordinates of one geometry key (paths, rings or points) in bulk
+# Each part (or a multipoint's point list) starts with an absolute vertex and continues with offsets from the previous one
+def _dequantize_parts(geometries, key, scale, translate, y_sign):
+    if key == 'points':
+        parts = [geometry['points'] for geometry in geometries if geometry.get('points')]
+    else:
+        parts = [part for geometry in geometries for part in (geometry.get(key) or []) if part]
+    if not parts:
+        return
+    part_lengths = np.fromiter((len(part) for part in parts), dtype=np.int64, count=len(parts))
+    deltas = np.fromiter(
+        chain.from_iterable((point[0], point[1]) for point in chain.from_iterable(parts)),
+        dtype=np.float64,
+        count=int(part_lengths.sum()) * 2,
+    ).reshape(-1, 2)
+
+    # Running sums restarted at every part give the absolute integer coordinates
+    totals = np.cumsum(deltas, axis=0)
+    starts = np.concatenate(([0], np.cumsum(part_lengths)[:-1]))
+    before = np.zeros((len(parts), 2))
+    before[1:] = totals[starts[1:] - 1]
+    absolute = totals - np.repeat(before, part_lengths, axis=0)
+    xs = (translate[0] + absolute[:, 0] * scale[0]).tolist()
+    ys = (translate[1] + y_sign * absolute[:, 1] * scale[1]).tolist()
+
+    index = 0
+    for part in parts:
+        for position, point in enumerate(part):
+            # z and m values are not quantized and are kept as they are
+            part[position] = [xs[index], ys[index]] + list(point[2:])
+            index += 1
+
+
+# Function to decode a quantized Esri JSON feature set (one with a "transform") into real coordinates, in place
+# Feature sets without a transform are returned unchanged
+def dequantize(data):
+    transform = data.pop('transform', None)
+    if not transform:
+        return data
+    scale = transform['scale']
+    translate = transform['translate']
+    y_sign = -1.0 if transform.get('originPosition', 'upperLeft') == 'upperLeft' else 1.0
+
+    geometries = [feature['geometry'] for feature in data.get('features') or [] if feature.get('geometry')]
+    for key in ('paths', 'rings', 'points'):
+        _dequantize_parts(geometries, key, scale, translate, y_sign)
+    for geometry in geometries:
+        # Single points are not delta-encoded
+        if geometry.get('x') is not None and geometry.get('y') is not None:
+            geometry['x'] = translate[0] + geometry['x'] * scale[0]
+            geometry['y'] = translate[1] + y_sign * geometry['y'] * scale[1]
+    return data
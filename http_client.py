@@ -0,0 +1,162 @@
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+# Shared HTTP client for the ArcBridge tools.
+# One pooled keep-alive session per process, gzip negotiation, timeouts on every
+# call, a cap on concurrent requests per host, and exponential backoff that
+# honours Retry-After on throttling and server errors. Requests that are not
+# idempotent (POST unless the caller says otherwise) are only retried when the
+# server can't have acted on them: the connection was never made, or it throttled them.
+
+# (connect, read) timeout in seconds applied when the caller does not pass one
+DEFAULT_TIMEOUT = (10, 300)
+
+# Number of attempts made for a request before giving up
+MAX_ATTEMPTS = 5
+
+# Base delay and ceiling for exponential backoff, in seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60
+
+# Status codes that are retried
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Status codes that mean the request was refused unprocessed, so even non-idempotent requests are retried
+UNPROCESSED_STATUSES = {429}
+
+# Methods that are safe to send again after a timeout or a server error
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+# Maximum number of requests in flight to the same host
+PER_HOST_CONCURRENCY = 16
+
+_session = None
+_session_lock = threading.Lock()
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+
+
+# Function to return the shared session, creating it on first use
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=32, pool_maxsize=PER_HOST_CONCURRENCY, pool_block=True)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+            _session = session
+        return _session
+
+
+# Function to get the semaphore limiting concurrent requests to a host
+def _host_slot(url):
+    host = urlparse(url).netloc.lower()
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(PER_HOST_CONCURRENCY)
+        return _host_slots[host]
+
+
+# Function to work out how long to wait before the next attempt
+def _retry_delay(attempt, response=None):
+    if response is not None:
+        retry_after = response.headers.get('Retry-After')
+        if retry_after:
+            try:
+                return min(max(float(retry_after), 0), BACKOFF_MAX)
+            except ValueError:
+                pass
+            # An HTTP date instead of seconds; a malformed header falls back to backoff
+            try:
+                retry_date = email.utils.parsedate_to_datetime(retry_after)
+            except (TypeError, ValueError):
+                retry_date = None
+            if retry_date is not None:
+                return min(max(retry_date.timestamp() - time.time(), 0), BACKOFF_MAX)
+    # Full jitter keeps many workers from retrying in lockstep
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+# Function to tell whether a connection error happened before the request was sent
+def _not_sent(error):
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+
+# Function to hold the host slot until a streamed response is closed
+def _release_on_close(response, slot):
+    close = response.close
+    released = []
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            if not released:
+                released.append(True)
+                slot.release()
+
+    response.close = close_and_release
+    return response
+
+
+# Function to send a request with pooling, a timeout and retries
+# Returns the last response once retries are exhausted, so callers can still inspect status_code
+# Streamed responses keep their host slot until closed; use them as a context manager
+# idempotent defaults from the method; pass True for POSTs that are safe to repeat (e.g. queries)
+def request(method, url, max_attempts=MAX_ATTEMPTS, idempotent=None, **kwargs):
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    session = get_session()
+    slot = _host_slot(url)
+
+    for attempt in range(max_attempts):
+        last_attempt = attempt == max_attempts - 1
+        slot.acquire()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            slot.release()
+            # After a read timeout or a dropped connection the server may already have acted
+            if last_attempt or not (idempotent or _not_sent(e)):
+                raise
+            time.sleep(_retry_delay(attempt))
+            continue
+        except Exception:
+            slot.release()
+            raise
+
+        retry_statuses = RETRY_STATUSES if idempotent else UNPROCESSED_STATUSES
+        if response.status_code in retry_statuses and not last_attempt:
+            delay = _retry_delay(attempt, response)
+            response.close()
+            slot.release()
+            time.sleep(delay)
+            continue
+
+        if kwargs.get('stream'):
+            return _release_on_close(response, slot)
+        slot.release()
+        return response
+
+
+# Function to send a GET request through the shared session
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+
+# Function to send a POST request through the shared session
+def post(url, **kwargs):
+    return request('POST', url, **kwargs)
@@ -0,0 +1,181 @@
+import datetime
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import deque
+
+# Job scheduler for the launcher.
+# Jobs wait in a priority queue (lower number first, then in submission order) and a fixed
+# number of dispatcher threads run them, so a burst of clicks queues up instead of starting
+# one heavy process each. Every job keeps its state (queued/running/done/failed), exit code,
+# timings and the last lines of its output, which follow() streams as they arrive.
+
+# Number of jobs running at the same time
+DEFAULT_MAX_RUNNING = 2
+
+# Number of jobs allowed to wait; submissions past this are refused
+DEFAULT_MAX_QUEUED = 20
+
+# Number of finished jobs kept for the status API
+DEFAULT_HISTORY = 100
+
+# Default priority of a job (lower runs first)
+DEFAULT_PRIORITY = 10
+
+# Lines of output kept per job
+OUTPUT_LINES = 2000
+
+# Seconds follow() waits for new output before yielding a keep-alive
+FOLLOW_KEEPALIVE = 15
+
+FINISHED_STATES = ('done', 'failed')
+
+
+# Raised when the queue is full
+class QueueFull(Exception):
+    pass
+
+
+# Function to format a timestamp for the status API
+def _timestamp(value):
+    return datetime.datetime.fromtimestamp(value).isoformat(timespec='seconds') if value else None
+
+
+# One scheduled run; start(job) is called on a dispatcher thread and returns a Popen with stdout piped
+class Job:
+    def __init__(self, name, start, priority=DEFAULT_PRIORITY):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.priority = priority
+        self.start = start
+        self.state = 'queued'
+        self.exit_code = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self._lines = deque(maxlen=OUTPUT_LINES)
+        self._line_total = 0
+        self._changed = threading.Condition()
+
+    # Function to add a line of output and wake up followers
+    def output(self, line):
+        with self._changed:
+            self._lines.append(line)
+            self._line_total += 1
+            self._changed.notify_all()
+
+    # Function to move the job to a new state and wake up followers
+    def _set_state(self, state, exit_code=None, error=None):
+        with self._changed:
+            self.state = state
+            if state == 'running':
+                self.started = time.time()
+            elif state in FINISHED_STATES:
+                self.finished = time.time()
+                self.exit_code = exit_code
+                self.error = error
+            self._changed.notify_all()
+
+    # Function to describe the job for the status API
+    def to_dict(self):
+        end = self.finished or time.time()
+        return {
+            'id': self.id,
+            'name': self.name,
+            'priority': self.priority,
+            'state': self.state,
+            'exit_code': self.exit_code,
+            'error': self.error,
+            'submitted': _timestamp(self.submitted),
+            'started': _timestamp(self.started),
+            'finished': _timestamp(self.finished),
+            'seconds': round(end - self.started, 3) if self.started else None,
+            'lines': self._line_total,
+        }
+
+    # Function to yield ('line', text) for output from line number `since` on and ('state', dict) on every
+    # state change, until the job has finished; yields None after FOLLOW_KEEPALIVE seconds without news
+    def follow(self, since=0):
+        sent_state = None
+        while True:
+            with self._changed:
+                if self._line_total == since and self.state == sent_state:
+                    self._changed.wait(FOLLOW_KEEPALIVE)
+                first = self._line_total - len(self._lines)
+                lines = list(self._lines)[max(0, since - first):]
+                since = self._line_total
+                state = self.state
+            for line in lines:
+                yield 'line', line
+            if state != sent_state:
+                sent_state = state
+                yield 'state', self.to_dict()
+                if state in FINISHED_STATES:
+                    return
+            elif not lines:
+                yield None
+
+
+class JobScheduler:
+    def __init__(self, max_running=DEFAULT_MAX_RUNNING, max_queued=DEFAULT_MAX_QUEUED, history=DEFAULT_HISTORY):
+        self.max_running = max(1, max_running)
+        self.max_queued = max_queued
+        self.history = history
+        self._queue = []
+        self._order = itertools.count()
+        self._jobs = {}
+        self._available = threading.Condition()
+        for _ in range(self.max_running):
+            threading.Thread(target=self._dispatch, daemon=True).start()
+
+    # Function to queue a job; raises QueueFull when max_queued jobs are already waiting
+    def submit(self, name, start, priority=DEFAULT_PRIORITY):
+        job = Job(name, start, priority)
+        with self._available:
+            if len(self._queue) >= self.max_queued:
+                raise QueueFull(f"{len(self._queue)} jobs are already waiting; try again later")
+            self._jobs[job.id] = job
+            heapq.heappush(self._queue, (priority, next(self._order), job))
+            self._prune()
+            self._available.notify()
+        return job
+
+    # Function to look up a job by id (None when unknown or pruned)
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    # Function to list the known jobs, newest first
+    def jobs(self):
+        with self._available:
+            jobs = list(self._jobs.values())
+        return sorted(jobs, key=lambda job: job.submitted, reverse=True)
+
+    # Function to forget the oldest finished jobs past the history size
+    def _prune(self):
+        finished = [job for job in self._jobs.values() if job.state in FINISHED_STATES]
+        finished.sort(key=lambda job: job.finished)
+        for job in finished[:max(0, len(finished) - self.history)]:
+            del self._jobs[job.id]
+
+    # Function run by each dispatcher thread: take the most urgent job and run it to completion
+    def _dispatch(self):
+        while True:
+            with self._available:
+                while not self._queue:
+                    self._available.wait()
+                _, _, job = heapq.heappop(self._queue)
+            job._set_state('running')
+            try:
+                process = job.start(job)
+                for line in process.stdout:
+                    job.output(line.decode('utf-8', 'replace').rstrip('\r\n'))
+                exit_code = process.wait()
+                job._set_state('done' if exit_code == 0 else 'failed', exit_code=exit_code)
+            except Exception as e:
+                job.output(f"Error: {e}")
+                job._set_state('failed', error=str(e))
+            with self._available:
+                self._prune()
@@ -0,0 +1,541 @@
+import json
+import math
+import random
+import re
+import socket
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# Local mock of the ArcGIS REST endpoints the ArcBridge tools call, for the benchmarks.
+# Serves synthetic feature layers (FeatureServer, JSON and PBF), map exports (MapServer) and
+# the multipart upload calls of the sharing API. Features are generated from their object ID
+# and a seed, so a layer of any size costs nothing until it is queried and every run sees the
+# same data. Paging limits, latency and error rates are set per server.
+
+# Name of the mock service under /arcgis/rest/services
+SERVICE_NAME = 'Bench'
+
+# Page size of layers that do not set their own
+DEFAULT_MAX_RECORD_COUNT = 2000
+
+# Extent the synthetic features are spread over (Web Mercator meters)
+EXTENT = {'xmin': -8300000.0, 'ymin': 4900000.0, 'xmax': -8100000.0, 'ymax': 5100000.0,
+          'spatialReference': {'wkid': 102100, 'latestWkid': 3857}}
+
+# Size of a generated feature, in meters
+FEATURE_RADIUS = 250.0
+
+# Ground resolution of PBF coordinates, in meters
+PBF_RESOLUTION = 0.001
+
+# Largest export the map service renders in one request
+MAX_IMAGE_SIZE = 4096
+
+# Bytes of encoded responses kept so repeated page requests skip the encoding
+RESPONSE_CACHE_BYTES = 512 * 1024 ** 2
+
+# Status sent for an injected error; clients retry it
+ERROR_STATUS = 503
+
+_GEOMETRY_TYPES = {
+    'point': 'esriGeometryPoint',
+    'polyline': 'esriGeometryPolyline',
+    'polygon': 'esriGeometryPolygon',
+}
+
+# Types of the extra attribute fields, in turn
+_EXTRA_FIELD_TYPES = ('esriFieldTypeString', 'esriFieldTypeInteger', 'esriFieldTypeDouble', 'esriFieldTypeDate')
+
+# Field type and geometry type numbers of the PBF feature collection format
+_PBF_FIELD_TYPES = {
+    'esriFieldTypeSmallInteger': 0, 'esriFieldTypeInteger': 1, 'esriFieldTypeSingle': 2, 'esriFieldTypeDouble': 3,
+    'esriFieldTypeString': 4, 'esriFieldTypeDate': 5, 'esriFieldTypeOID': 6, 'esriFieldTypeGeometry': 7,
+}
+_PBF_GEOMETRY_TYPES = {'esriGeometryPoint': 0, 'esriGeometryMultipoint': 1, 'esriGeometryPolyline': 2,
+                       'esriGeometryPolygon': 3}
+
+_OID_CONDITION = re.compile(r'OBJECTID\s*(>=|<=|>|<|=)\s*(\d+)', re.IGNORECASE)
+
+
+# A synthetic layer: geometry type, size, vertices per part, parts per feature and extra fields
+class LayerSpec:
+    def __init__(self, layer_id, name, geometry='polygon', features=10000, vertices=32, parts=1, fields=8,
+                 max_record_count=DEFAULT_MAX_RECORD_COUNT, seed=0):
+        if geometry not in _GEOMETRY_TYPES:
+            raise ValueError(f"geometry must be one of {', '.join(_GEOMETRY_TYPES)}")
+        self.id = layer_id
+        self.name = name
+        self.geometry = geometry
+        self.features = features
+        self.vertices = max(2 if geometry == 'polyline' else 3, vertices)
+        self.parts = max(1, parts)
+        self.max_record_count = max_record_count
+        self.seed = seed
+        self.fields = [
+            {'name': 'OBJECTID', 'type': 'esriFieldTypeOID', 'alias': 'OBJECTID'},
+            {'name': 'NAME', 'type': 'esriFieldTypeString', 'alias': 'Name', 'length': 64},
+            {'name': 'CATEGORY', 'type': 'esriFieldTypeInteger', 'alias': 'Category'},
+            {'name': 'UPDATED', 'type': 'esriFieldTypeDate', 'alias': 'Updated', 'length': 8},
+        ] + [
+            {'name': f'FIELD_{index}', 'type': _EXTRA_FIELD_TYPES[index % len(_EXTRA_FIELD_TYPES)], 'alias': f'Field {index}'}
+            for index in range(max(0, fields - 4))
+        ]
+
+    # Function to describe the layer like a FeatureServer layer resource
+    def metadata(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'type': 'Feature Layer',
+            'geometryType': _GEOMETRY_TYPES[self.geometry],
+            'objectIdField': 'OBJECTID',
+            'fields': self.fields,
+            'maxRecordCount': self.max_record_count,
+            'extent': EXTENT,
+            'supportedQueryFormats': 'JSON, geoJSON, PBF',
+            'advancedQueryCapabilities': {'supportsPagination': True},
+            'editingInfo': {'lastEditDate': 1700000000000},
+            'description': f'Synthetic {self.geometry} layer with {self.features} features',
+        }
+
+    # Function to generate one feature from its object ID
+    def feature(self, oid):
+        rng = random.Random(self.seed * 1000003 + oid)
+        columns = int(math.sqrt(self.features)) + 1
+        cx = EXTENT['xmin'] + (oid % columns + 0.5) * (EXTENT['xmax'] - EXTENT['xmin']) / columns
+        cy = EXTENT['ymin'] + (oid // columns + 0.5) * (EXTENT['ymax'] - EXTENT['ymin']) / columns
+        attributes = {
+            'OBJECTID': oid,
+            'NAME': f'Feature {oid}',
+            'CATEGORY': oid % 17,
+            'UPDATED': 1600000000000 + oid * 60000,
+        }
+        for field in self.fields[4:]:
+            field_type = field['type']
+            if field_type == 'esriFieldTypeString':
+                attributes[field['name']] = f'{field["name"].lower()}-{rng.randrange(100000)}'
+            elif field_type == 'esriFieldTypeInteger':
+                attributes[field['name']] = rng.randrange(1000000)
+            elif field_type == 'esriFieldTypeDouble':
+                attributes[field['name']] = round(rng.uniform(0, 1000), 3)
+            else:
+                attributes[field['name']] = 1600000000000 + rng.randrange(10 ** 10)
+        return {'attributes': attributes, 'geometry': self._geometry(rng, cx, cy)}
+
+    # Function to generate a geometry around a center point
+    def _geometry(self, rng, cx, cy):
+        if self.geometry == 'point':
+            return {'x': round(cx + rng.uniform(-FEATURE_RADIUS, FEATURE_RADIUS), 3),
+                    'y': round(cy + rng.uniform(-FEATURE_RADIUS, FEATURE_RADIUS), 3)}
+        parts = []
+        for part in range(self.parts):
+            radius = FEATURE_RADIUS / (part + 1)
+            if self.geometry == 'polygon':
+                # Clockwise, closed, like an ArcGIS outer ring; later parts are smaller rings beside the first
+                px = cx + part * FEATURE_RADIUS * 2
+                ring = []
+                for index in range(self.vertices):
+                    angle = -2 * math.pi * index / self.vertices
+                    r = radius * rng.uniform(0.8, 1.0)
+                    ring.append([round(px + r * math.cos(angle), 3), round(cy + r * math.sin(angle), 3)])
+                ring.append(ring[0])
+                parts.append(ring)
+            else:
+                x = cx - radius + part * 10
+                y = cy
+                path = []
+                for _ in range(self.vertices):
+                    x += rng.uniform(0, 2 * radius / self.vertices)
+                    y += rng.uniform(-radius, radius) / self.vertices
+                    path.append([round(x, 3), round(y, 3)])
+                parts.append(path)
+        return {'rings' if self.geometry == 'polygon' else 'paths': parts}
+
+    # Function to build an Esri JSON feature set for a list of object IDs
+    def feature_set(self, oids, out_fields=None, exceeded=False):
+        fields = self.fields
+        features = [self.feature(oid) for oid in oids]
+        if out_fields:
+            fields = [field for field in fields if field['name'] in out_fields or field['name'] == 'OBJECTID']
+            names = {field['name'] for field in fields}
+            for feature in features:
+                feature['attributes'] = {key: value for key, value in feature['attributes'].items() if key in names}
+        data = {
+            'objectIdFieldName': 'OBJECTID',
+            'geometryType': _GEOMETRY_TYPES[self.geometry],
+            'spatialReference': EXTENT['spatialReference'],
+            'fields': fields,
+            'features': features,
+        }
+        if exceeded:
+            data['exceededTransferLimit'] = True
+        return data
+
+
+# Function to encode a varint
+def _varint(value):
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+# Function to zigzag-encode a signed integer
+def _zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+# Function to encode a field key
+def _key(number, wire_type):
+    return _varint(number << 3 | wire_type)
+
+
+# Function to encode a length-delimited field
+def _message(number, payload):
+    return _key(number, 2) + _varint(len(payload)) + payload
+
+
+# Function to encode a double field
+def _double(number, value):
+    return _key(number, 1) + struct.pack('<d', value)
+
+
+# Function to encode an attribute value as a PBF Value message
+def _pbf_value(value):
+    if value is None:
+        return b''
+    if isinstance(value, bool):
+        return _key(9, 0) + _varint(int(value))
+    if isinstance(value, int):
+        return _key(8, 0) + _varint(_zigzag(value))
+    if isinstance(value, float):
+        return _double(3, value)
+    return _message(1, str(value).encode('utf-8'))
+
+
+# Function to encode a geometry as a PBF Geometry message with quantized, delta-encoded coordinates
+def _pbf_geometry(geometry, translate_x, translate_y):
+    if 'x' in geometry:
+        parts = [[[geometry['x'], geometry['y']]]]
+    else:
+        parts = geometry.get('rings') or geometry.get('paths') or []
+    coords = []
+    last_x = last_y = 0
+    for part in parts:
+        for x, y in (vertex[:2] for vertex in part):
+            qx = round((x - translate_x) / PBF_RESOLUTION)
+            qy = round((translate_y - y) / PBF_RESOLUTION)
+            coords.append(_zigzag(qx - last_x))
+            coords.append(_zigzag(qy - last_y))
+            last_x, last_y = qx, qy
+    payload = b''
+    if 'x' not in geometry:
+        payload += _message(2, b''.join(_varint(len(part)) for part in parts))
+    return payload + _message(3, b''.join(_varint(value) for value in coords))
+
+
+# Function to encode an Esri JSON query result as a FeatureCollectionPBuffer (f=pbf)
+# Handles feature sets, {'count': n} and {'objectIds': [...]}; the inverse of pbf_features.decode_feature_collection
+def encode_feature_collection(data):
+    if 'count' in data:
+        result = _message(2, _key(1, 0) + _varint(data['count']))
+    elif 'objectIds' in data:
+        ids = _message(1, data.get('objectIdFieldName', 'OBJECTID').encode('utf-8'))
+        ids += _message(3, b''.join(_varint(oid) for oid in data['objectIds']))
+        result = _message(3, ids)
+    else:
+        translate_x, translate_y = EXTENT['xmin'], EXTENT['ymax']
+        spatial_reference = data.get('spatialReference') or {}
+        body = _message(1, data.get('objectIdFieldName', 'OBJECTID').encode('utf-8'))
+        body += _key(7, 0) + _varint(_PBF_GEOMETRY_TYPES.get(data.get('geometryType'), 127))
+        body += _message(8, _key(1, 0) + _varint(spatial_reference.get('wkid', 0))
+                         + _key(2, 0) + _varint(spatial_reference.get('latestWkid', 0)))
+        if data.get('exceededTransferLimit'):
+            body += _key(9, 0) + _varint(1)
+        body += _message(12, _message(2, _double(1, PBF_RESOLUTION) + _double(2, PBF_RESOLUTION))
+                         + _message(3, _double(1, translate_x) + _double(2, translate_y)))
+        names = []
+        for field in data.get('fields') or []:
+            names.append(field['name'])
+            body += _message(13, _message(1, field['name'].encode('utf-8'))
+                             + _key(2, 0) + _varint(_PBF_FIELD_TYPES.get(field['type'], 4))
+                             + _message(3, field.get('alias', field['name']).encode('utf-8')))
+        for feature in data.get('features') or []:
+            attributes = feature.get('attributes') or {}
+            payload = b''.join(_message(1, _pbf_value(attributes.get(name))) for name in names)
+            if feature.get('geometry'):
+                payload += _message(2, _pbf_geometry(feature['geometry'], translate_x, translate_y))
+            body += _message(15, payload)
+        result = _message(1, body)
+    return _message(2, result)
+
+
+# Function to render a PNG of the requested size (a gradient, so it compresses like a real map)
+def render_png(width, height):
+    row = bytes((x * 255 // max(1, width - 1), 128, 200, 255)[channel] for x in range(width) for channel in range(4))
+    raw = b''.join(b'\x00' + row for _ in range(height))
+
+    def chunk(kind, payload):
+        return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+# Function to pick the object IDs a where clause selects (only object ID comparisons are understood)
+def _select_oids(where, feature_count):
+    low, high = 1, feature_count
+    for operator, value in _OID_CONDITION.findall(where or ''):
+        value = int(value)
+        if operator == '>=':
+            low = max(low, value)
+        elif operator == '>':
+            low = max(low, value + 1)
+        elif operator == '<=':
+            high = min(high, value)
+        elif operator == '<':
+            high = min(high, value - 1)
+        else:
+            low, high = max(low, value), min(high, value)
+    return range(low, high + 1)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body go out as separate writes; without TCP_NODELAY every response waits on a delayed ACK
+    def setup(self):
+        super().setup()
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.mock.handle(self, {})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        form = {}
+        if 'application/x-www-form-urlencoded' in (self.headers.get('Content-Type') or ''):
+            form = dict(parse_qsl(body.decode('utf-8')))
+        self.server.mock.handle(self, form, len(body))
+
+
+# Mock ArcGIS server on a local port; use as a context manager or call start() and stop()
+# latency (+ up to jitter) seconds are added to every request; error_rate is the share answered with ERROR_STATUS
+class MockArcGISServer:
+    def __init__(self, layers, latency=0.0, jitter=0.0, error_rate=0.0, seed=0, host='127.0.0.1', port=0):
+        self.layers = {layer.id: layer for layer in layers}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._responses = {}
+        self._response_bytes = 0
+        self._items = {}
+        self._tokens = {}
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.mock = self
+        self._thread = None
+        self.reset_stats()
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    # Function to get the URL of the mock service ('FeatureServer' or 'MapServer')
+    def service_url(self, kind='FeatureServer'):
+        return f'{self.url}/arcgis/rest/services/{SERVICE_NAME}/{kind}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    # Function to clear the request statistics
+    def reset_stats(self):
+        with self._lock:
+            self._stats = {'requests': 0, 'errors': 0, 'bytes_sent': 0, 'bytes_received': 0}
+
+    # Function to read the request statistics
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    # Function to count a request
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._stats[key] += amount
+
+    # Function to send a response body
+    def _send(self, handler, body, content_type='application/json', status=200, headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body, separators=(',', ':')).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+        self._count('bytes_sent', len(body))
+
+    # Function to answer one request
+    def handle(self, handler, form, received=0):
+        self._count('requests')
+        self._count('bytes_received', received)
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+        with self._lock:
+            failed = self.error_rate and self._random.random() < self.error_rate
+        if failed:
+            self._count('errors')
+            self._send(handler, {'error': {'code': ERROR_STATUS, 'message': 'Injected error'}},
+                       status=ERROR_STATUS, headers={'Retry-After': '0'})
+            return
+
+        parts = urlsplit(handler.path)
+        params = dict(parse_qsl(parts.query), **form)
+        path = parts.path.rstrip('/')
+        try:
+            if path.startswith('/sharing/rest'):
+                self._send(handler, self._sharing(path[len('/sharing/rest'):], params, handler.headers.get('Referer')))
+                return
+            match = re.match(rf'/arcgis/rest/services/{SERVICE_NAME}/(FeatureServer|MapServer)(?:/(.*))?$', path)
+            if match is None:
+                self._send(handler, {'error': {'code': 404, 'message': 'Not found'}}, status=404)
+                return
+            kind, rest = match.group(1), match.group(2) or ''
+            if kind == 'MapServer':
+                self._map_server(handler, rest, params)
+            else:
+                self._feature_server(handler, rest, params)
+        except (KeyError, ValueError) as e:
+            self._send(handler, {'error': {'code': 400, 'message': f'Invalid request: {e}'}})
+
+    # Function to describe the service
+    def _service_info(self):
+        return {
+            'currentVersion': 11.1,
+            'units': 'esriMeters',
+            'maxImageWidth': MAX_IMAGE_SIZE,
+            'maxImageHeight': MAX_IMAGE_SIZE,
+            'fullExtent': EXTENT,
+            'layers': [{'id': layer.id, 'name': layer.name, 'geometryType': layer.metadata()['geometryType']}
+                       for layer in self.layers.values()],
+            'tables': [],
+        }
+
+    # Function to answer FeatureServer requests
+    def _feature_server(self, handler, rest, params):
+        if rest == '':
+            self._send(handler, self._service_info())
+        elif rest == 'layers':
+            self._send(handler, {'layers': [layer.metadata() for layer in self.layers.values()], 'tables': []})
+        elif rest.isdigit():
+            self._send(handler, self.layers[int(rest)].metadata())
+        elif rest.endswith('/query') and rest.split('/')[0].isdigit():
+            layer = self.layers[int(rest.split('/')[0])]
+            pbf = params.get('f') == 'pbf'
+            cache_key = (layer.id, tuple(sorted(params.items())))
+            body = self._responses.get(cache_key)
+            if body is None:
+                result = self._query(layer, params)
+                body = encode_feature_collection(result) if pbf else json.dumps(result, separators=(',', ':')).encode('utf-8')
+                with self._lock:
+                    if self._response_bytes + len(body) <= RESPONSE_CACHE_BYTES:
+                        self._responses[cache_key] = body
+                        self._response_bytes += len(body)
+            self._send(handler, body, 'application/x-protobuf' if pbf else 'application/json')
+        else:
+            self._send(handler, {'error': {'code': 404, 'message': 'Not found'}})
+
+    # Function to run a layer query
+    def _query(self, layer, params):
+        oids = _select_oids(params.get('where'), layer.features)
+        if str(params.get('returnCountOnly')).lower() == 'true':
+            return {'count': len(oids)}
+        if params.get('outStatistics'):
+            return {'features': [{'attributes': {'MIN_OID': oids[0] if oids else None, 'MAX_OID': oids[-1] if oids else None}}]}
+        if str(params.get('returnIdsOnly')).lower() == 'true':
+            return {'objectIdFieldName': 'OBJECTID', 'objectIds': list(oids)}
+        offset = int(params.get('resultOffset') or 0)
+        limit = min(int(params.get('resultRecordCount') or layer.max_record_count), layer.max_record_count)
+        selected = oids[offset:offset + limit]
+        out_fields = params.get('outFields', '*')
+        out_fields = None if out_fields == '*' else set(out_fields.split(','))
+        return layer.feature_set(selected, out_fields, exceeded=len(oids) - offset > limit)
+
+    # Function to answer MapServer requests
+    def _map_server(self, handler, rest, params):
+        if rest == '':
+            self._send(handler, self._service_info())
+        elif rest == 'export':
+            width, height = (int(value) for value in params.get('size', '400,400').split(','))
+            if width > MAX_IMAGE_SIZE or height > MAX_IMAGE_SIZE:
+                self._send(handler, {'error': {'code': 400, 'message': 'Requested image is too large'}})
+                return
+            cache_key = ('export', width, height)
+            body = self._responses.get(cache_key)
+            if body is None:
+                body = self._responses[cache_key] = render_png(width, height)
+            self._send(handler, body, 'image/png')
+        else:
+            self._send(handler, {'error': {'code': 404, 'message': 'Not found'}})
+
+    # Function to answer the token and multipart upload calls of the sharing API
+    # Like a portal, calls made with a referer-bound token are rejected unless they send that Referer
+    # (multipart form bodies are not parsed, so their Referer is checked against every issued token)
+    def _sharing(self, path, params, referer=None):
+        if path == '/generateToken':
+            token = f'mock-token-{uuid.uuid4().hex}'
+            with self._lock:
+                self._tokens[token] = params.get('referer') if params.get('client') == 'referer' else None
+            return {'token': token, 'expires': int((time.time() + 7200) * 1000), 'ssl': False}
+        with self._lock:
+            if 'token' in params:
+                bound = {self._tokens.get(params['token'])} - {None}
+            else:
+                bound = set(self._tokens.values()) - {None}
+        if bound and referer not in bound:
+            return {'error': {'code': 498, 'message': 'Invalid token.'}}
+        if path.endswith('/addItem'):
+            item_id = uuid.uuid4().hex
+            with self._lock:
+                self._items[item_id] = {'parts': 0, 'status': 'partial'}
+            return {'success': True, 'id': item_id}
+        match = re.search(r'/items/([0-9a-f]+)/(addPart|commit|status|update)$', path)
+        if match is None:
+            return {'error': {'code': 404, 'message': 'Not found'}}
+        item_id, action = match.groups()
+        with self._lock:
+            item = self._items.setdefault(item_id, {'parts': 0, 'status': 'partial'})
+            if action == 'addPart':
+                item['parts'] += 1
+            elif action == 'commit':
+                item['status'] = 'completed'
+            elif action == 'status':
+                return {'itemId': item_id, 'status': item['status']}
+        return {'success': True, 'id': item_id}
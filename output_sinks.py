@@ -0,0 +1,588 @@
+import datetime
+import json
+import os
+import sqlite3
+import struct
+import threading
+from array import array
+from collections import defaultdict
+from contextlib import closing, contextmanager
+
+import numpy as np
+
+import run_metrics
+
+try:
+    import arcpy
+except ImportError:  # Only the file geodatabase sink needs ArcGIS; GeoPackage output works without it
+    arcpy = None
+
+# Output sinks for REST-to-GDB downloads.
+# A sink owns the output a layer is written to. The file geodatabase sink loads a staged Esri JSON
+# file with arcpy, as the tool always has. The GeoPackage sink writes the downloaded pages straight
+# into a SQLite database with batched inserts, so extraction runs without ArcGIS or staging files.
+# The sink is picked from the output path: .gpkg/.sqlite files get a GeoPackage, anything else is
+# treated as a file geodatabase. register_sink adds other backends by extension.
+#
+# Every sink offers target(name), exists(target), lock(), apply_metadata(...), source_ids(...),
+# delete_source_ids(...) and append(...). Sinks with streaming = True take pages through
+# write_pages(target, pages); the others load a staging file with load_file(target, json_path).
+
+# Features inserted per GeoPackage transaction
+INSERT_BATCH_SIZE = 5000
+
+# Seconds a GeoPackage connection waits for another writer
+SQLITE_TIMEOUT = 60
+
+# GeoPackage header values: application id 'GPKG' and version 1.2
+GPKG_APPLICATION_ID = 0x47504B47
+GPKG_USER_VERSION = 10200
+
+# Names of the feature id and geometry columns of GeoPackage tables
+GPKG_FID_COLUMN = 'fid'
+GPKG_GEOMETRY_COLUMN = 'geom'
+
+WGS84_WKT = ('GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],'
+             'AUTHORITY["EPSG","6326"]],PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],'
+             'UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AUTHORITY["EPSG","4326"]]')
+
+# Core GeoPackage tables, created when missing
+_GPKG_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (
+        srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL,
+        organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)""",
+    """CREATE TABLE IF NOT EXISTS gpkg_contents (
+        table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE,
+        description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')),
+        min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER,
+        CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))""",
+    """CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (
+        table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL,
+        srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL,
+        CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name),
+        CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name),
+        CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))""",
+    """CREATE TABLE IF NOT EXISTS gpkg_extensions (
+        table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL,
+        scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))""",
+)
+
+# Spatial reference rows every GeoPackage must have
+_GPKG_REQUIRED_SRS = (
+    ('WGS 84 geodetic', 4326, 'EPSG', 4326, WGS84_WKT, 'longitude/latitude coordinates in decimal degrees'),
+    ('Undefined cartesian SRS', -1, 'NONE', -1, 'undefined', 'undefined cartesian coordinate reference system'),
+    ('Undefined geographic SRS', 0, 'NONE', 0, 'undefined', 'undefined geographic coordinate reference system'),
+)
+
+# Esri geometry type -> (GeoPackage geometry type name, WKB type code)
+_GPKG_GEOMETRY_TYPES = {
+    'esriGeometryPoint': ('POINT', 1),
+    'esriGeometryMultipoint': ('MULTIPOINT', 4),
+    'esriGeometryPolyline': ('MULTILINESTRING', 5),
+    'esriGeometryPolygon': ('MULTIPOLYGON', 6),
+}
+
+_WKB_LINESTRING = 2
+_WKB_POLYGON = 3
+
+# Esri field type -> GeoPackage column type
+_GPKG_FIELD_TYPES = {
+    'esriFieldTypeSmallInteger': 'SMALLINT',
+    'esriFieldTypeInteger': 'INTEGER',
+    'esriFieldTypeBigInteger': 'INTEGER',
+    'esriFieldTypeSingle': 'FLOAT',
+    'esriFieldTypeDouble': 'DOUBLE',
+    'esriFieldTypeDate': 'DATETIME',
+    'esriFieldTypeDateOnly': 'DATE',
+    'esriFieldTypeBlob': 'BLOB',
+}
+
+# Field types the output gets on its own (the feature id) or stores separately (the shape)
+_SKIPPED_FIELD_TYPES = ('esriFieldTypeOID', 'esriFieldTypeGeometry')
+
+# GeoPackage binary header: magic, version, flags (little endian, xy envelope), srs id, envelope
+_GPKG_HEADER = struct.Struct('<2sBBi4d')
+_GPKG_HEADER_FLAGS = 0b011
+
+_WKB_COUNT = struct.Struct('<I')
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# One lock per output, since a file geodatabase does not allow concurrent schema changes and SQLite has one writer
+_output_locks = defaultdict(threading.RLock)
+_output_locks_lock = threading.Lock()
+
+# Sinks already opened, by output path
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+# Function to get the lock serializing writes to one output (re-entrant, so a sync can hold it around its writes)
+def get_output_lock(path):
+    with _output_locks_lock:
+        return _output_locks[os.path.normcase(os.path.abspath(path))]
+
+
+# Writes feature classes into a file geodatabase through a staged Esri JSON file
+class GeodatabaseSink:
+    streaming = False
+
+    def __init__(self, path, log=print):
+        if arcpy is None:
+            raise RuntimeError(f"Writing to {path} needs arcpy (ArcGIS Pro); choose a .gpkg output to run without it")
+        self.path = path
+        self.log = log
+
+    # Function to name the output of a layer
+    def target(self, name):
+        return os.path.join(self.path, f'{name}_fc')
+
+    def exists(self, target):
+        return arcpy.Exists(target)
+
+    def lock(self):
+        return get_output_lock(self.path)
+
+    # Function to create (or overwrite) a feature class from a staged Esri JSON file
+    def load_file(self, target, json_path):
+        arcpy.JSONToFeatures_conversion(json_path, target)
+
+    # Function to copy the layer's description onto the feature class metadata
+    def apply_metadata(self, target, metadata, layer_name):
+        fc_metadata = arcpy.metadata.Metadata(target)
+        fc_metadata.title = metadata.get("name", layer_name)
+        fc_metadata.tags = metadata.get("type", "Layer")
+        fc_metadata.summary = metadata.get("description", "No description provided.")
+        fc_metadata.credits = metadata.get("copyrightText", "")
+        fc_metadata.save()
+
+    # Function to read every value of the source ID field
+    def source_ids(self, target, field):
+        return {row[0] for row in arcpy.da.SearchCursor(target, [field])}
+
+    # Function to delete the rows whose source ID is in ids
+    def delete_source_ids(self, target, field, ids):
+        with arcpy.da.UpdateCursor(target, [field]) as update_cursor:
+            for row in update_cursor:
+                if row[0] in ids:
+                    update_cursor.deleteRow()
+
+    # Function to append an Esri JSON feature set to an existing feature class, staged at staging_path
+    def append(self, target, data, staging_path):
+        with run_metrics.span('staging_write') as write_span:
+            with open(staging_path, 'w') as f:
+                json.dump(data, f)
+            write_span.add(bytes=os.path.getsize(staging_path))
+        delta_fc = f"memory\\{os.path.basename(target)}_delta"
+        with run_metrics.span('json_to_features') as convert_span:
+            arcpy.JSONToFeatures_conversion(staging_path, delta_fc)
+            convert_span.add(features=len(data['features']))
+        with run_metrics.span('append'):
+            arcpy.management.Append(delta_fc, target, 'NO_TEST')
+            arcpy.management.Delete(delta_fc)
+
+
+# Function to turn an Esri date (epoch milliseconds) into a GeoPackage DATETIME string
+def _gpkg_datetime(value):
+    if not isinstance(value, (int, float)):
+        return value
+    moment = _EPOCH + datetime.timedelta(milliseconds=value)
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + f"{moment.microsecond // 1000:03d}Z"
+
+
+# Function to turn an Esri date-only value into a GeoPackage DATE string
+def _gpkg_date(value):
+    if not isinstance(value, (int, float)):
+        return value
+    return (_EPOCH + datetime.timedelta(milliseconds=value)).strftime('%Y-%m-%d')
+
+
+# Converters for attribute values that are stored differently from the Esri JSON
+_VALUE_CONVERTERS = {
+    'esriFieldTypeDate': _gpkg_datetime,
+    'esriFieldTypeDateOnly': _gpkg_date,
+}
+
+
+# Function to quote an SQL identifier
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+# Function to run statements in one write transaction, taking the write lock up front
+@contextmanager
+def _transaction(connection):
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    connection.execute('COMMIT')
+
+
+# Function to turn a list of Esri vertices into an (n, dims) float array; None when there are no vertices
+def _coords(vertices, dims):
+    if not vertices:
+        return None
+    try:
+        coords = np.array(vertices, dtype=np.float64)
+    except ValueError:  # Ragged vertices (a missing z or m): pad them out
+        coords = np.array([list(vertex[:dims]) + [None] * (dims - len(vertex)) for vertex in vertices], dtype=np.float64)
+    if coords.ndim != 2 or coords.shape[1] < 2:
+        return None
+    if coords.shape[1] > dims:
+        coords = coords[:, :dims]
+    elif coords.shape[1] < dims:
+        coords = np.hstack([coords, np.full((len(coords), dims - coords.shape[1]), np.nan)])
+    return np.ascontiguousarray(coords)
+
+
+# Function to encode a coordinate sequence (count + vertices)
+def _wkb_points(coords):
+    return _WKB_COUNT.pack(len(coords)) + coords.tobytes()
+
+
+# Function to group Esri rings into polygons: clockwise rings are outer rings, counter-clockwise rings
+# are holes of the outer ring before them (the order ArcGIS writes them in)
+def _polygons(rings):
+    polygons = []
+    for coords in rings:
+        x = coords[:, 0]
+        y = coords[:, 1]
+        twice_area = np.dot(x[:-1], y[1:]) - np.dot(x[1:], y[:-1])
+        if twice_area < 0 or not polygons:
+            polygons.append([coords])
+        else:
+            polygons[-1].append(coords)
+    return polygons
+
+
+# Column layout of a GeoPackage feature table, and the encoder for its rows
+class _TableLayout:
+    def __init__(self, page, srs_id):
+        self.columns = []
+        taken = {GPKG_FID_COLUMN, GPKG_GEOMETRY_COLUMN}
+        for field in page.get('fields') or []:
+            name = field.get('name')
+            if not name or field.get('type') in _SKIPPED_FIELD_TYPES:
+                continue
+            column = name
+            while column.lower() in taken:
+                column = f'{column}_1'
+            taken.add(column.lower())
+            self.columns.append((column, name, _GPKG_FIELD_TYPES.get(field.get('type'), 'TEXT'),
+                                 _VALUE_CONVERTERS.get(field.get('type'))))
+
+        geometry_type = page.get('geometryType')
+        features = page.get('features') or []
+        has_geometry = geometry_type in _GPKG_GEOMETRY_TYPES and any('geometry' in feature for feature in features)
+        self.geometry_type = geometry_type if has_geometry else None
+        self.has_z = bool(page.get('hasZ'))
+        self.has_m = bool(page.get('hasM'))
+        self.dims = 2 + self.has_z + self.has_m
+        self.srs_id = srs_id
+        if self.geometry_type:
+            type_name, base_code = _GPKG_GEOMETRY_TYPES[self.geometry_type]
+            self.geometry_type_name = type_name
+            self._wkb_code = base_code + 1000 * self.has_z + 2000 * self.has_m
+            self._part_code = {'esriGeometryMultipoint': 1, 'esriGeometryPolyline': _WKB_LINESTRING,
+                               'esriGeometryPolygon': _WKB_POLYGON}.get(self.geometry_type, base_code)
+            self._part_code += 1000 * self.has_z + 2000 * self.has_m
+
+    # Function to keep only the columns an existing table has
+    def restrict(self, existing_columns):
+        existing = {column.lower() for column in existing_columns}
+        self.columns = [column for column in self.columns if column[0].lower() in existing]
+
+    # Function to build the CREATE TABLE statement
+    def create_sql(self, table):
+        definitions = [f'{_quote(GPKG_FID_COLUMN)} INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL']
+        if self.geometry_type:
+            definitions.append(f'{_quote(GPKG_GEOMETRY_COLUMN)} {self.geometry_type_name}')
+        definitions += [f'{_quote(column)} {column_type}' for column, _, column_type, _ in self.columns]
+        return f'CREATE TABLE {_quote(table)} ({", ".join(definitions)})'
+
+    # Function to build the INSERT statement
+    def insert_sql(self, table):
+        names = [GPKG_FID_COLUMN] + ([GPKG_GEOMETRY_COLUMN] if self.geometry_type else []) + [column[0] for column in self.columns]
+        return (f'INSERT INTO {_quote(table)} ({", ".join(_quote(name) for name in names)}) '
+                f'VALUES ({", ".join("?" * len(names))})')
+
+    # Function to encode features into rows (without the feature id) and envelopes (minx, maxx, miny, maxy or None)
+    def rows(self, features):
+        rows = []
+        envelopes = []
+        attribute_columns = [(name, convert) for _, name, _, convert in self.columns]
+        for feature in features:
+            attributes = feature.get('attributes') or {}
+            row = [convert(attributes.get(name)) if convert else attributes.get(name) for name, convert in attribute_columns]
+            if self.geometry_type:
+                blob, envelope = self.encode(feature.get('geometry'))
+                row.insert(0, blob)
+                envelopes.append(envelope)
+            rows.append(row)
+        return rows, envelopes
+
+    # Function to encode an Esri JSON geometry as a GeoPackage geometry blob; returns (blob, envelope)
+    def encode(self, geometry):
+        if not geometry:
+            return None, None
+        dims = self.dims
+        if self.geometry_type == 'esriGeometryPoint':
+            if geometry.get('x') is None or geometry.get('x') == 'NaN':
+                return None, None
+            vertex = [geometry['x'], geometry['y']]
+            if self.has_z:
+                vertex.append(geometry.get('z'))
+            if self.has_m:
+                vertex.append(geometry.get('m'))
+            parts = [_coords([vertex], dims)]
+            body = parts[0].tobytes()
+        elif self.geometry_type == 'esriGeometryMultipoint':
+            parts = [_coords(geometry.get('points'), dims)]
+            if parts[0] is None:
+                return None, None
+            point_header = struct.pack('<BI', 1, self._part_code)
+            body = _WKB_COUNT.pack(len(parts[0])) + b''.join(point_header + vertex.tobytes() for vertex in parts[0])
+        elif self.geometry_type == 'esriGeometryPolyline':
+            parts = [coords for coords in (_coords(path, dims) for path in geometry.get('paths') or []) if coords is not None]
+            if not parts:
+                return None, None
+            line_header = struct.pack('<BI', 1, self._part_code)
+            body = _WKB_COUNT.pack(len(parts)) + b''.join(line_header + _wkb_points(coords) for coords in parts)
+        else:
+            parts = [coords for coords in (_coords(ring, dims) for ring in geometry.get('rings') or [])
+                     if coords is not None and len(coords) >= 3]
+            if not parts:
+                return None, None
+            polygons = _polygons(parts)
+            polygon_header = struct.pack('<BI', 1, self._part_code)
+            body = _WKB_COUNT.pack(len(polygons)) + b''.join(
+                polygon_header + _WKB_COUNT.pack(len(rings)) + b''.join(_wkb_points(ring) for ring in rings)
+                for rings in polygons
+            )
+
+        xy = parts[0][:, :2] if len(parts) == 1 else np.concatenate([coords[:, :2] for coords in parts])
+        minx, miny = xy.min(axis=0)
+        maxx, maxy = xy.max(axis=0)
+        header = _GPKG_HEADER.pack(b'GP', 0, _GPKG_HEADER_FLAGS, self.srs_id, minx, maxx, miny, maxy)
+        return header + struct.pack('<BI', 1, self._wkb_code) + body, (minx, maxx, miny, maxy)
+
+
+# Writes feature tables into a GeoPackage (SQLite) file, straight from the downloaded pages
+# Inserts run in batches of INSERT_BATCH_SIZE per transaction in WAL mode; the R-tree spatial
+# index and the table extent are built once the last page is in
+class GeoPackageSink:
+    streaming = True
+
+    def __init__(self, path, log=print):
+        self.path = path
+        self.log = log
+        self._initialize()
+
+    # Function to open a connection in autocommit mode (transactions are explicit)
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    # Function to create the GeoPackage tables the first time the file is used
+    def _initialize(self):
+        with self.lock(), closing(self._connect()) as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(f'PRAGMA application_id={GPKG_APPLICATION_ID}')
+            connection.execute(f'PRAGMA user_version={GPKG_USER_VERSION}')
+            with _transaction(connection):
+                for statement in _GPKG_SCHEMA:
+                    connection.execute(statement)
+                connection.executemany('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)', _GPKG_REQUIRED_SRS)
+
+    # Function to name the output of a layer (the table name goes after the file path, like a feature class)
+    def target(self, name):
+        return os.path.join(self.path, name)
+
+    def exists(self, target):
+        with closing(self._connect()) as connection:
+            row = connection.execute('SELECT 1 FROM gpkg_contents WHERE table_name = ?', (os.path.basename(target),)).fetchone()
+        return row is not None
+
+    def lock(self):
+        return get_output_lock(self.path)
+
+    # Function to register the spatial reference of a page and return its srs_id
+    def _srs_id(self, connection, spatial_reference):
+        spatial_reference = spatial_reference or {}
+        wkid = spatial_reference.get('latestWkid') or spatial_reference.get('wkid')
+        if not wkid:
+            return -1
+        # Esri's own codes start at 100000 (e.g. 102100 before it became EPSG:3857)
+        organization = 'ESRI' if wkid >= 100000 else 'EPSG'
+        connection.execute('INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)',
+                           (f'{organization}:{wkid}', wkid, organization, wkid,
+                            spatial_reference.get('wkt') or 'undefined', None))
+        return wkid
+
+    # Function to drop a table with its index and registrations
+    def _drop_table(self, connection, table):
+        connection.execute(f'DROP TABLE IF EXISTS {_quote(table)}')
+        connection.execute(f'DROP TABLE IF EXISTS {_quote(f"rtree_{table}_{GPKG_GEOMETRY_COLUMN}")}')
+        for registry in ('gpkg_extensions', 'gpkg_geometry_columns', 'gpkg_contents'):
+            connection.execute(f'DELETE FROM {registry} WHERE table_name = ?', (table,))
+
+    # Function to create a feature table for the first page and register it
+    def _create_table(self, connection, table, page):
+        layout = _TableLayout(page, self._srs_id(connection, page.get('spatialReference')))
+        connection.execute(layout.create_sql(table))
+        connection.execute('INSERT INTO gpkg_contents (table_name, data_type, identifier, srs_id) VALUES (?, ?, ?, ?)',
+                           (table, 'features' if layout.geometry_type else 'attributes', table,
+                            layout.srs_id if layout.geometry_type else None))
+        if layout.geometry_type:
+            connection.execute('INSERT INTO gpkg_geometry_columns VALUES (?, ?, ?, ?, ?, ?)',
+                               (table, GPKG_GEOMETRY_COLUMN, layout.geometry_type_name, layout.srs_id,
+                                int(layout.has_z), int(layout.has_m)))
+        return layout
+
+    # Function to describe an existing table with the columns it shares with a page
+    def _existing_layout(self, connection, table, page):
+        geometry_row = connection.execute('SELECT srs_id FROM gpkg_geometry_columns WHERE table_name = ?', (table,)).fetchone()
+        layout = _TableLayout(page, geometry_row[0] if geometry_row else -1)
+        if geometry_row is None:
+            layout.geometry_type = None
+        layout.restrict([row[1] for row in connection.execute(f'PRAGMA table_info({_quote(table)})')])
+        return layout
+
+    # Function to write pages of Esri JSON features into a table, replacing it or appending to it
+    # The table is (re)created from the first page with features; index_fields get an attribute index
+    # Returns the number of features written
+    def write_pages(self, target, pages, replace=True, index_fields=()):
+        table = os.path.basename(target)
+        layout = None
+        insert_sql = None
+        count = 0
+        fids = array('q')
+        envelopes = array('d')
+        with closing(self._connect()) as connection:
+            for page in pages:
+                features = page.get('features') or []
+                if not features:
+                    continue
+                if layout is None:
+                    with self.lock(), _transaction(connection):
+                        if replace:
+                            self._drop_table(connection, table)
+                            layout = self._create_table(connection, table, page)
+                        else:
+                            layout = self._existing_layout(connection, table, page)
+                    insert_sql = layout.insert_sql(table)
+
+                for start in range(0, len(features), INSERT_BATCH_SIZE):
+                    rows, batch_envelopes = layout.rows(features[start:start + INSERT_BATCH_SIZE])
+                    with self.lock(), _transaction(connection):
+                        first_fid = connection.execute(
+                            f'SELECT COALESCE(MAX({_quote(GPKG_FID_COLUMN)}), 0) + 1 FROM {_quote(table)}').fetchone()[0]
+                        connection.executemany(insert_sql, ([first_fid + index] + row for index, row in enumerate(rows)))
+                    for index, envelope in enumerate(batch_envelopes):
+                        if envelope is not None:
+                            fids.append(first_fid + index)
+                            envelopes.extend(envelope)
+                    count += len(rows)
+
+            if layout is not None:
+                with self.lock(), _transaction(connection):
+                    self._finish_table(connection, table, layout, fids, envelopes, index_fields)
+        return count
+
+    # Function to index the new rows, widen the table extent and create the attribute indexes
+    def _finish_table(self, connection, table, layout, fids, envelopes, index_fields):
+        if layout.geometry_type and fids:
+            rtree = _quote(f'rtree_{table}_{GPKG_GEOMETRY_COLUMN}')
+            try:
+                connection.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {rtree} USING rtree(id, minx, maxx, miny, maxy)')
+                connection.executemany(f'INSERT OR REPLACE INTO {rtree} VALUES (?, ?, ?, ?, ?)',
+                                       zip(fids, envelopes[0::4], envelopes[1::4], envelopes[2::4], envelopes[3::4]))
+                connection.execute('INSERT OR IGNORE INTO gpkg_extensions VALUES (?, ?, ?, ?, ?)',
+                                   (table, GPKG_GEOMETRY_COLUMN, 'gpkg_rtree_index',
+                                    'http://www.geopackage.org/spec120/#extension_rtree', 'write-only'))
+            except sqlite3.OperationalError as e:  # SQLite built without the R*Tree module
+                self.log(f"No spatial index for {table}: {e}")
+
+            bounds = np.frombuffer(envelopes, dtype=np.float64).reshape(-1, 4)
+            connection.execute(
+                'UPDATE gpkg_contents SET min_x = MIN(COALESCE(min_x, ?), ?), max_x = MAX(COALESCE(max_x, ?), ?), '
+                'min_y = MIN(COALESCE(min_y, ?), ?), max_y = MAX(COALESCE(max_y, ?), ?) WHERE table_name = ?',
+                tuple(float(value) for value in (bounds[:, 0].min(), bounds[:, 0].min(), bounds[:, 1].max(), bounds[:, 1].max(),
+                                                 bounds[:, 2].min(), bounds[:, 2].min(), bounds[:, 3].max(), bounds[:, 3].max())) + (table,))
+
+        connection.execute("UPDATE gpkg_contents SET last_change = strftime('%Y-%m-%dT%H:%M:%fZ','now') WHERE table_name = ?", (table,))
+        column_names = {column for column, _, _, _ in layout.columns}
+        for field in index_fields:
+            if field in column_names:
+                connection.execute(f'CREATE INDEX IF NOT EXISTS {_quote(f"idx_{table}_{field}")} ON {_quote(table)} ({_quote(field)})')
+
+    # Function to describe the table with the layer's name and description
+    def apply_metadata(self, target, metadata, layer_name):
+        description = metadata.get("description") or metadata.get("name", layer_name)
+        with closing(self._connect()) as connection, _transaction(connection):
+            connection.execute('UPDATE gpkg_contents SET description = ? WHERE table_name = ?',
+                               (description, os.path.basename(target)))
+
+    # Function to read every value of the source ID field
+    def source_ids(self, target, field):
+        with closing(self._connect()) as connection:
+            return {row[0] for row in connection.execute(f'SELECT {_quote(field)} FROM {_quote(os.path.basename(target))}')}
+
+    # Function to delete the rows whose source ID is in ids, with their spatial index entries
+    def delete_source_ids(self, target, field, ids):
+        table = os.path.basename(target)
+        keys = [(value,) for value in ids]
+        with self.lock(), closing(self._connect()) as connection, _transaction(connection):
+            has_rtree = connection.execute(
+                "SELECT 1 FROM gpkg_extensions WHERE table_name = ? AND extension_name = 'gpkg_rtree_index'", (table,)).fetchone()
+            if has_rtree:
+                connection.executemany(
+                    f'DELETE FROM {_quote(f"rtree_{table}_{GPKG_GEOMETRY_COLUMN}")} WHERE id IN '
+                    f'(SELECT {_quote(GPKG_FID_COLUMN)} FROM {_quote(table)} WHERE {_quote(field)} = ?)', keys)
+            connection.executemany(f'DELETE FROM {_quote(table)} WHERE {_quote(field)} = ?', keys)
+
+    # Function to append an Esri JSON feature set to an existing table (no staging file needed)
+    def append(self, target, data, staging_path=None):
+        with run_metrics.span('append') as append_span:
+            count = self.write_pages(target, [data], replace=False)
+            append_span.add(features=count)
+
+
+# Sink class per output file extension; anything else is a file geodatabase
+SINK_TYPES = {
+    '.gpkg': GeoPackageSink,
+    '.sqlite': GeoPackageSink,
+}
+
+
+# Function to add a sink backend for outputs ending in extension
+def register_sink(extension, sink_class):
+    SINK_TYPES[extension.lower()] = sink_class
+
+
+# Function to pick the sink class for an output path
+def sink_class(path):
+    return SINK_TYPES.get(os.path.splitext(path)[1].lower(), GeodatabaseSink)
+
+
+# Function to check that an output can be written: a geodatabase must exist, a file sink's folder must
+def check_output(path):
+    if sink_class(path) is GeodatabaseSink:
+        if not os.path.exists(path):
+            raise ValueError(f"geodatabase path does not exist: {path}")
+    elif not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        raise ValueError(f"output folder does not exist: {os.path.dirname(path)}")
+
+
+# Function to get the sink writing to an output path, shared by every layer writing there
+def open_sink(path, log=print):
+    key = os.path.normcase(os.path.abspath(path))
+    with _sinks_lock:
+        sink = _sinks.get(key)
+        if sink is None:
+            sink = _sinks[key] = sink_class(path)(path, log)
+    return sink
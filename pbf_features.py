@@ -0,0 +1,424 @@
+import struct
+
+import numpy as np
+
+# Decoder for ArcGIS feature service query responses in Protocol Buffer format (f=pbf).
+# The binary FeatureCollectionPBuffer message is read directly from the wire format (no
+# protobuf package or generated code needed) into the same Esri JSON dict a f=json query
+# returns: fields, geometryType, spatialReference, features with attributes and geometry.
+# PBF geometries are always quantized: coordinates are zigzag integers, delta-encoded across
+# the whole geometry and mapped back to real coordinates with the response's transform. The
+# packed coordinates of every feature in a page are decoded together with NumPy, so the
+# per-byte varint work runs in bulk rather than once per vertex in Python.
+
+# Content type a feature service sends with PBF responses
+PBF_CONTENT_TYPE = 'application/x-protobuf'
+
+_GEOMETRY_TYPES = {
+    0: 'esriGeometryPoint',
+    1: 'esriGeometryMultipoint',
+    2: 'esriGeometryPolyline',
+    3: 'esriGeometryPolygon',
+    4: 'esriGeometryMultipatch',
+    127: None,
+}
+
+_FIELD_TYPES = [
+    'esriFieldTypeSmallInteger', 'esriFieldTypeInteger', 'esriFieldTypeSingle', 'esriFieldTypeDouble',
+    'esriFieldTypeString', 'esriFieldTypeDate', 'esriFieldTypeOID', 'esriFieldTypeGeometry',
+    'esriFieldTypeBlob', 'esriFieldTypeRaster', 'esriFieldTypeGUID', 'esriFieldTypeGlobalID',
+    'esriFieldTypeXML', 'esriFieldTypeBigInteger', 'esriFieldTypeDateOnly', 'esriFieldTypeTimeOnly',
+    'esriFieldTypeTimestampOffset',
+]
+
+# Wire types
+_VARINT = 0
+_FIXED64 = 1
+_LENGTH_DELIMITED = 2
+_FIXED32 = 5
+
+_DOUBLE = struct.Struct('<d')
+_FLOAT = struct.Struct('<f')
+
+
+# Function to read a varint at pos; returns (value, next position)
+def _varint(data, pos):
+    byte = data[pos]
+    if byte < 0x80:
+        return byte, pos + 1
+    result = byte & 0x7f
+    shift = 7
+    pos += 1
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+# Function to undo zigzag encoding of a signed integer
+def _zigzag(value):
+    return (value >> 1) ^ -(value & 1)
+
+
+# Function to iterate over the fields of a message in data[start:end]
+# Yields (field number, wire type, value) where value is an int for varints, a (start, end) range for
+# length-delimited fields and the raw bytes for fixed-size fields
+def _fields(data, start=0, end=None):
+    pos = start
+    end = len(data) if end is None else end
+    while pos < end:
+        key, pos = _varint(data, pos)
+        number = key >> 3
+        wire_type = key & 7
+        if wire_type == _VARINT:
+            value, pos = _varint(data, pos)
+        elif wire_type == _LENGTH_DELIMITED:
+            length, pos = _varint(data, pos)
+            value = (pos, pos + length)
+            pos += length
+        elif wire_type == _FIXED64:
+            value = data[pos:pos + 8]
+            pos += 8
+        elif wire_type == _FIXED32:
+            value = data[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type {wire_type} at byte {pos}")
+        yield number, wire_type, value
+
+
+# Function to read a packed repeated varint field
+def _packed_varints(data, start, end):
+    values = []
+    pos = start
+    append = values.append
+    while pos < end:
+        byte = data[pos]
+        if byte < 0x80:
+            append(byte)
+            pos += 1
+        else:
+            value, pos = _varint(data, pos)
+            append(value)
+    return values
+
+
+# Function to decode a UTF-8 string field
+def _string(data, value):
+    return bytes(data[value[0]:value[1]]).decode('utf-8')
+
+
+# Function to decode an attribute Value message
+# A Value holds one field, almost always behind a one-byte key, so that case skips the generic field loop
+def _value(data, start, end):
+    if start == end:
+        return None
+    key = data[start]
+    if key < 0x80 and end - start > 1:
+        number = key >> 3
+        if number == 1:
+            length, pos = _varint(data, start + 1)
+            return str(data[pos:pos + length], 'utf-8')
+        if number == 3:
+            return _DOUBLE.unpack_from(data, start + 1)[0]
+        if number in (4, 8):
+            value = _varint(data, start + 1)[0]
+            return (value >> 1) ^ -(value & 1)
+        if number in (5, 7):
+            return _varint(data, start + 1)[0]
+    for number, wire_type, value in _fields(data, start, end):
+        if number == 1:
+            return _string(data, value)
+        if number == 2:
+            return _FLOAT.unpack(value)[0]
+        if number == 3:
+            return _DOUBLE.unpack(value)[0]
+        if number in (4, 8):
+            return _zigzag(value)
+        if number in (5, 7):
+            return value
+        if number == 6:
+            # int64 is two's complement in a varint
+            return value - (1 << 64) if value >= 1 << 63 else value
+        if number == 9:
+            return bool(value)
+    return None
+
+
+# Function to decode a Field message into an Esri JSON field
+def _field(data, start, end):
+    field = {}
+    for number, _, value in _fields(data, start, end):
+        if number == 1:
+            field['name'] = _string(data, value)
+        elif number == 2:
+            field['type'] = _FIELD_TYPES[value] if value < len(_FIELD_TYPES) else 'esriFieldTypeString'
+        elif number == 3:
+            field['alias'] = _string(data, value)
+    # Like other enums, a type of 0 (small integer) is left off the wire
+    field.setdefault('type', _FIELD_TYPES[0])
+    field.setdefault('alias', field.get('name'))
+    return field
+
+
+# Function to decode a SpatialReference message
+def _spatial_reference(data, start, end):
+    reference = {}
+    names = {1: 'wkid', 2: 'latestWkid', 3: 'vcsWkid', 4: 'latestVcsWkid'}
+    for number, _, value in _fields(data, start, end):
+        if number in names:
+            reference[names[number]] = value
+        elif number == 5:
+            reference['wkt'] = _string(data, value)
+    return reference
+
+
+# Function to decode a Transform message into (origin upper left?, scale x/y/m/z, translate x/y/m/z)
+def _transform(data, start, end):
+    upper_left = True
+    scale = [1.0, 1.0, 1.0, 1.0]
+    translate = [0.0, 0.0, 0.0, 0.0]
+    for number, _, value in _fields(data, start, end):
+        if number == 1:
+            upper_left = value == 0
+        elif number in (2, 3):
+            target = scale if number == 2 else translate
+            for index, wire_type, component in _fields(data, *value):
+                if 1 <= index <= 4 and wire_type == _FIXED64:
+                    target[index - 1] = _DOUBLE.unpack(component)[0]
+    return upper_left, scale, translate
+
+
+# Function to decode a Geometry message into (part lengths, coordinates)
+# Packed coordinates (the usual encoding) come back as their (start, end) byte range for bulk decoding,
+# unpacked ones as a list of raw varints
+def _geometry(data, start, end):
+    lengths = []
+    coords = []
+    for number, wire_type, value in _fields(data, start, end):
+        if number == 2:
+            lengths = _packed_varints(data, *value) if wire_type == _LENGTH_DELIMITED else lengths + [value]
+        elif number == 3:
+            coords = value if wire_type == _LENGTH_DELIMITED else list(coords) + [value]
+    return lengths, coords
+
+
+# Function to decode the packed varints of many byte ranges at once
+# Returns (raw values as uint64, number of values in each range)
+def _bulk_varints(data, ranges):
+    buffer = np.frombuffer(b''.join(data[start:end] for start, end in ranges), dtype=np.uint8)
+    if len(buffer) == 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(len(ranges), dtype=np.int64)
+    last = buffer < 0x80
+    if not last[-1]:
+        raise ValueError("Truncated varint in PBF geometry")
+    ends = np.flatnonzero(last)
+    if len(ends) == len(buffer):
+        # Every value fits in one byte
+        values = buffer.astype(np.uint64)
+    else:
+        starts = np.concatenate(([0], ends[:-1] + 1))
+        shifts = (np.arange(len(buffer)) - np.repeat(starts, ends - starts + 1)) * 7
+        values = np.bitwise_or.reduceat((buffer & 0x7f).astype(np.uint64) << shifts.astype(np.uint64), starts)
+    offsets = np.cumsum([0] + [end - start for start, end in ranges])
+    terminators = np.concatenate(([0], np.cumsum(last)))
+    return values, terminators[offsets[1:]] - terminators[offsets[:-1]]
+
+
+# Function to turn the delta-encoded coordinates of many geometries into real vertices, one list per geometry
+# Layout is x, y, then z and m when present; the deltas run on across the parts of a geometry
+def _bulk_vertices(data, coords_list, stride, has_z, transform):
+    if all(isinstance(coords, tuple) for coords in coords_list):
+        raw, counts = _bulk_varints(data, coords_list)
+    else:
+        arrays = [_bulk_varints(data, [coords])[0] if isinstance(coords, tuple) else np.array(coords, dtype=np.uint64)
+                  for coords in coords_list]
+        raw = np.concatenate(arrays)
+        counts = np.array([len(array) for array in arrays], dtype=np.int64)
+    if np.any(counts % stride):
+        raise ValueError("PBF geometry coordinates do not match the response's dimensions")
+
+    one = np.uint64(1)
+    deltas = ((raw >> one).astype(np.int64) ^ -(raw & one).astype(np.int64)).reshape(-1, stride)
+    vertex_counts = counts // stride
+    # Running sums restarted at every geometry give the absolute integer coordinates
+    totals = np.cumsum(deltas, axis=0)
+    starts = np.concatenate(([0], np.cumsum(vertex_counts)[:-1]))
+    before = np.vstack((np.zeros((1, stride), dtype=np.int64), totals))[starts]
+    absolute = totals - np.repeat(before, vertex_counts, axis=0)
+
+    upper_left, scale, translate = transform
+    sx, sy, sm, sz = scale
+    tx, ty, tm, tz = translate
+    real = np.empty(absolute.shape)
+    real[:, 0] = tx + absolute[:, 0] * sx
+    real[:, 1] = ty + (-1.0 if upper_left else 1.0) * absolute[:, 1] * sy
+    extra = 2
+    if has_z:
+        real[:, extra] = tz + absolute[:, extra] * sz
+        extra += 1
+    if stride > extra:
+        real[:, extra] = tm + absolute[:, extra] * sm
+
+    vertices = real.tolist()
+    return [vertices[start:start + count] for start, count in zip(starts.tolist(), vertex_counts.tolist())]
+
+
+# Function to build an Esri JSON geometry from a geometry's part lengths and vertices
+def _esri_geometry(geometry_type, lengths, vertices, has_z, has_m):
+    if not vertices:
+        return None
+    if geometry_type == 'esriGeometryPoint':
+        point = {'x': vertices[0][0], 'y': vertices[0][1]}
+        if has_z:
+            point['z'] = vertices[0][2]
+        if has_m:
+            point['m'] = vertices[0][-1]
+        return point
+    if geometry_type == 'esriGeometryMultipoint':
+        return {'points': vertices}
+
+    parts = []
+    position = 0
+    for length in lengths or [len(vertices)]:
+        parts.append(vertices[position:position + length])
+        position += length
+    return {'rings' if geometry_type == 'esriGeometryPolygon' else 'paths': parts}
+
+
+# Function to decode a FeatureResult message into an Esri JSON feature set
+def _feature_result(data, start, end):
+    header = {}
+    fields = []
+    feature_ranges = []
+    transform = (True, [1.0, 1.0, 1.0, 1.0], [0.0, 0.0, 0.0, 0.0])
+    # Enum fields at their default (0) are left off the wire, so a missing geometry type means points
+    geometry_type = 'esriGeometryPoint'
+    has_z = has_m = False
+    for number, _, value in _fields(data, start, end):
+        if number == 1:
+            header['objectIdFieldName'] = _string(data, value)
+        elif number == 3:
+            header['globalIdFieldName'] = _string(data, value)
+        elif number == 7:
+            geometry_type = _GEOMETRY_TYPES.get(value)
+        elif number == 8:
+            header['spatialReference'] = _spatial_reference(data, *value)
+        elif number == 9:
+            if value:
+                header['exceededTransferLimit'] = True
+        elif number == 10:
+            has_z = bool(value)
+        elif number == 11:
+            has_m = bool(value)
+        elif number == 12:
+            transform = _transform(data, *value)
+        elif number == 13:
+            fields.append(_field(data, *value))
+        elif number == 15:
+            feature_ranges.append(value)
+
+    if geometry_type:
+        header['geometryType'] = geometry_type
+    if has_z:
+        header['hasZ'] = True
+    if has_m:
+        header['hasM'] = True
+    stride = 2 + has_z + has_m
+    names = [field['name'] for field in fields]
+
+    features = []
+    geometries = []
+    for feature_start, feature_end in feature_ranges:
+        values = []
+        feature = {}
+        # Features are runs of attribute values (key 0x0a) and a geometry (key 0x12); other fields are skipped
+        pos = feature_start
+        while pos < feature_end:
+            key = data[pos]
+            if key >= 0x80 or key & 7 != _LENGTH_DELIMITED:
+                # An unusual layout; read the whole feature the generic way
+                values = []
+                geometries = [entry for entry in geometries if entry[0] is not feature]
+                for number, _, value in _fields(data, feature_start, feature_end):
+                    if number == 1:
+                        values.append(_value(data, *value))
+                    elif number == 2 and geometry_type:
+                        geometries.append((feature, *_geometry(data, *value)))
+                break
+            length = data[pos + 1]
+            pos += 2
+            if length >= 0x80:
+                length, pos = _varint(data, pos - 1)
+            if key == 0x0a:
+                values.append(_value(data, pos, pos + length) if length else None)
+            elif key == 0x12 and geometry_type:
+                geometries.append((feature, *_geometry(data, pos, pos + length)))
+            pos += length
+        feature['attributes'] = dict(zip(names, values))
+        features.append(feature)
+
+    # Geometries are decoded after the attributes, all at once
+    if geometries:
+        vertices = _bulk_vertices(data, [coords for _, _, coords in geometries], stride, has_z, transform)
+        for (feature, lengths, _), feature_vertices in zip(geometries, vertices):
+            geometry = _esri_geometry(geometry_type, lengths, feature_vertices, has_z, has_m)
+            if geometry is not None:
+                feature['geometry'] = geometry
+
+    return {**header, 'fields': fields, 'features': features}
+
+
+# Function to decode a f=pbf query response body into an Esri JSON feature set dict
+# Count and object ID responses come back as {'count': n} and {'objectIdFieldName': ..., 'objectIds': [...]}
+def decode_feature_collection(data):
+    data = memoryview(data)
+    for number, _, value in _fields(data):
+        if number != 2:
+            continue
+        for result_number, _, result in _fields(data, *value):
+            if result_number == 1:
+                return _feature_result(data, *result)
+            if result_number == 2:
+                for count_number, _, count in _fields(data, *result):
+                    if count_number == 1:
+                        return {'count': count}
+                return {'count': 0}
+            if result_number == 3:
+                ids = {'objectIds': []}
+                for ids_number, wire_type, ids_value in _fields(data, *result):
+                    if ids_number == 1:
+                        ids['objectIdFieldName'] = _string(data, ids_value)
+                    elif ids_number == 3:
+                        ids['objectIds'] = (_packed_varints(data, *ids_value) if wire_type == _LENGTH_DELIMITED
+                                            else ids['objectIds'] + [ids_value])
+                return ids
+    return {'features': []}
+
+
+# Function to tell whether a layer advertises PBF query output in its metadata
+def supports_pbf(metadata):
+    formats = metadata.get('supportedQueryFormats') or ''
+    return 'pbf' in [value.strip().lower() for value in formats.split(',')]
+
+
+# Function to tell whether a response body is PBF rather than a JSON error or feature set
+def is_pbf_response(response):
+    content_type = response.headers.get('Content-Type', '')
+    return 'protobuf' in content_type or ('json' not in content_type and response.content.lstrip()[:1] != b'{')
+
+
+# Function to build a page transform putting the layer's own field definitions (lengths, domains) on decoded pages,
+# since the PBF field list only carries names, types and aliases
+def make_field_transform(metadata):
+    definitions = {field['name']: field for field in metadata.get('fields') or [] if field.get('name')}
+    if not definitions:
+        return None
+
+    def transform(data):
+        data['fields'] = [definitions.get(field.get('name'), field) for field in data.get('fields') or []]
+        return data
+    return transform
@@ -0,0 +1,160 @@
+import json
+
+# Per-layer query profiles for REST-to-GDB downloads.
+# A profile narrows what a layer query returns instead of always asking for every field and
+# full-precision vertex of the whole layer. All keys are optional:
+#
+#   {
+#     "fields": ["PARCEL_ID", "ZONING"],          # outFields; the object ID field is always added
+#     "where": "COUNTY = 'Kent'",
+#     "geometry": [xmin, ymin, xmax, ymax],        # envelope, or {"rings": [...]} for a polygon filter
+#     "geometry_sr": 4326,                         # spatial reference of the filter (default: the layer's)
+#     "spatial_rel": "esriSpatialRelIntersects",
+#     "return_geometry": true,
+#     "max_allowable_offset": 2.0,                 # generalize vertices, in layer units
+#     "geometry_precision": 2,                     # decimal places of returned coordinates
+#     "quantize": {"tolerance": 0.5}               # integer, delta-encoded coordinates, decoded on arrival
+#   }
+#
+# A profiles file maps layer ids to profiles; "*" applies to every layer and is merged under the layer's own.
+
+# Keys a profile may use
+PROFILE_KEYS = ('fields', 'where', 'geometry', 'geometry_sr', 'spatial_rel', 'return_geometry',
+                'max_allowable_offset', 'geometry_precision', 'quantize')
+
+# Key of the profile applied to every layer in a profiles file
+DEFAULT_PROFILE_KEY = '*'
+
+# Query parameters of the spatial filter
+SPATIAL_FILTER_PARAMS = ('geometry', 'geometryType', 'inSR', 'spatialRel')
+
+
+# Function to load a profiles file mapping layer ids (or "*") to profiles
+def load_profiles(path):
+    with open(path) as f:
+        profiles = json.load(f)
+    if not isinstance(profiles, dict):
+        raise ValueError(f"Query profiles file {path} must map layer ids to profiles")
+    for key, profile in profiles.items():
+        validate_profile(profile, f"profile '{key}' in {path}")
+    return profiles
+
+
+# Function to check a profile for unknown keys and malformed values
+def validate_profile(profile, where_from='query profile'):
+    if not isinstance(profile, dict):
+        raise ValueError(f"{where_from} must be an object")
+    unknown = sorted(set(profile) - set(PROFILE_KEYS))
+    if unknown:
+        raise ValueError(f"{where_from} has unknown key(s): {', '.join(unknown)}")
+    if profile.get('geometry') is not None:
+        _geometry_filter(profile['geometry'])
+    quantize = profile.get('quantize')
+    if quantize and not (isinstance(quantize, dict) and quantize.get('tolerance')) and profile.get('geometry_precision') is None:
+        raise ValueError(f"{where_from}: quantize needs a tolerance, e.g. {{\"tolerance\": 0.5}}, or a geometry_precision")
+
+
+# Function to pick a layer's profile: the "*" profile with the layer's own profile merged over it
+def profile_for(profiles, layer_id):
+    if not profiles:
+        return None
+    merged = dict(profiles.get(DEFAULT_PROFILE_KEY) or {})
+    merged.update(profiles.get(str(layer_id)) or profiles.get(layer_id) or {})
+    return merged or None
+
+
+# Function to turn a filter geometry into (geometry JSON, geometryType)
+def _geometry_filter(geometry):
+    if isinstance(geometry, (list, tuple)):
+        if len(geometry) != 4:
+            raise ValueError(f"Envelope filter needs four values: xmin,ymin,xmax,ymax (got {geometry})")
+        xmin, ymin, xmax, ymax = (float(value) for value in geometry)
+        geometry = {'xmin': xmin, 'ymin': ymin, 'xmax': xmax, 'ymax': ymax}
+    if not isinstance(geometry, dict):
+        raise ValueError(f"Unsupported filter geometry: {geometry}")
+    if 'rings' in geometry:
+        return geometry, 'esriGeometryPolygon'
+    if all(key in geometry for key in ('xmin', 'ymin', 'xmax', 'ymax')):
+        return geometry, 'esriGeometryEnvelope'
+    raise ValueError("Filter geometry must be an envelope or a polygon with rings")
+
+
+# Function to get the spatial reference id of a layer from its metadata
+def _layer_wkid(metadata):
+    reference = (metadata.get('extent') or {}).get('spatialReference') or metadata.get('spatialReference') or {}
+    return reference.get('latestWkid') or reference.get('wkid')
+
+
+# Function to tell whether a layer can return quantized coordinates
+def supports_quantization(metadata):
+    return bool(metadata.get('supportsCoordinatesQuantization')
+                or (metadata.get('advancedQueryCapabilities') or {}).get('supportsCoordinatesQuantization'))
+
+
+# Function to build the query parameters for a layer from its profile (None for everything)
+# required_fields are added to a field list, e.g. the object ID and edit date fields sync relies on
+# Returns (params, quantized) where quantized tells whether responses need decoding
+def build_query_params(profile, metadata, required_fields=(), log=print):
+    profile = profile or {}
+    validate_profile(profile)
+    params = {
+        'where': '1=1',
+        'outFields': '*',
+        'returnGeometry': True,
+        'f': 'json'
+    }
+    if profile.get('where'):
+        params['where'] = profile['where']
+
+    fields = profile.get('fields')
+    if fields and fields != '*':
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
+        wanted = list(fields) + [field for field in required_fields if field and field not in fields]
+        params['outFields'] = ','.join(wanted)
+
+    if profile.get('geometry') is not None:
+        geometry, geometry_type = _geometry_filter(profile['geometry'])
+        params['geometry'] = json.dumps(geometry)
+        params['geometryType'] = geometry_type
+        params['spatialRel'] = profile.get('spatial_rel') or 'esriSpatialRelIntersects'
+        if profile.get('geometry_sr') is not None:
+            params['inSR'] = profile['geometry_sr']
+
+    if profile.get('return_geometry') is False:
+        params['returnGeometry'] = False
+        return params, False
+
+    if profile.get('max_allowable_offset') is not None:
+        params['maxAllowableOffset'] = profile['max_allowable_offset']
+    if profile.get('geometry_precision') is not None:
+        params['geometryPrecision'] = int(profile['geometry_precision'])
+
+    quantized = False
+    quantize = profile.get('quantize')
+    if quantize:
+        layer_extent = metadata.get('extent')
+        if not supports_quantization(metadata):
+            log(f"Layer {metadata.get('name', '')} does not support coordinate quantization; downloading full coordinates")
+        elif not layer_extent:
+            log(f"Layer {metadata.get('name', '')} reports no extent to quantize against; downloading full coordinates")
+        else:
+            options = quantize if isinstance(quantize, dict) else {}
+            tolerance = options.get('tolerance') or 10.0 ** -int(profile['geometry_precision'])
+            extent = {key: layer_extent[key] for key in ('xmin', 'ymin', 'xmax', 'ymax')}
+            wkid = _layer_wkid(metadata)
+            if wkid:
+                extent['spatialReference'] = {'wkid': wkid}
+            params['quantizationParameters'] = json.dumps({
+                'mode': options.get('mode', 'view'),
+                'originPosition': 'upperLeft',
+                'tolerance': tolerance,
+                'extent': extent,
+            })
+            quantized = True
+    return params, quantized
+
+
+# Function to pick the spatial filter out of query parameters, for count, statistics and ID queries
+def spatial_filter(params):
+    return {key: params[key] for key in SPATIAL_FILTER_PARAMS if key in params}
@@ -0,0 +1,170 @@
+import csv
+import datetime
+import json
+import os
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import disk_cache
+import http_client
+import raster_tiles
+
+# Batch map exports for Rastertool.
+# A jobs file lists (name, layers, bbox, format) rows; every job runs on a bounded
+# pool and each response body is streamed to disk in chunks, so memory stays flat
+# no matter how many or how large the exports are.
+#
+# CSV jobs file (bbox quoted, formats separated by ';'):
+#   name,layers,bbox,format
+#   landuse,"0,3","-2271872,1386016,-60872,3783016",PDF;PNG
+#
+# JSON jobs file:
+#   [{"name": "landuse", "layers": "0,3", "bbox": [-2271872, 1386016, -60872, 3783016],
+#     "format": ["PDF", "PNG"], "bbox_sr": "102002", "size": "1600,1200"}]
+#
+# A job with a "resolution" (map units per pixel) is exported as a tiled GeoTIFF mosaic instead;
+# its format must be left empty or set to TIFF.
+
+# Format of tiled mosaic jobs, and the format names accepted for them
+MOSAIC_FORMAT = 'TIFF'
+MOSAIC_FORMATS = ('tif', 'tiff', 'geotiff')
+
+# Defaults for optional job fields
+DEFAULT_BBOX_SR = '102002'
+DEFAULT_SIZE = '800,600'
+
+# Default number of exports running at the same time
+DEFAULT_EXPORT_WORKERS = 4
+
+# Size of the chunks written while streaming an export to disk
+CHUNK_SIZE = 1024 * 1024
+
+
+# Function to normalize a bbox given as a list or a comma/space separated string
+def normalize_bbox(bbox):
+    if isinstance(bbox, str):
+        bbox = bbox.replace(',', ' ').split()
+    values = [float(value) for value in bbox]
+    if len(values) != 4:
+        raise ValueError(f"Bounding box needs four values: xmin,ymin,xmax,ymax (got {bbox})")
+    return values
+
+
+# Function to load export jobs from a CSV or JSON file, one job per output format
+def load_export_jobs(path):
+    with open(path, newline='') as f:
+        if path.lower().endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+
+    jobs = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+        row = {key.strip().lower(): value for key, value in row.items() if key}
+        if not row.get('name') or not row.get('bbox'):
+            raise ValueError(f"Job {number} in {path} needs at least a name and a bbox")
+        resolution = float(row['resolution']) if row.get('resolution') else None
+        formats = row.get('format') or (MOSAIC_FORMAT if resolution else 'PNG')
+        if isinstance(formats, str):
+            formats = [value.strip() for value in formats.split(';') if value.strip()]
+        if resolution:
+            # A tiled job writes one GeoTIFF mosaic whatever the format, so one row is one job
+            if any(value.lower() not in MOSAIC_FORMATS for value in formats):
+                raise ValueError(f"Job {number} in {path} has a resolution, so it exports a GeoTIFF mosaic; "
+                                 f"leave its format empty or set it to {MOSAIC_FORMAT}")
+            formats = [MOSAIC_FORMAT]
+        for image_format in formats:
+            key = (row['name'], image_format.lower())
+            if key in seen:
+                raise ValueError(f"Job {number} in {path} repeats name '{row['name']}' for format {image_format}")
+            seen.add(key)
+            jobs.append({
+                'name': row['name'],
+                'layers': str(row.get('layers') or ''),
+                'bbox': normalize_bbox(row['bbox']),
+                'bbox_sr': str(row.get('bbox_sr') or DEFAULT_BBOX_SR),
+                'size': row.get('size') or DEFAULT_SIZE,
+                'format': image_format,
+                'resolution': resolution,
+            })
+    return jobs
+
+
+# Function to build the export request parameters for a job
+def export_params(job):
+    params = {
+        'f': 'image',
+        'bbox': ','.join(repr(value) for value in job['bbox']),
+        'bboxSR': job['bbox_sr'],
+        'size': job['size'],
+        'format': job['format'].lower(),
+        'transparent': True,
+    }
+    if job['layers']:
+        params['layers'] = f"show:{job['layers']}"
+    return params
+
+
+# Function to stream one export to save_path, through the disk cache when one is given
+def export_image(export_url, job, save_path, cache=None):
+    params = export_params(job)
+    if cache is not None:
+        with disk_cache.cached_response(cache, export_url, params, cacheable=raster_tiles.is_export_response) as result:
+            if result['path'] is None:
+                raise RuntimeError(f"Failed to fetch image. Status code: {result['status_code']} {result.get('text', '')[:200]}")
+            shutil.copyfile(result['path'], save_path)
+        return save_path
+
+    temp_path = f"{save_path}.{uuid.uuid4().hex}.part"
+    try:
+        with http_client.get(export_url, params=params, stream=True) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"Failed to fetch image. Status code: {response.status_code}")
+            if not raster_tiles.is_export_response(response):
+                raise RuntimeError(f"Server returned {response.headers.get('Content-Type')}: {response.text[:200]}")
+            with open(temp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+        os.replace(temp_path, save_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return save_path
+
+
+# Function to run one job and return its result dict
+def run_export_job(export_url, job, save_folder, timestamp, cache=None):
+    try:
+        if job.get('resolution'):
+            save_path = os.path.join(save_folder, f"{job['name']}_mosaic_{timestamp}.tif")
+            raster_tiles.export_tiled(export_url, job['layers'], job['bbox'], job['bbox_sr'], job['resolution'],
+                                      save_path, cache=cache)
+        else:
+            save_path = os.path.join(save_folder, f"{job['name']}_image_{timestamp}.{job['format'].lower()}")
+            export_image(export_url, job, save_path, cache)
+        return {'name': job['name'], 'format': job['format'], 'path': save_path, 'status': 'done', 'error': None}
+    except Exception as e:
+        return {'name': job['name'], 'format': job['format'], 'path': None, 'status': 'failed', 'error': str(e)}
+
+
+# Function to run export jobs concurrently, with at most max_workers exports at once
+# log(message) is called as each job finishes; results come back in job order
+def run_export_jobs(export_url, jobs, save_folder, max_workers=DEFAULT_EXPORT_WORKERS, cache=None, log=print):
+    os.makedirs(save_folder, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    results = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(run_export_job, export_url, job, save_folder, timestamp, cache): index
+            for index, job in enumerate(jobs)
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results[futures[future]] = result
+            if result['status'] == 'done':
+                log(f"[{done}/{len(jobs)}] Saved '{result['path']}'")
+            else:
+                log(f"[{done}/{len(jobs)}] Error: {result['name']} ({result['format']}) failed: {result['error']}")
+    return results
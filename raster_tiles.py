@@ -0,0 +1,218 @@
+import math
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
+
+import numpy as np
+
+import disk_cache
+import http_client
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is only needed to decode tiles in tiled mode
+    Image = None
+
+# Tiled high-resolution exports from a MapServer export endpoint.
+# The target extent is split into server-sized tiles that are fetched concurrently
+# and pasted into an uncompressed RGBA TIFF canvas that lives on disk
+# (memory-mapped), so the full mosaic never has to fit in RAM. A world file
+# (.tfw) georeferences the result.
+
+# Tile size used when the service does not report maxImageWidth/maxImageHeight
+DEFAULT_MAX_TILE_SIZE = 2048
+
+# Default number of tiles fetched at the same time
+DEFAULT_TILE_WORKERS = 8
+
+# Bytes per pixel of the output canvas (RGBA)
+_CHANNELS = 4
+
+# Where pixel data starts in the output file; the header and IFD always fit before it
+_DATA_OFFSET = 4096
+
+
+# Function to get the service URL for an export endpoint (.../MapServer/export -> .../MapServer)
+def service_url_from_export(export_url):
+    export_url = export_url.rstrip('/')
+    if export_url.lower().endswith('/export'):
+        return export_url[:-len('/export')]
+    return export_url
+
+
+# Function to read the largest image the service will export in one request
+def fetch_max_image_size(export_url):
+    try:
+        response = http_client.get(service_url_from_export(export_url), params={'f': 'json'})
+        info = response.json() if response.status_code == 200 else {}
+    except Exception:
+        info = {}
+    return (
+        int(info.get('maxImageWidth') or DEFAULT_MAX_TILE_SIZE),
+        int(info.get('maxImageHeight') or DEFAULT_MAX_TILE_SIZE),
+    )
+
+
+# Function to split an extent into tiles at a ground resolution (map units per pixel)
+# Returns (width, height, extent, tiles) where extent is snapped to whole pixels from the upper-left corner
+# and each tile is (x_offset, y_offset, width, height, (xmin, ymin, xmax, ymax))
+def plan_tiles(bbox, resolution, max_tile_width, max_tile_height):
+    xmin, ymin, xmax, ymax = bbox
+    if xmax <= xmin or ymax <= ymin or resolution <= 0:
+        raise ValueError("Bounding box must have xmax > xmin and ymax > ymin, and resolution must be positive")
+    width = math.ceil((xmax - xmin) / resolution)
+    height = math.ceil((ymax - ymin) / resolution)
+    extent = (xmin, ymax - height * resolution, xmin + width * resolution, ymax)
+
+    tiles = []
+    for y_offset in range(0, height, max_tile_height):
+        tile_height = min(max_tile_height, height - y_offset)
+        for x_offset in range(0, width, max_tile_width):
+            tile_width = min(max_tile_width, width - x_offset)
+            tile_xmin = xmin + x_offset * resolution
+            tile_ymax = ymax - y_offset * resolution
+            tiles.append((
+                x_offset, y_offset, tile_width, tile_height,
+                (tile_xmin, tile_ymax - tile_height * resolution, tile_xmin + tile_width * resolution, tile_ymax),
+            ))
+    return width, height, extent, tiles
+
+
+# Function to write an uncompressed RGBA TIFF header and size the file for the pixel data
+# Switches to BigTIFF when the image is too large for a classic TIFF
+def create_tiff_canvas(path, width, height):
+    data_size = width * height * _CHANNELS
+    big = _DATA_OFFSET + data_size >= 2 ** 32
+    # (tag, type, values): type 3 = SHORT, 4 = LONG, 16 = LONG8
+    offset_type = 16 if big else 4
+    entries = [
+        (256, offset_type, [width]),                  # ImageWidth
+        (257, offset_type, [height]),                 # ImageLength
+        (258, 3, [8, 8, 8, 8]),                       # BitsPerSample
+        (259, 3, [1]),                                # Compression: none
+        (262, 3, [2]),                                # Photometric: RGB
+        (273, offset_type, [_DATA_OFFSET]),           # StripOffsets
+        (277, 3, [_CHANNELS]),                        # SamplesPerPixel
+        (278, offset_type, [height]),                 # RowsPerStrip
+        (279, offset_type, [data_size]),              # StripByteCounts
+        (284, 3, [1]),                                # PlanarConfiguration: chunky
+        (338, 3, [2]),                                # ExtraSamples: unassociated alpha
+    ]
+    type_formats = {3: 'H', 4: 'I', 16: 'Q'}
+
+    if big:
+        header = struct.pack('<2sHHHQ', b'II', 43, 8, 0, 16)
+        entry_format, count_format, inline_size = '<HHQ', 'Q', 8
+        ifd_offset = 16
+    else:
+        header = struct.pack('<2sHI', b'II', 42, 8)
+        entry_format, count_format, inline_size = '<HHI', 'I', 4
+        ifd_offset = 8
+
+    entry_size = struct.calcsize(entry_format) + inline_size
+    count_size = 8 if big else 2
+    next_size = 8 if big else 4
+    extra_offset = ifd_offset + count_size + len(entries) * entry_size + next_size
+
+    ifd = struct.pack('<Q' if big else '<H', len(entries))
+    extra = b''
+    for tag, value_type, values in entries:
+        packed = struct.pack(f"<{len(values)}{type_formats[value_type]}", *values)
+        ifd += struct.pack(entry_format, tag, value_type, len(values))
+        if len(packed) <= inline_size:
+            ifd += packed.ljust(inline_size, b'\0')
+        else:
+            ifd += struct.pack(f"<{count_format}", extra_offset + len(extra))
+            extra += packed
+    ifd += b'\0' * next_size
+
+    with open(path, 'wb') as f:
+        f.write(header + ifd + extra)
+        # Sizing the file up front leaves it sparse until tiles arrive
+        f.truncate(_DATA_OFFSET + data_size)
+    return np.memmap(path, dtype=np.uint8, mode='r+', offset=_DATA_OFFSET, shape=(height, width, _CHANNELS))
+
+
+# Function to write the world file that places the image in map coordinates
+def write_world_file(image_path, extent, resolution):
+    world_path = os.path.splitext(image_path)[0] + '.tfw'
+    xmin, _, _, ymax = extent
+    with open(world_path, 'w') as f:
+        # Pixel size, rotations, then the center of the upper-left pixel
+        f.write(f"{resolution}\n0.0\n0.0\n{-resolution}\n{xmin + resolution / 2}\n{ymax - resolution / 2}\n")
+    return world_path
+
+
+# Function to tell whether an export response carries a rendered map rather than an error page
+def is_export_response(response):
+    content_type = response.headers.get('Content-Type', '')
+    return not content_type.startswith(('application/json', 'text/plain', 'text/html'))
+
+# Function to fetch one tile as an RGBA array, through the disk cache when one is given
+def fetch_tile(export_url, params, tile_bbox, width, height, cache=None):
+    tile_params = dict(params)
+    tile_params['bbox'] = ','.join(repr(value) for value in tile_bbox)
+    tile_params['size'] = f"{width},{height}"
+    if cache is not None:
+        with disk_cache.cached_response(cache, export_url, tile_params, cacheable=is_export_response) as result:
+            if result['path'] is None:
+                raise RuntimeError(f"Tile request failed (Status Code: {result['status_code']}): {result.get('text', '')[:200]}")
+            with Image.open(result['path']) as image:
+                pixels = np.asarray(image.convert('RGBA'))
+    else:
+        response = http_client.get(export_url, params=tile_params)
+        if response.status_code != 200:
+            raise RuntimeError(f"Tile request failed (Status Code: {response.status_code})")
+        if not is_export_response(response):
+            raise RuntimeError(f"Tile request returned {response.headers.get('Content-Type')}: {response.text[:200]}")
+        with Image.open(BytesIO(response.content)) as image:
+            pixels = np.asarray(image.convert('RGBA'))
+    if pixels.shape[:2] != (height, width):
+        raise RuntimeError(f"Tile came back {pixels.shape[1]}x{pixels.shape[0]} instead of {width}x{height}")
+    return pixels
+
+
+# Function to export an extent at a ground resolution as a tiled mosaic with a world file
+# bbox is (xmin, ymin, xmax, ymax) in spatial_reference (a WKID); progress(done, total) is called per tile
+# Returns (image_path, world_file_path, width, height)
+def export_tiled(export_url, layers, bbox, spatial_reference, resolution, out_path, transparent=True,
+                 max_tile_size=None, max_workers=DEFAULT_TILE_WORKERS, progress=None, cache=None):
+    if Image is None:
+        raise RuntimeError("Tiled export needs Pillow to decode tiles (pip install pillow)")
+
+    if max_tile_size:
+        max_tile_width = max_tile_height = max_tile_size
+    else:
+        max_tile_width, max_tile_height = fetch_max_image_size(export_url)
+    width, height, extent, tiles = plan_tiles(bbox, resolution, max_tile_width, max_tile_height)
+
+    params = {
+        'f': 'image',
+        'layers': f'show:{layers}' if layers else None,
+        'bboxSR': spatial_reference,
+        'imageSR': spatial_reference,
+        'format': 'png32',
+        'transparent': transparent,
+    }
+    params = {key: value for key, value in params.items() if value is not None}
+
+    canvas = create_tiff_canvas(out_path, width, height)
+    try:
+        # Workers paste straight into the memory-mapped canvas, so finished tiles never pile up in RAM
+        def fetch_and_paste(x_offset, y_offset, tile_width, tile_height, tile_bbox):
+            pixels = fetch_tile(export_url, params, tile_bbox, tile_width, tile_height, cache)
+            canvas[y_offset:y_offset + tile_height, x_offset:x_offset + tile_width] = pixels
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tiles)))) as executor:
+            futures = [executor.submit(fetch_and_paste, *tile) for tile in tiles]
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                if progress is not None:
+                    progress(done, len(tiles))
+        canvas.flush()
+    finally:
+        del canvas
+
+    world_path = write_world_file(out_path, extent, resolution)
+    return out_path, world_path, width, height
@@ -0,0 +1,226 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import output_sinks
+import query_profile
+import rest_engine
+import run_metrics
+
+try:
+    import yaml
+except ImportError:  # YAML manifests need PyYAML; JSON manifests work without it
+    yaml = None
+
+# Headless REST-to-GDB runner: processes every service and layer listed in a manifest
+# with a pool of workers and writes a machine-readable run summary.
+#
+# Example manifest (YAML, or the same structure as JSON):
+#
+#   defaults:
+#     output_gdb: C:\Data\Nightly.gdb
+#     staging_dir: C:\Data\staging
+#     incremental: true
+#     transport: pbf               # binary feature collections where offered: fewer bytes, more CPU
+#   services:
+#     - url: https://example.com/arcgis/rest/services/Parcels/FeatureServer
+#       layers: [0, 3]
+#     - url: https://example.com/arcgis/rest/services/Roads/FeatureServer
+#       output_gdb: C:\Data\Roads.gdb
+#     - url: https://example.com/arcgis/rest/services/Hydro/FeatureServer
+#       output_gdb: /data/hydro.gpkg  # GeoPackage output, no ArcGIS needed
+#       layers: all
+#       query:                       # query profile for every layer (see query_profile.py)
+#         geometry: [-8200000, 4950000, -8150000, 5000000]
+#         quantize: {tolerance: 1}
+#       layer_queries:               # per-layer profiles, merged over query
+#         2: {fields: [ROUTE_ID, NAME], where: "STATUS = 'OPEN'"}
+#
+# Usage: python rest_batch.py manifest.yaml --workers 8 --summary run_summary.json
+#        [--metrics run_metrics.json|.csv] [--profile run.prof]
+
+# Options a service entry (or the defaults block) may set for its layers
+LAYER_OPTIONS = ('output_gdb', 'stream_to_disk', 'incremental', 'staging_dir', 'transport')
+
+
+# Function to load a manifest from a YAML or JSON file
+def load_manifest(path):
+    with open(path) as f:
+        if path.lower().endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise RuntimeError("PyYAML is required for YAML manifests (pip install pyyaml), or use a JSON manifest")
+            manifest = yaml.safe_load(f)
+        else:
+            manifest = json.load(f)
+    if not isinstance(manifest, dict) or not manifest.get('services'):
+        raise ValueError(f"Manifest {path} has no 'services' list")
+    return manifest
+
+
+# Function to turn one service entry into process_layer jobs
+def resolve_service(service, defaults):
+    options = {key: service.get(key, defaults.get(key)) for key in LAYER_OPTIONS}
+    options = {key: value for key, value in options.items() if value is not None}
+    base_url = service['url'].rstrip('/')
+    if not options.get('output_gdb'):
+        raise ValueError("no output_gdb given")
+    output_sinks.check_output(options['output_gdb'])
+    if options.get('transport', 'json') not in rest_engine.TRANSPORTS:
+        raise ValueError(f"transport must be one of {', '.join(rest_engine.TRANSPORTS)}")
+
+    # The service's query profile (or the default one) applies to every layer, with per-layer profiles merged over it
+    profiles = {query_profile.DEFAULT_PROFILE_KEY: service.get('query', defaults.get('query')) or {}}
+    profiles.update({str(key): value for key, value in (service.get('layer_queries') or {}).items()})
+    for key, profile in profiles.items():
+        query_profile.validate_profile(profile, f"query profile '{key}'")
+
+    info = rest_engine.fetch_service_info(base_url)
+    available = {layer['id']: layer['name'] for layer in info.get('layers', [])}
+    requested = service.get('layers', 'all')
+    if requested == 'all':
+        layer_ids = list(available)
+    else:
+        missing = [layer_id for layer_id in requested if layer_id not in available]
+        if missing:
+            raise ValueError(f"layer id(s) not in service: {missing}")
+        layer_ids = list(requested)
+
+    return [
+        {
+            'layer_num': layer_id,
+            'layer_name': available[layer_id],
+            'base_url': base_url,
+            'service_units': info.get('units'),
+            'layer_query': query_profile.profile_for(profiles, layer_id),
+            **options,
+        }
+        for layer_id in layer_ids
+    ]
+
+
+# Function to build the result dict of a job that failed before it ran
+def failed_result(service_url, output, error, layer_id=None, layer_name=None):
+    return {
+        'service': service_url,
+        'layer_id': layer_id,
+        'layer_name': layer_name,
+        'output': output,
+        'status': 'failed',
+        'features': 0,
+        'pages': 0,
+        'error': error,
+        'seconds': 0,
+    }
+
+
+# Function to get the key of the feature class or table a job writes to
+# Output names come from the layer name alone and are case-insensitive in geodatabases and GeoPackages
+def output_target_key(job):
+    return (os.path.normcase(os.path.abspath(job['output_gdb'])), rest_engine.sanitize_layer_name(job['layer_name']).lower())
+
+
+# Function to fail jobs that would write to the same output as an earlier job of the manifest
+# Without this the later layer silently overwrites the earlier one, and incremental sync of either
+# compares its deletes against the other's rows
+def split_duplicate_targets(jobs):
+    kept = []
+    failures = []
+    owners = {}
+    for job in jobs:
+        key = output_target_key(job)
+        owner = owners.setdefault(key, job)
+        if owner is job:
+            kept.append(job)
+            continue
+        error = (f"Layer '{job['layer_name']}' would write to the same output as layer {owner['layer_num']} "
+                 f"of {owner['base_url']} in {job['output_gdb']}; give one of the services its own output_gdb")
+        rest_engine.log_message(f"Skipping layer {job['layer_num']} of {job['base_url']}: {error}", "ERROR")
+        failures.append(failed_result(job['base_url'], job['output_gdb'], error, job['layer_num'], job['layer_name']))
+    return kept, failures
+
+
+# Function to resolve every service of a manifest concurrently
+# Returns (jobs, failures) where failures are result dicts for services that could not be resolved
+# and for layers whose output another layer of the manifest already writes to
+def build_jobs(manifest, max_workers):
+    defaults = manifest.get('defaults') or {}
+    services = manifest['services']
+
+    def resolve(service):
+        try:
+            return resolve_service(service, defaults), None
+        except Exception as e:
+            rest_engine.log_message(f"Skipping service {service.get('url')}: {e}", "ERROR")
+            return [], failed_result(service.get('url'), service.get('output_gdb', defaults.get('output_gdb')), str(e))
+
+    jobs = []
+    failures = []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(services)))) as executor:
+        for service_jobs, failure in executor.map(resolve, services):
+            jobs.extend(service_jobs)
+            if failure:
+                failures.append(failure)
+    jobs, duplicates = split_duplicate_targets(jobs)
+    return jobs, failures + duplicates
+
+
+# Function to run a whole manifest and return the run summary
+def run_manifest(manifest, max_workers=rest_engine.DEFAULT_LAYER_WORKERS):
+    started = time.time()
+    jobs, failures = build_jobs(manifest, max_workers)
+    rest_engine.log_message(f"Running {len(jobs)} layer job(s) from {len(manifest['services'])} service(s), {max_workers} at a time")
+    results = failures + rest_engine.run_layer_jobs(jobs, max_workers)
+
+    statuses = {}
+    for result in results:
+        statuses[result['status']] = statuses.get(result['status'], 0) + 1
+    return {
+        'started': datetime.datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+        'seconds': round(time.time() - started, 3),
+        'layers': len(results),
+        'statuses': statuses,
+        'features': sum(result['features'] for result in results),
+        'failed': statuses.get('failed', 0),
+        'results': results,
+    }
+
+
+# Function to log to stderr so stdout stays free for the summary
+def log_to_stderr(message, level="INFO"):
+    print(f"[{level}] {message}", file=sys.stderr, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download ArcGIS REST layers into file geodatabases from a manifest.")
+    parser.add_argument('manifest', help="YAML or JSON manifest listing services, layers and outputs")
+    parser.add_argument('--workers', type=int, default=rest_engine.DEFAULT_LAYER_WORKERS,
+                        help="number of layers processed at the same time")
+    parser.add_argument('--summary', help="write the JSON run summary to this file instead of stdout")
+    parser.add_argument('--metrics', help="write per-stage timings to this file (JSON, or CSV with a .csv name)")
+    parser.add_argument('--profile', help="write cProfile stats of the layer jobs to this file (open with pstats)")
+    args = parser.parse_args(argv)
+
+    rest_engine.set_log_handler(log_to_stderr)
+    manifest = load_manifest(args.manifest)
+    if args.metrics or args.profile:
+        with run_metrics.RunRecorder('rest_batch', args.metrics, args.profile, manifest=args.manifest) as recorder:
+            summary = run_manifest(manifest, max(1, args.workers))
+        summary['stages'] = recorder.summary()
+    else:
+        summary = run_manifest(manifest, max(1, args.workers))
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        json.dump(summary, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
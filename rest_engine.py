@@ -0,0 +1,648 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import http_client
+import output_sinks
+import pbf_features
+import query_profile
+import run_metrics
+import service_catalog
+from feature_stream import assemble_feature_file, scan_file, stream_response_to_file
+from geometry_engine import LINEAR_UNIT_METERS, add_measures, dequantize, spatial_reference_units
+
+# REST-to-GDB extraction engine shared by the API_to_GDB window and the rest_batch command line.
+# Nothing here touches Tk: progress goes through log_message and each layer returns a result dict.
+
+# Page size used when the layer metadata does not report a maxRecordCount
+DEFAULT_MAX_RECORD_COUNT = 1000
+
+# Upper bound on concurrent page requests per layer (downloads are I/O bound)
+MAX_PAGE_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Default folder holding the staging JSON files handed to JSONToFeatures
+STAGING_DIR = r'C:\NLSA_Test\Scripts\featureserver_script'
+
+# Name of the file, inside the staging folder, holding per-layer watermarks for incremental sync
+SYNC_STATE_FILE = 'sync_state.json'
+
+# Field holding each feature's object ID on the source service, used to match rows during sync
+SOURCE_ID_FIELD = 'SRC_OID'
+
+# Default number of layers processed at the same time
+DEFAULT_LAYER_WORKERS = 4
+
+# Feature transports: verbose Esri JSON (the default), or the binary PBF feature collection where the layer offers it;
+# PBF sends far fewer bytes but costs more CPU to decode, so it only wins when the network is the bottleneck
+TRANSPORTS = ('json', 'pbf')
+
+# Guards reads and writes of the sync state files
+sync_state_lock = threading.Lock()
+
+# Callable receiving (message, level); None prints to the console
+_log_handler = None
+
+
+# Function to route engine messages to a handler, e.g. a queue drained by a GUI
+def set_log_handler(handler):
+    global _log_handler
+    _log_handler = handler
+
+# Function to log a message (safe to call from any thread)
+def log_message(message, level="INFO"):
+    if _log_handler is not None:
+        _log_handler(message, level)
+    else:
+        print(f"[{level}] {message}", flush=True)
+
+# Function to fetch the service description (layers, tables, units, ...), through the service catalog cache
+def fetch_service_info(base_url):
+    return service_catalog.get_catalog().service_info(base_url)
+
+# Function to sanitize layer names for ArcGIS
+def sanitize_layer_name(name):
+    sanitized_name = re.sub(r'\W+', '_', name)
+    sanitized_name = sanitized_name.strip('_')
+    if sanitized_name and not sanitized_name[0].isalpha():
+        sanitized_name = 'Layer_' + sanitized_name
+    return sanitized_name
+
+# Function to find the object ID field of a layer from its metadata
+def get_oid_field(metadata):
+    if metadata.get('objectIdField'):
+        return metadata['objectIdField']
+    for field in metadata.get('fields') or []:
+        if field.get('type') == 'esriFieldTypeOID':
+            return field['name']
+    return None
+
+# Function to run a query and return the parsed JSON, raising on HTTP or service errors
+# f=pbf queries are decoded into the same Esri JSON structure (errors still come back as JSON)
+def query_json(url, params):
+    response = http_client.get(url, params=params)
+    response.raise_for_status()
+    if params.get('f') == 'pbf' and pbf_features.is_pbf_response(response):
+        return pbf_features.decode_feature_collection(response.content)
+    data = response.json()
+    if 'error' in data:
+        raise RuntimeError(f"Service error: {data['error'].get('message', data['error'])}")
+    return data
+
+# Function to get the number of features matching the query (and spatial filter, see query_profile.spatial_filter)
+def get_feature_count(url, where, spatial=None):
+    data = query_json(url, {'where': where, **(spatial or {}), 'returnCountOnly': 'true', 'f': 'json'})
+    return data.get('count')
+
+# Function to get the lowest and highest object ID matching the query
+def get_oid_range(url, where, oid_field, spatial=None):
+    statistics = [
+        {'statisticType': 'min', 'onStatisticField': oid_field, 'outStatisticFieldName': 'MIN_OID'},
+        {'statisticType': 'max', 'onStatisticField': oid_field, 'outStatisticFieldName': 'MAX_OID'},
+    ]
+    data = query_json(url, {'where': where, **(spatial or {}), 'outStatistics': json.dumps(statistics), 'f': 'json'})
+    features = data.get('features') or []
+    if not features:
+        return None
+    # Some servers return statistic names in a different case
+    attributes = {key.upper(): value for key, value in features[0]['attributes'].items()}
+    if attributes.get('MIN_OID') is None or attributes.get('MAX_OID') is None:
+        return None
+    return int(attributes['MIN_OID']), int(attributes['MAX_OID'])
+
+# Function to split a layer query into pages using the layer metadata
+# Each page is a dict of extra query parameters; pages are returned in object ID order
+def build_pages(url, params, metadata):
+    page_size = metadata.get('maxRecordCount') or DEFAULT_MAX_RECORD_COUNT
+    oid_field = get_oid_field(metadata)
+    supports_pagination = (metadata.get('advancedQueryCapabilities') or {}).get('supportsPagination', False)
+    where = params.get('where', '1=1')
+    spatial = query_profile.spatial_filter(params)
+
+    if not oid_field:
+        return build_offset_pages(url, where, spatial, page_size, supports_pagination), page_size
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        count_future = executor.submit(get_feature_count, url, where, spatial)
+        range_future = executor.submit(get_oid_range, url, where, oid_field, spatial)
+        try:
+            count = count_future.result()
+        except Exception:
+            count = None
+        try:
+            oid_range = range_future.result()
+        except Exception:
+            oid_range = None
+
+    if count is not None and count <= page_size:
+        return [{}], page_size
+
+    # Object ID ranges are cheapest for the server, unless the IDs are very sparse
+    if oid_range:
+        low, high = oid_range
+        span = high - low + 1
+        if count is None or span <= count * 2 or not supports_pagination:
+            return [
+                {'where': f"({where}) AND {oid_field} >= {start} AND {oid_field} < {start + page_size}"}
+                for start in range(low, high + 1, page_size)
+            ], page_size
+
+    if count is not None and supports_pagination:
+        return [
+            {'resultOffset': offset, 'resultRecordCount': page_size, 'orderByFields': oid_field}
+            for offset in range(0, count, page_size)
+        ], page_size
+
+    return [{}], page_size
+
+# Function to page a layer without an object ID field by record offset, when the service supports it
+# Without a unique field to order by, the server's own order is trusted to stay the same between pages
+def build_offset_pages(url, where, spatial, page_size, supports_pagination):
+    if not supports_pagination:
+        return [{}]
+    try:
+        count = get_feature_count(url, where, spatial)
+    except Exception:
+        count = None
+    if count is None or count <= page_size:
+        return [{}]
+    return [{'resultOffset': offset, 'resultRecordCount': page_size} for offset in range(0, count, page_size)]
+
+# Function to fetch a single page, splitting it further if the server still truncates it
+# page_size is the service's maxRecordCount, used to spot an unpaged query that was silently cut off
+def fetch_page(url, params, page, oid_field, page_size=None):
+    data = query_json(url, {**params, **page})
+    features = data.get('features') or []
+    if not data.get('exceededTransferLimit'):
+        if not oid_field and not page and page_size and len(features) >= page_size:
+            log_message(f"Query returned {len(features)} features, the service's page size, and the layer has no object ID "
+                        "field to page by; the rest of the layer may be missing", "WARNING")
+        return data, features
+
+    if 'resultOffset' in page and features:
+        # Ask for the remainder of this page after the features we already have
+        remainder = dict(page)
+        remainder['resultOffset'] = page['resultOffset'] + len(features)
+        remainder['resultRecordCount'] = page['resultRecordCount'] - len(features)
+        if remainder['resultRecordCount'] > 0:
+            _, more = fetch_page(url, params, remainder, oid_field)
+            features = features + more
+        return data, features
+
+    if oid_field and features:
+        # Continue the object ID range after the last feature received
+        last_oid = max(feature['attributes'][oid_field] for feature in features)
+        remainder = dict(page)
+        remainder['where'] = f"({page.get('where', params.get('where', '1=1'))}) AND {oid_field} > {last_oid}"
+        _, more = fetch_page(url, params, remainder, oid_field)
+        return data, features + more
+
+    log_message(f"The server truncated a page at {len(features)} features and it can't be continued; "
+                "the rest of the layer is missing", "WARNING")
+    return data, features
+
+# Function to download every feature of a layer in pages, fetched concurrently
+# Returns the first page's response with the features of all pages merged in order
+def fetch_all_features(url, params, metadata, max_workers=MAX_PAGE_WORKERS):
+    pages, page_size = build_pages(url, params, metadata)
+    oid_field = get_oid_field(metadata)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages)))) as executor:
+        results = list(executor.map(lambda page: fetch_page(url, params, page, oid_field, page_size), pages))
+
+    merged = None
+    features = []
+    for data, page_features in results:
+        if merged is None or (not merged.get('fields') and data.get('fields')):
+            merged = data
+        features.extend(page_features)
+
+    merged = dict(merged or {})
+    merged['features'] = features
+    merged.pop('exceededTransferLimit', None)
+    return merged, len(pages)
+
+# Function to stream one page straight to disk, returning the scanned result
+# PBF pages are decoded in memory (a page is bounded by maxRecordCount) and staged as Esri JSON
+def stream_page(url, params, page, path, oid_field, page_size=None):
+    if params.get('f') == 'pbf':
+        data, features = fetch_page(url, params, page, oid_field, page_size)
+        with open(path, 'w') as f:
+            json.dump({**data, 'features': features}, f)
+        return scan_file(path)
+
+    with http_client.get(url, params={**params, **page}, stream=True) as response:
+        response.raise_for_status()
+        result = stream_response_to_file(response, path)
+    if result.error:
+        raise RuntimeError(f"Service error: {result.error.get('message', result.error)}")
+    if result.header.get('exceededTransferLimit'):
+        # Rare: the server truncated the page, so let fetch_page continue it in memory (one page at most)
+        data, features = fetch_page(url, params, page, oid_field, page_size)
+        with open(path, 'w') as f:
+            json.dump({**data, 'features': features}, f)
+        result = scan_file(path)
+    elif not oid_field and not page and page_size and result.feature_count >= page_size:
+        log_message(f"Query returned {result.feature_count} features, the service's page size, and the layer has no object ID "
+                    "field to page by; the rest of the layer may be missing", "WARNING")
+    return result
+
+# Function to download every feature of a layer into a single staging file without holding it in memory
+# Pages are streamed to their own files concurrently, then joined in order
+def download_features_to_file(url, params, metadata, json_path, transform=None, max_workers=MAX_PAGE_WORKERS):
+    pages, page_size = build_pages(url, params, metadata)
+    oid_field = get_oid_field(metadata)
+    base_path = os.path.splitext(json_path)[0]
+    page_paths = [f"{base_path}_page{index:05d}.json" for index in range(len(pages))]
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages)))) as executor:
+            results = list(executor.map(lambda page, path: stream_page(url, params, page, path, oid_field, page_size),
+                                        pages, page_paths))
+        feature_count = assemble_feature_file(results, json_path, transform)
+    finally:
+        for path in page_paths:
+            if os.path.exists(path):
+                os.remove(path)
+    return feature_count, len(pages)
+
+# Function to download every feature of a layer straight into a streaming output sink
+# Pages are fetched concurrently (at most max_workers ahead of the writer) and handed over in order
+def download_features_to_sink(url, params, metadata, sink, target, transform=None, replace=True, index_fields=(),
+                              max_workers=MAX_PAGE_WORKERS):
+    pages, page_size = build_pages(url, params, metadata)
+    oid_field = get_oid_field(metadata)
+
+    def page_data():
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pages)))) as executor:
+            pending = deque()
+            for page in pages:
+                pending.append(executor.submit(fetch_page, url, params, page, oid_field, page_size))
+                if len(pending) > max_workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+
+    def transformed():
+        for data, features in page_data():
+            data = dict(data, features=features)
+            data.pop('exceededTransferLimit', None)
+            yield transform(data) if transform is not None else data
+
+    feature_count = sink.write_pages(target, transformed(), replace=replace, index_fields=index_fields)
+    return feature_count, len(pages)
+
+# Function to get every object ID matching the query
+def get_object_ids(url, where, spatial=None):
+    data = query_json(url, {'where': where, **(spatial or {}), 'returnIdsOnly': 'true', 'f': 'json'})
+    return set(data.get('objectIds') or [])
+
+# Function to get the last data edit time (epoch milliseconds) reported by the layer metadata
+def get_last_edit_date(metadata):
+    editing_info = metadata.get('editingInfo') or {}
+    return editing_info.get('dataLastEditDate') or editing_info.get('lastEditDate')
+
+# Function to format an epoch-milliseconds value for a standardized SQL where clause
+def format_query_timestamp(epoch_ms):
+    moment = datetime.datetime.fromtimestamp(epoch_ms / 1000, tz=datetime.timezone.utc)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+# Function to read the sync watermark stored for a layer, or None if it was never synced
+def load_sync_state(state_path, sync_key):
+    with sync_state_lock:
+        if not os.path.exists(state_path):
+            return None
+        with open(state_path) as f:
+            return json.load(f).get(sync_key)
+
+# Function to store the sync watermark for a layer
+def save_sync_state(state_path, sync_key, entry):
+    with sync_state_lock:
+        state = {}
+        if os.path.exists(state_path):
+            with open(state_path) as f:
+                state = json.load(f)
+        state[sync_key] = entry
+        temp_path = f"{state_path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(temp_path, state_path)
+
+# Function to build a page transform that copies each source object ID into SOURCE_ID_FIELD
+# and records the highest object ID and edit date staged in watermarks
+def make_source_id_transform(oid_field, edit_field, watermarks):
+    def transform(data):
+        fields = data.setdefault('fields', [])
+        if not any(field.get('name') == SOURCE_ID_FIELD for field in fields):
+            fields.append({'name': SOURCE_ID_FIELD, 'type': 'esriFieldTypeInteger', 'alias': SOURCE_ID_FIELD})
+        for feature in data.get('features') or []:
+            attributes = feature.setdefault('attributes', {})
+            oid = attributes.get(oid_field)
+            attributes[SOURCE_ID_FIELD] = oid
+            if oid is not None and (watermarks.get('max_oid') is None or oid > watermarks['max_oid']):
+                watermarks['max_oid'] = oid
+            edit_date = attributes.get(edit_field) if edit_field else None
+            if edit_date is not None and (watermarks.get('max_edit_date') is None or edit_date > watermarks['max_edit_date']):
+                watermarks['max_edit_date'] = edit_date
+        return data
+    return transform
+
+# Function to chain page transforms, skipping unused ones
+def compose_transforms(*transforms):
+    transforms = [transform for transform in transforms if transform is not None]
+    if not transforms:
+        return None
+
+    def transform(data):
+        for step in transforms:
+            data = step(data)
+        return data
+    return transform
+
+# Function to build the page transform that writes area and length attributes, or None if it does not apply
+# Units come from the layer's own spatial reference; the service-level units are only used when it can't be read
+def make_measure_transform(metadata, service_units):
+    if metadata.get('geometryType') not in (None, 'esriGeometryPolygon', 'esriGeometryPolyline'):
+        return None
+    layer_name = metadata.get('name', '')
+    reference = (metadata.get('extent') or {}).get('spatialReference') or metadata.get('spatialReference')
+    kind, unit_scale = spatial_reference_units(reference)
+    if kind is None and service_units == 'esriDecimalDegrees':
+        kind = 'geographic'
+    elif kind is None and service_units in LINEAR_UNIT_METERS:
+        kind, unit_scale = 'projected', LINEAR_UNIT_METERS[service_units]
+
+    if kind == 'geographic':
+        log_message(f"Layer {layer_name} is in geographic coordinates; planar area and length are not calculated")
+        return None
+    if unit_scale is None:
+        log_message(f"Layer {layer_name}: units of spatial reference {reference} could not be determined; "
+                    "planar area and length are not calculated", "WARNING")
+        return None
+    return lambda data: add_measures(data, unit_scale)
+
+# Function to apply only the changes since the last sync to an existing feature class
+# Added and edited features are re-downloaded and upserted on SOURCE_ID_FIELD; features gone from the service are deleted
+# Returns a dict of change counts, or None if the layer was unchanged
+def sync_layer(layer_num, layer_name, url, params, metadata, sink, output_fc, json_path, state_path, sync_key, state, page_transform=None):
+    last_edit_date = get_last_edit_date(metadata)
+    if last_edit_date is not None and last_edit_date == state.get('last_edit_date'):
+        log_message(f"Layer {layer_num} ({layer_name}) unchanged since last sync, skipped")
+        return None
+
+    oid_field = get_oid_field(metadata)
+    edit_field = (metadata.get('editFieldsInfo') or {}).get('editDateField')
+    where = params.get('where', '1=1')
+
+    conditions = []
+    if state.get('max_oid') is not None:
+        conditions.append(f"{oid_field} > {state['max_oid']}")
+    if edit_field and state.get('max_edit_date') is not None:
+        # Inclusive, since the timestamp is truncated to whole seconds; re-applying a row is harmless
+        conditions.append(f"{edit_field} >= TIMESTAMP '{format_query_timestamp(state['max_edit_date'])}'")
+    elif not edit_field:
+        log_message(f"Layer {layer_num} ({layer_name}) has no edit date field; only added and deleted features are synced", "WARNING")
+    delta_params = dict(params)
+    if conditions:
+        delta_params['where'] = f"({where}) AND ({' OR '.join(conditions)})"
+
+    watermarks = {'max_oid': state.get('max_oid'), 'max_edit_date': state.get('max_edit_date')}
+    transform = compose_transforms(make_source_id_transform(oid_field, edit_field, watermarks), page_transform)
+    with run_metrics.span('query') as query_span:
+        delta_data, page_count = fetch_all_features(url, delta_params, metadata)
+        delta_data = transform(delta_data)
+        changed_ids = {feature['attributes'][SOURCE_ID_FIELD] for feature in delta_data['features']}
+        server_ids = get_object_ids(url, where, query_profile.spatial_filter(params))
+        query_span.add(features=len(delta_data['features']), pages=page_count)
+
+    with sink.lock():
+        with run_metrics.span('cursor_pass') as cursor_span:
+            local_ids = sink.source_ids(output_fc, SOURCE_ID_FIELD)
+            deleted_ids = local_ids - server_ids
+            stale_ids = (changed_ids & local_ids) | deleted_ids
+            if stale_ids:
+                sink.delete_source_ids(output_fc, SOURCE_ID_FIELD, stale_ids)
+            cursor_span.add(features=len(local_ids), deleted=len(stale_ids))
+
+        if delta_data['features']:
+            sink.append(output_fc, delta_data, json_path)
+
+    save_sync_state(state_path, sync_key, {
+        'last_edit_date': last_edit_date,
+        'max_oid': watermarks['max_oid'],
+        'max_edit_date': watermarks['max_edit_date'],
+    })
+    updated = len(changed_ids & local_ids)
+    counts = {'added': len(changed_ids) - updated, 'updated': updated, 'deleted': len(deleted_ids)}
+    log_message(f"Synced {output_fc}: {counts['added']} added, {counts['updated']} updated, {counts['deleted']} deleted")
+    return counts
+
+# Function to process each layer individually
+# Returns a result dict: service, layer_id, layer_name, output, status (done, synced, unchanged, empty, failed),
+# features, pages, error and seconds
+# layer_query is a query profile narrowing the download (fields, filters, generalization, quantization; see query_profile.py)
+# transport 'pbf' downloads binary feature collections when the layer supports them, JSON otherwise
+# output_gdb is a file geodatabase, or a .gpkg file written without arcpy (see output_sinks.py)
+def process_layer(layer_num, layer_name, output_gdb, base_url, stream_to_disk=True, incremental=False,
+                  service_units=None, staging_dir=STAGING_DIR, layer_query=None, transport='json'):
+    started = time.time()
+    sanitized_layer_name = sanitize_layer_name(layer_name)
+    url = f"{base_url}/{layer_num}/query"
+    result = {
+        'service': base_url,
+        'layer_id': layer_num,
+        'layer_name': layer_name,
+        'output': None,
+        'status': 'failed',
+        'features': 0,
+        'pages': 0,
+        'error': None,
+    }
+    log_message(f"Processing layer {layer_num} - {layer_name} from URL: {url}")
+
+    try:
+        sink = output_sinks.open_sink(output_gdb, log=lambda message: log_message(message, "WARNING"))
+        output_fc = result['output'] = sink.target(sanitized_layer_name)
+        with run_metrics.span('layer', service=base_url, layer_id=layer_num, layer_name=layer_name) as layer_span:
+            _process_layer(result, layer_num, layer_name, url, sink, output_fc, base_url,
+                           stream_to_disk, incremental, service_units, staging_dir, layer_query, transport)
+            layer_span.add(features=result['features'], pages=result['pages'])
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = str(e)
+        log_message(f"An error occurred while processing layer {layer_num} ({layer_name}): {e}", "ERROR")
+    result['seconds'] = round(time.time() - started, 3)
+    return result
+
+# Function doing the work of process_layer, filling in its result dict
+def _process_layer(result, layer_num, layer_name, url, sink, output_fc, base_url,
+                   stream_to_disk, incremental, service_units, staging_dir, profile, transport):
+    with run_metrics.span('metadata_fetch'):
+        # Every layer of the service is described by one catalog request, shared by the layers of the run
+        # Without metadata the layer still downloads (with default paging), so no failure here is fatal
+        try:
+            layer_metadata = service_catalog.get_catalog().layer_definition(base_url, layer_num, service_catalog.RUN_MAX_AGE)
+        except Exception as e:
+            log_message(f"Failed to retrieve metadata for layer {layer_num}: {e}", "WARNING")
+            layer_metadata = {}
+
+    # Staging names include a hash of the layer URL so layers from different services never collide
+    url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()[:8]
+    json_path = os.path.join(staging_dir, f'{sanitize_layer_name(layer_name)}_{url_hash}_features.json')
+    os.makedirs(staging_dir, exist_ok=True)
+
+    # Incremental sync: apply changes to the existing output, or do a full load that records a watermark
+    state_path = os.path.join(staging_dir, SYNC_STATE_FILE)
+    sync_key = f"{base_url}/{layer_num}|{output_fc}"
+    if profile:
+        # A different profile selects different features, so it gets its own watermark
+        sync_key += '|' + hashlib.md5(json.dumps(profile, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    oid_field = get_oid_field(layer_metadata)
+    edit_field = (layer_metadata.get('editFieldsInfo') or {}).get('editDateField')
+
+    # The object ID (paging, sync) and edit date (sync) fields stay in the query whatever fields the profile selects
+    params, quantized = query_profile.build_query_params(profile, layer_metadata, (oid_field, edit_field),
+                                                         log=lambda message: log_message(message, "WARNING"))
+    # PBF pages only carry field names and types, so they get the layer's full field definitions back
+    field_transform = None
+    if transport == 'pbf':
+        if pbf_features.supports_pbf(layer_metadata):
+            params['f'] = 'pbf'
+            field_transform = pbf_features.make_field_transform(layer_metadata)
+        else:
+            log_message(f"Layer {layer_num} ({layer_name}) does not offer PBF output; downloading JSON")
+
+    # Quantized pages are decoded before anything else looks at their coordinates
+    measure_transform = make_measure_transform(layer_metadata, service_units) if params['returnGeometry'] else None
+    page_transform = compose_transforms(field_transform, dequantize if quantized else None, measure_transform)
+    transform = page_transform
+    watermarks = {}
+    if incremental and not oid_field:
+        log_message(f"Layer {layer_num} ({layer_name}) has no object ID field; running a full download", "WARNING")
+        incremental = False
+    if incremental:
+        state = load_sync_state(state_path, sync_key)
+        if state is not None and sink.exists(output_fc):
+            counts = sync_layer(layer_num, layer_name, url, params, layer_metadata, sink, output_fc, json_path,
+                                state_path, sync_key, state, page_transform)
+            if counts is None:
+                result['status'] = 'unchanged'
+            else:
+                result['status'] = 'synced'
+                result.update(counts)
+                result['features'] = counts['added'] + counts['updated']
+            return
+        transform = compose_transforms(make_source_id_transform(oid_field, edit_field, watermarks), page_transform)
+
+    # Streamed downloads write the staging file (or the output itself) as they go, so their query span covers the write too
+    if sink.streaming:
+        with run_metrics.span('query') as query_span:
+            feature_count, page_count = download_features_to_sink(url, params, layer_metadata, sink, output_fc, transform,
+                                                                  index_fields=(SOURCE_ID_FIELD,) if incremental else ())
+            query_span.add(features=feature_count, pages=page_count)
+    else:
+        feature_count, page_count = stage_features(url, params, layer_metadata, json_path, transform, stream_to_disk)
+    result['features'] = feature_count
+    result['pages'] = page_count
+
+    if not feature_count:
+        result['status'] = 'empty'
+        log_message(f"No data returned for layer {layer_num} ({layer_name})", "WARNING")
+        return
+
+    log_message(f"Downloaded {feature_count} features in {page_count} page(s)")
+    if measure_transform is not None and not sink.streaming:
+        log_message(f"Area and length calculated while staging: {json_path}")
+
+    # Only one layer at a time writes to a given output
+    with sink.lock():
+        if sink.streaming:
+            log_message(f"Features written to: {output_fc}")
+        else:
+            with run_metrics.span('json_to_features') as convert_span:
+                sink.load_file(output_fc, json_path)
+                convert_span.add(features=feature_count)
+            log_message(f"Conversion to Feature Class completed: {output_fc}")
+
+        # Apply metadata from API response to the output
+        if layer_metadata:
+            with run_metrics.span('metadata_save'):
+                sink.apply_metadata(output_fc, layer_metadata, layer_name)
+            log_message(f"Metadata applied to: {output_fc}")
+
+    if incremental:
+        save_sync_state(state_path, sync_key, {
+            'last_edit_date': get_last_edit_date(layer_metadata),
+            'max_oid': watermarks.get('max_oid'),
+            'max_edit_date': watermarks.get('max_edit_date'),
+        })
+    result['status'] = 'done'
+
+# Function to download a layer into its staging file for a sink that loads files
+# Returns (feature count, page count)
+def stage_features(url, params, layer_metadata, json_path, transform, stream_to_disk):
+    try:
+        if stream_to_disk:
+            with run_metrics.span('query') as query_span:
+                feature_count, page_count = download_features_to_file(url, params, layer_metadata, json_path, transform)
+                query_span.add(features=feature_count, pages=page_count,
+                               bytes=os.path.getsize(json_path) if feature_count else 0)
+        else:
+            with run_metrics.span('query') as query_span:
+                json_data, page_count = fetch_all_features(url, params, layer_metadata)
+                if transform is not None:
+                    json_data = transform(json_data)
+                feature_count = len(json_data['features'])
+                query_span.add(features=feature_count, pages=page_count)
+            if feature_count:
+                with run_metrics.span('staging_write') as write_span:
+                    with open(json_path, 'w') as f:
+                        json.dump(json_data, f)
+                    write_span.add(bytes=os.path.getsize(json_path))
+    except Exception as e:
+        raise RuntimeError(f"Request error: {e}") from e
+    return feature_count, page_count
+
+# Function to run layer jobs concurrently, with at most max_workers layers running at once
+# Each job is a dict of process_layer keyword arguments; results come back in job order
+def run_layer_jobs(jobs, max_workers=DEFAULT_LAYER_WORKERS):
+    results = [None] * len(jobs)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(process_layer, **job): index for index, job in enumerate(jobs)}
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    return results
+
+# Function to process layers of one service into one geodatabase
+# With a metrics_path the stage timings of the run are written there (JSON, or CSV for a .csv path)
+# query_profiles maps layer ids (or "*") to query profiles, see query_profile.load_profiles
+def process_layers(layers, output_gdb, base_url, max_workers, stream_to_disk=True, incremental=False, service_units=None,
+                   metrics_path=None, query_profiles=None, transport='json'):
+    log_message(f"Processing {len(layers)} layer(s), {max_workers} at a time...")
+    jobs = [
+        {
+            'layer_num': layer_num,
+            'layer_name': layer_name,
+            'output_gdb': output_gdb,
+            'base_url': base_url,
+            'stream_to_disk': stream_to_disk,
+            'incremental': incremental,
+            'service_units': service_units,
+            'layer_query': query_profile.profile_for(query_profiles, layer_num),
+            'transport': transport,
+        }
+        for layer_num, layer_name in layers
+    ]
+    if metrics_path:
+        with run_metrics.RunRecorder('rest_to_gdb', metrics_path, service=base_url, workers=max_workers):
+            results = run_layer_jobs(jobs, max_workers)
+        log_message(f"Run metrics written to {metrics_path}")
+    else:
+        results = run_layer_jobs(jobs, max_workers)
+    log_message("Processing completed for all selected layers.")
+    return results
@@ -0,0 +1,261 @@
+import cProfile
+import csv
+import datetime
+import itertools
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; the peak working set is read through ctypes there
+    resource = None
+
+# Lightweight run tracing for the ArcBridge pipelines.
+# Code marks its stages with `with run_metrics.span('stage', layer_id=3) as s: ... s.add(bytes=n)`.
+# While a run recorder is active every finished span is kept with its wall time, counters
+# (bytes, features, ...), labels inherited from enclosing spans and the process's peak RSS;
+# RunRecorder.close() writes them to a JSON or CSV file. Without an active recorder a span
+# costs a couple of attribute lookups.
+
+# Columns of the CSV metrics file; labels and any other counters go into the last two as JSON
+CSV_COLUMNS = ('run', 'span_id', 'parent_id', 'name', 'thread', 'start', 'seconds', 'bytes', 'features',
+               'peak_rss', 'labels', 'counters')
+
+# Recorders currently collecting spans
+_active = []
+_active_lock = threading.Lock()
+
+# Stack of open spans per thread
+_local = threading.local()
+
+_span_ids = itertools.count(1)
+
+
+# Function to read the peak resident set size of this process in bytes (None when unavailable)
+def peak_rss():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + [
+                (name, ctypes.c_size_t) for name in (
+                    'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                    'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage',
+                )
+            ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except Exception:
+        pass
+    return None
+
+
+# One timed stage; counters are summed with add()
+class Span:
+    def __init__(self, name, labels, parent):
+        self.id = next(_span_ids)
+        self.name = name
+        self.parent_id = parent.id if parent is not None else None
+        self.labels = dict(parent.labels, **labels) if parent is not None else labels
+        self.counters = {}
+        self.thread = threading.current_thread().name
+        self.start = time.time()
+        self.seconds = None
+        self.peak_rss = None
+
+    # Function to add to the span's counters, e.g. add(bytes=len(data), features=10)
+    def add(self, **counters):
+        for key, value in counters.items():
+            if value:
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    # Function to describe the finished span
+    def to_dict(self):
+        return {
+            'span_id': self.id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'thread': self.thread,
+            'start': datetime.datetime.fromtimestamp(self.start).isoformat(timespec='milliseconds'),
+            'seconds': round(self.seconds, 6),
+            'peak_rss': self.peak_rss,
+            'labels': self.labels,
+            'counters': self.counters,
+        }
+
+
+# Stand-in returned while no recorder is active
+class _NullSpan:
+    labels = {}
+
+    def add(self, **counters):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+# Function to time a stage of the current run; labels describe it (layer, job, ...) and are inherited by nested spans
+@contextmanager
+def span(name, **labels):
+    if not _active:
+        yield _NULL_SPAN
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    current = Span(name, labels, stack[-1] if stack else None)
+    profiler = None
+    if not stack:
+        profiler = _start_profile()
+    stack.append(current)
+    started = time.perf_counter()
+    try:
+        yield current
+    finally:
+        current.seconds = time.perf_counter() - started
+        stack.pop()
+        if profiler is not None:
+            profiler.disable()
+        current.peak_rss = peak_rss()
+        with _active_lock:
+            recorders = list(_active)
+        for recorder in recorders:
+            recorder._record(current, profiler)
+
+
+# Function to add counters to the innermost open span of this thread (no-op outside a span)
+def add(**counters):
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1].add(**counters)
+
+
+# Function to start a profiler for an outermost span when an active recorder wants profiles
+def _start_profile():
+    with _active_lock:
+        wanted = any(recorder.profile_path for recorder in _active)
+    if not wanted:
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:  # Another profiler already owns this interpreter (Python 3.12+)
+        return None
+    return profiler
+
+
+# Collects the spans of one run and writes them out when closed
+# metrics_path ends in .csv for one row per span, anything else gets JSON with a per-stage summary;
+# profile_path, if given, receives the merged cProfile stats of every outermost span (pstats format)
+class RunRecorder:
+    def __init__(self, name, metrics_path=None, profile_path=None, **labels):
+        self.name = name
+        self.metrics_path = metrics_path
+        self.profile_path = profile_path
+        self.labels = labels
+        self.spans = []
+        self._profiles = []
+        self._lock = threading.Lock()
+        self.started = time.time()
+        with _active_lock:
+            _active.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # Function to keep a finished span (and its profile)
+    def _record(self, current, profiler):
+        with self._lock:
+            self.spans.append(current.to_dict())
+            if profiler is not None and self.profile_path:
+                self._profiles.append(profiler)
+
+    # Function to total wall time and counters per stage name
+    def summary(self):
+        stages = {}
+        for entry in self.spans:
+            stage = stages.setdefault(entry['name'], {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'counters': {}})
+            stage['count'] += 1
+            stage['seconds'] += entry['seconds']
+            stage['max_seconds'] = max(stage['max_seconds'], entry['seconds'])
+            for key, value in entry['counters'].items():
+                stage['counters'][key] = stage['counters'].get(key, 0) + value
+        for stage in stages.values():
+            stage['seconds'] = round(stage['seconds'], 6)
+            stage['max_seconds'] = round(stage['max_seconds'], 6)
+        return stages
+
+    # Function to stop recording and write the metrics (and profile) files; returns the run as a dict
+    def close(self):
+        with _active_lock:
+            if self in _active:
+                _active.remove(self)
+        run = {
+            'run': self.name,
+            'labels': self.labels,
+            'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+            'seconds': round(time.time() - self.started, 3),
+            'peak_rss': peak_rss(),
+            'stages': self.summary(),
+            'spans': self.spans,
+        }
+        if self.metrics_path:
+            write_metrics(run, self.metrics_path)
+        if self.profile_path and self._profiles:
+            stats = pstats.Stats(self._profiles[0])
+            for profiler in self._profiles[1:]:
+                stats.add(profiler)
+            stats.dump_stats(self.profile_path)
+        return run
+
+
+# Function to write a run's metrics as JSON, or as CSV (one row per span) when the path ends in .csv
+def write_metrics(run, path):
+    folder = os.path.dirname(os.path.abspath(path))
+    os.makedirs(folder, exist_ok=True)
+    if not path.lower().endswith('.csv'):
+        with open(path, 'w') as f:
+            json.dump(run, f, indent=2)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+        writer.writeheader()
+        for entry in run['spans']:
+            counters = dict(entry['counters'])
+            writer.writerow({
+                'run': run['run'],
+                'span_id': entry['span_id'],
+                'parent_id': entry['parent_id'],
+                'name': entry['name'],
+                'thread': entry['thread'],
+                'start': entry['start'],
+                'seconds': entry['seconds'],
+                'bytes': counters.pop('bytes', 0),
+                'features': counters.pop('features', 0),
+                'peak_rss': entry['peak_rss'],
+                'labels': json.dumps(entry['labels']),
+                'counters': json.dumps(counters),
+            })
+
+
+# Function to build a timestamped metrics path for a tool's run, e.g. ~/.arcbridge/metrics/rest_to_gdb_20240101_120000.json
+def default_metrics_path(tool, folder=None):
+    folder = folder or os.path.join(os.path.expanduser('~'), '.arcbridge', 'metrics')
+    return os.path.join(folder, f"{tool}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
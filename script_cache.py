@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+import http_client
+
+# Local cache of the scripts the launcher fetches from GitHub.
+# Every script is kept on disk with the ETag it was served with. A fetch sends
+# If-None-Match, so an unchanged script costs a 304 and no download, and is skipped
+# entirely when it was validated within the last REVALIDATE_INTERVAL seconds. When
+# GitHub can't be reached the last good copy is served instead.
+
+# Seconds a validated script is served without asking GitHub again
+REVALIDATE_INTERVAL = 60
+
+# Revalidation gives up quickly so an offline launcher falls back to the cached copy without a long wait
+REVALIDATE_TIMEOUT = (5, 30)
+REVALIDATE_ATTEMPTS = 2
+
+# Name of the file holding the ETags of the cached scripts
+INDEX_NAME = '.etags.json'
+
+
+class ScriptCache:
+    def __init__(self, base_url, cache_dir, revalidate_interval=REVALIDATE_INTERVAL, log=print):
+        self.base_url = base_url
+        self.cache_dir = cache_dir
+        self.revalidate_interval = revalidate_interval
+        self.log = log
+        self._validated = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._index_path = os.path.join(cache_dir, INDEX_NAME)
+        try:
+            with open(self._index_path) as f:
+                self._etags = json.load(f)
+        except (OSError, ValueError):
+            self._etags = {}
+
+    # Function to write the ETag index atomically
+    def _save_index(self):
+        temp_path = f"{self._index_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self._etags, f)
+        os.replace(temp_path, self._index_path)
+
+    # Function to return the local path of a script, downloading it only when it changed
+    # Returns None when the script can't be fetched and there is no cached copy
+    def fetch(self, script_name):
+        local_path = os.path.join(self.cache_dir, script_name)
+        cached = os.path.exists(local_path)
+        if cached and time.time() - self._validated.get(script_name, 0) < self.revalidate_interval:
+            return local_path
+
+        headers = {}
+        if cached and self._etags.get(script_name):
+            headers['If-None-Match'] = self._etags[script_name]
+        try:
+            response = http_client.get(f"{self.base_url}{script_name}", headers=headers,
+                                       timeout=REVALIDATE_TIMEOUT, max_attempts=REVALIDATE_ATTEMPTS)
+        except Exception as e:
+            if cached:
+                self.log(f"Could not reach GitHub for {script_name} ({e}); using the cached copy.")
+                return local_path
+            self.log(f"Failed to download {script_name} from GitHub: {e}")
+            return None
+
+        if response.status_code == 304 and cached:
+            self._validated[script_name] = time.time()
+            return local_path
+        if response.status_code == 200:
+            temp_path = f"{local_path}.{uuid.uuid4().hex}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(response.content)
+            os.replace(temp_path, local_path)
+            with self._lock:
+                self._etags[script_name] = response.headers.get('ETag')
+                self._save_index()
+            self._validated[script_name] = time.time()
+            self.log(f"{script_name} downloaded successfully from GitHub.")
+            return local_path
+        if cached:
+            self.log(f"GitHub returned {response.status_code} for {script_name}; using the cached copy.")
+            return local_path
+        self.log(f"Failed to download {script_name} from GitHub.")
+        return None
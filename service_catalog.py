@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import disk_cache
+
+# Cached catalog of feature and map service definitions.
+# A service's layer and table definitions are fetched with one /layers?f=json request, or
+# concurrently one per layer on servers without that endpoint, and kept on disk (expiring after
+# CATALOG_TTL, then revalidated with the server's ETag/Last-Modified when it sends them) and in
+# memory. The layer picker and the per-layer metadata step of a run both read from here, so a
+# service with hundreds of layers costs one round-trip instead of one per layer.
+
+# Folder of the on-disk catalog cache
+CATALOG_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.arcbridge', 'catalog')
+
+# Size budget of the catalog cache
+CATALOG_CACHE_MAX_BYTES = 256 * 1024 ** 2
+
+# Seconds before a cached definition is revalidated with the server
+CATALOG_TTL = 15 * 60
+
+# Definitions older than this are revalidated before a run uses them, so a run sees current
+# editing info (last edit dates) without paying a request when the picker has just loaded them
+RUN_MAX_AGE = 60
+
+# Number of layer definitions fetched at the same time when the service has no /layers endpoint
+METADATA_WORKERS = 8
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+# Function to get the catalog shared by the tools of this process
+def get_catalog():
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ServiceCatalog()
+        return _catalog
+
+
+# Function to replace the shared catalog, e.g. with one caching somewhere else
+def set_catalog(catalog):
+    global _catalog
+    with _catalog_lock:
+        _catalog = catalog
+
+
+# Function to normalize a service URL for use as a catalog key
+def _service_key(base_url):
+    return base_url.strip().rstrip('/')
+
+
+class ServiceCatalog:
+    def __init__(self, cache_dir=CATALOG_CACHE_DIR, ttl=CATALOG_TTL, max_bytes=CATALOG_CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.cache = disk_cache.DiskCache(cache_dir, max_bytes, ttl)
+        self._layers = {}
+        self._service_locks = defaultdict(threading.Lock)
+        self._lock = threading.Lock()
+
+    # Function to GET a JSON document through the disk cache; returns (document, cache status)
+    # Raises on HTTP errors and on ArcGIS error bodies (which come back with status 200 and are never kept)
+    def _get_json(self, url, max_age=None):
+        with disk_cache.cached_response(self.cache, url, {'f': 'json'}, max_age=max_age) as result:
+            if result['status_code'] != 200 or result['path'] is None:
+                raise RuntimeError(f"HTTP {result['status_code']} from {url}")
+            with open(result['path'], 'rb') as f:
+                document = json.load(f)
+        if isinstance(document, dict) and 'error' in document:
+            self.cache.delete(disk_cache.cache_key(url, {'f': 'json'}))
+            raise RuntimeError(f"Service error: {document['error'].get('message', document['error'])}")
+        return document, result['cache']
+
+    # Function to get the service description (layers, tables, units, ...)
+    def service_info(self, base_url, max_age=None):
+        return self._get_json(_service_key(base_url), max_age)[0]
+
+    # Function to get every layer and table definition of a service, keyed by id
+    # Returns the in-memory copy while it is younger than max_age (default: the catalog TTL)
+    def layer_definitions(self, base_url, max_age=None):
+        key = _service_key(base_url)
+        max_age = self.ttl if max_age is None else max_age
+        with self._lock:
+            service_lock = self._service_locks[key]
+        # One thread loads a service while the others wait for its result
+        with service_lock:
+            loaded = self._layers.get(key)
+            if loaded is not None and time.time() - loaded[0] < max_age:
+                return loaded[1]
+            definitions = self._load_definitions(key, max_age)
+            self._layers[key] = (time.time(), definitions)
+            return definitions
+
+    # Function to fetch the definitions from /layers, or layer by layer when the server lacks it
+    def _load_definitions(self, key, max_age):
+        try:
+            document, _ = self._get_json(f"{key}/layers", max_age)
+            if 'layers' in document:
+                return {item['id']: item for item in (document.get('layers') or []) + (document.get('tables') or [])}
+        except Exception:
+            pass
+
+        info = self.service_info(key, max_age)
+        ids = [item['id'] for item in (info.get('layers') or []) + (info.get('tables') or [])]
+        if not ids:
+            return {}
+        with ThreadPoolExecutor(max_workers=min(METADATA_WORKERS, len(ids))) as executor:
+            documents = executor.map(lambda layer_id: self._get_json(f"{key}/{layer_id}", max_age)[0], ids)
+            return dict(zip(ids, documents))
+
+    # Function to get one layer's definition, falling back to its own request if the service listing lacks it
+    def layer_definition(self, base_url, layer_id, max_age=None):
+        definitions = self.layer_definitions(base_url, max_age)
+        definition = definitions.get(layer_id)
+        if definition is None:
+            definition, _ = self._get_json(f"{_service_key(base_url)}/{layer_id}", max_age)
+        return definition
+
+    # Function to load a service's definitions on a background thread, e.g. while the user picks layers
+    def prefetch(self, base_url, log=None):
+        def load():
+            try:
+                self.layer_definitions(base_url)
+            except Exception as e:
+                if log is not None:
+                    log(f"Could not prefetch layer definitions: {e}")
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+
+    # Function to drop the in-memory copy of a service, so the next lookup goes back to the disk cache
+    def forget(self, base_url):
+        self._layers.pop(_service_key(base_url), None)
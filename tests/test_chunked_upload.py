@@ -0,0 +1,267 @@
+import hashlib
+import json
+import os
+import threading
+
+import pytest
+
+import chunked_upload
+from chunked_upload import ArcGISUploadEndpoint, ChunkedUpload
+
+PART_SIZE = 1024
+
+
+# Local stand-in for the sharing API's multipart upload calls, keeping items in memory
+# fail_parts maps a part number to how many more times uploading it fails
+class FakeUploadEndpoint:
+    def __init__(self, fail_parts=None, commit_status='completed'):
+        self.items = {}
+        self.part_calls = []
+        self.fail_parts = dict(fail_parts or {})
+        self.commit_status = commit_status
+        self.lost_items = set()
+        self._lock = threading.Lock()
+
+    def add_item(self, filename, properties):
+        item_id = f'item{len(self.items) + 1}'
+        self.items[item_id] = {'filename': filename, 'properties': properties, 'parts': {}, 'status': 'partial', 'data': None}
+        return item_id
+
+    def update_item(self, item_id, filename, properties):
+        self.items[item_id] = {'filename': filename, 'properties': properties, 'parts': {}, 'status': 'partial', 'data': None}
+
+    def add_part(self, item_id, part_number, data):
+        with self._lock:
+            self.part_calls.append(part_number)
+            if self.fail_parts.get(part_number):
+                self.fail_parts[part_number] -= 1
+                raise RuntimeError(f"Upload request failed: part {part_number} was dropped")
+            self.items[item_id]['parts'][part_number] = bytes(data)
+
+    def commit(self, item_id, properties):
+        item = self.items[item_id]
+        item['data'] = b''.join(item['parts'][number] for number in sorted(item['parts']))
+        item['status'] = self.commit_status
+
+    def status(self, item_id):
+        if item_id not in self.items or item_id in self.lost_items:
+            raise RuntimeError(f"Upload request failed: item {item_id} does not exist")
+        return {'itemId': item_id, 'status': self.items[item_id]['status']}
+
+
+@pytest.fixture(autouse=True)
+def no_commit_wait(monkeypatch):
+    monkeypatch.setattr(chunked_upload, 'COMMIT_POLL_INTERVAL', 0)
+
+
+# Function to build an upload of a file in tmp_path with small parts
+def make_upload(endpoint, tmp_path, max_workers=1, item_id=None, part_size=PART_SIZE):
+    return ChunkedUpload(endpoint, str(tmp_path / 'data.zip.upload.json'), 'data.zip', {'title': 'Data'},
+                         part_size=part_size, max_workers=max_workers, log=lambda message: None, item_id=item_id)
+
+
+# Function to run an upload of data to the end and return its item id
+# Like the publisher, the upload threads are stopped when feeding fails
+def upload_all(upload, data):
+    upload.begin()
+    try:
+        upload.feed(data)
+    except Exception:
+        upload.close()
+        raise
+    return upload.finish()
+
+
+# Function to read the journal of an interrupted upload
+def read_journal(tmp_path):
+    with open(tmp_path / 'data.zip.upload.json') as f:
+        return json.load(f)
+
+
+def payload(size, seed=0):
+    return bytes((index * 7 + seed) % 251 for index in range(size))
+
+
+def test_upload_in_parts(tmp_path):
+    endpoint = FakeUploadEndpoint()
+    data = payload(PART_SIZE * 5 + 100)
+    upload = make_upload(endpoint, tmp_path, max_workers=3)
+    item_id = upload_all(upload, data)
+    assert endpoint.items[item_id]['data'] == data
+    assert sorted(endpoint.part_calls) == [1, 2, 3, 4, 5, 6]
+    assert upload.uploaded == 6 and upload.skipped == 0
+    assert not os.path.exists(tmp_path / 'data.zip.upload.json')
+
+
+def test_empty_file_is_one_part(tmp_path):
+    endpoint = FakeUploadEndpoint()
+    item_id = upload_all(make_upload(endpoint, tmp_path), b'')
+    assert endpoint.part_calls == [1]
+    assert endpoint.items[item_id]['data'] == b''
+
+
+def test_resume_from_journal_sends_only_missing_parts(tmp_path):
+    endpoint = FakeUploadEndpoint(fail_parts={3: 1})
+    data = payload(PART_SIZE * 5)
+    with pytest.raises(RuntimeError, match='part 3'):
+        upload_all(make_upload(endpoint, tmp_path), data)
+
+    # Parts queued before the failure was noticed may have gone out too; part 3 is the one known to be missing
+    journal = read_journal(tmp_path)
+    uploaded = {int(number) for number in journal['parts']}
+    assert {1, 2} <= uploaded and 3 not in uploaded
+    assert journal['parts']['1'] == hashlib.sha256(data[:PART_SIZE]).hexdigest()
+
+    endpoint.part_calls.clear()
+    upload = make_upload(endpoint, tmp_path)
+    item_id = upload_all(upload, data)
+    assert item_id == journal['item_id']
+    assert len(endpoint.items) == 1
+    assert endpoint.part_calls == sorted({1, 2, 3, 4, 5} - uploaded)
+    assert upload.skipped == len(uploaded)
+    assert endpoint.items[item_id]['data'] == data
+
+
+def test_changed_parts_are_uploaded_again(tmp_path):
+    endpoint = FakeUploadEndpoint(fail_parts={4: 1})
+    data = payload(PART_SIZE * 4)
+    with pytest.raises(RuntimeError):
+        upload_all(make_upload(endpoint, tmp_path), data)
+
+    # The file changed inside part 2 before the retry; its hash no longer matches the journal
+    changed = bytearray(data)
+    changed[PART_SIZE + 10] ^= 0xff
+    changed = bytes(changed)
+    endpoint.part_calls.clear()
+    item_id = upload_all(make_upload(endpoint, tmp_path), changed)
+    assert endpoint.part_calls == [2, 4]
+    assert endpoint.items[item_id]['data'] == changed
+
+
+def test_file_that_shrank_since_the_interrupted_upload_starts_over(tmp_path):
+    endpoint = FakeUploadEndpoint(fail_parts={4: 1})
+    data = payload(PART_SIZE * 4)
+    with pytest.raises(RuntimeError):
+        upload_all(make_upload(endpoint, tmp_path), data)
+
+    # Parts past the new end are still in the item, so it can't be committed
+    with pytest.raises(RuntimeError, match='changed since the interrupted upload'):
+        upload_all(make_upload(endpoint, tmp_path), data[:PART_SIZE * 2])
+    assert not os.path.exists(tmp_path / 'data.zip.upload.json')
+
+    item_id = upload_all(make_upload(endpoint, tmp_path), data[:PART_SIZE * 2])
+    assert endpoint.items[item_id]['data'] == data[:PART_SIZE * 2]
+    assert len(endpoint.items) == 2
+
+
+def test_journal_of_an_item_the_portal_lost_is_not_resumed(tmp_path):
+    endpoint = FakeUploadEndpoint(fail_parts={2: 1})
+    data = payload(PART_SIZE * 3)
+    with pytest.raises(RuntimeError):
+        upload_all(make_upload(endpoint, tmp_path), data)
+    endpoint.lost_items.add(read_journal(tmp_path)['item_id'])
+
+    endpoint.part_calls.clear()
+    item_id = upload_all(make_upload(endpoint, tmp_path), data)
+    assert item_id == 'item2'
+    assert endpoint.part_calls == [1, 2, 3]
+
+
+def test_journal_with_another_part_size_is_not_resumed(tmp_path):
+    endpoint = FakeUploadEndpoint(fail_parts={2: 1})
+    data = payload(PART_SIZE * 3)
+    with pytest.raises(RuntimeError):
+        upload_all(make_upload(endpoint, tmp_path), data)
+
+    item_id = upload_all(make_upload(endpoint, tmp_path, part_size=PART_SIZE * 2), data)
+    assert item_id == 'item2'
+    assert endpoint.items[item_id]['data'] == data
+
+
+def test_failed_commit_removes_the_journal(tmp_path):
+    endpoint = FakeUploadEndpoint(commit_status='failed')
+    with pytest.raises(RuntimeError, match='failed to assemble'):
+        upload_all(make_upload(endpoint, tmp_path), payload(PART_SIZE * 2))
+    # The parts of a failed item can't be reused, so the next run starts a new item
+    assert not os.path.exists(tmp_path / 'data.zip.upload.json')
+
+
+def test_commit_error_keeps_the_journal_for_a_retry(tmp_path, monkeypatch):
+    endpoint = FakeUploadEndpoint()
+    data = payload(PART_SIZE * 2)
+
+    def refuse(item_id, properties):
+        raise RuntimeError("Upload request failed: commit timed out")
+    monkeypatch.setattr(endpoint, 'commit', refuse)
+    with pytest.raises(RuntimeError, match='commit timed out'):
+        upload_all(make_upload(endpoint, tmp_path), data)
+    assert sorted(read_journal(tmp_path)['parts']) == ['1', '2']
+
+    monkeypatch.undo()
+    monkeypatch.setattr(chunked_upload, 'COMMIT_POLL_INTERVAL', 0)
+    endpoint.part_calls.clear()
+    item_id = upload_all(make_upload(endpoint, tmp_path), data)
+    assert endpoint.part_calls == []
+    assert endpoint.items[item_id]['data'] == data
+
+
+def test_update_replaces_an_existing_item(tmp_path):
+    endpoint = FakeUploadEndpoint()
+    endpoint.items['existing'] = {'parts': {}, 'status': 'completed', 'data': b'old'}
+    data = payload(PART_SIZE + 1)
+    item_id = upload_all(make_upload(endpoint, tmp_path, item_id='existing'), data)
+    assert item_id == 'existing'
+    assert endpoint.items['existing']['data'] == data
+    assert len(endpoint.items) == 1
+
+
+def test_feed_file(tmp_path):
+    endpoint = FakeUploadEndpoint()
+    data = payload(PART_SIZE * 3 + 5)
+    path = tmp_path / 'data.zip'
+    path.write_bytes(data)
+    upload = make_upload(endpoint, tmp_path, max_workers=2)
+    upload.begin()
+    upload.feed_file(str(path))
+    assert endpoint.items[upload.finish()]['data'] == data
+
+
+# Stand-in for http_client.request that records the calls and answers like the sharing API
+class RecordingTransport:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        if url.endswith('/status'):
+            body = {'status': 'completed'}
+        else:
+            body = {'success': True, 'id': 'abc123'}
+        return type('Response', (), {'status_code': 200, 'json': lambda self: body})()
+
+
+def test_endpoint_sends_the_token_referer_on_every_call(monkeypatch):
+    transport = RecordingTransport()
+    monkeypatch.setattr(chunked_upload.http_client, 'request', transport)
+    endpoint = ArcGISUploadEndpoint('https://www.arcgis.com', 'analyst', lambda: 'token1', folder_id='f1')
+    item_id = endpoint.add_item('data.zip', {'title': 'Data'})
+    endpoint.update_item(item_id, 'data.zip', {'title': 'Data'})
+    endpoint.add_part(item_id, 1, b'bytes')
+    endpoint.commit(item_id, {'title': 'Data'})
+    endpoint.status(item_id)
+
+    assert [url.rsplit('/', 1)[1] for _, url, _ in transport.calls] == ['addItem', 'update', 'addPart', 'commit', 'status']
+    assert transport.calls[0][1] == 'https://www.arcgis.com/sharing/rest/content/users/analyst/f1/addItem'
+    for _, _, kwargs in transport.calls:
+        assert kwargs['headers'] == {'Referer': 'https://www.arcgis.com'}
+        assert (kwargs.get('data') or kwargs.get('params'))['token'] == 'token1'
+
+
+def test_endpoint_raises_on_error_bodies(monkeypatch):
+    def reject(method, url, **kwargs):
+        body = {'error': {'code': 498, 'message': 'Invalid token.'}}
+        return type('Response', (), {'status_code': 200, 'json': lambda self: body})()
+    monkeypatch.setattr(chunked_upload.http_client, 'request', reject)
+    endpoint = ArcGISUploadEndpoint('https://www.arcgis.com', 'analyst', 'token1')
+    with pytest.raises(RuntimeError, match='Invalid token'):
+        endpoint.status('abc123')
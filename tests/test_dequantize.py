@@ -0,0 +1,59 @@
+import pytest
+
+from geometry_engine import add_measures, dequantize
+
+# Quantized query responses: integer coordinates, each part delta-encoded from its first vertex
+
+
+# Function to build a clockwise, closed square ring
+def square(x, y, size):
+    return [[x, y], [x, y + size], [x + size, y + size], [x + size, y], [x, y]]
+
+
+def test_dequantize_upper_left_paths_and_points():
+    data = {
+        'transform': {'originPosition': 'upperLeft', 'scale': [0.5, 0.25, 0, 0], 'translate': [1000.0, 2000.0, 0, 0]},
+        'features': [
+            # Every part starts with an absolute vertex, then offsets from the previous vertex
+            {'geometry': {'paths': [[[2, 4], [2, 4], [-1, 0]], [[10, 0], [0, 8]]]}},
+            {'geometry': {'x': 4, 'y': 8}},
+            {'geometry': {'points': [[0, 0, 12.5], [4, 4, 13.5]]}},
+            {'attributes': {'OBJECTID': 4}},
+        ],
+    }
+    result = dequantize(data)
+    assert 'transform' not in result
+    assert result['features'][0]['geometry']['paths'] == [
+        [[1001.0, 1999.0], [1002.0, 1998.0], [1001.5, 1998.0]],
+        [[1005.0, 2000.0], [1005.0, 1998.0]],
+    ]
+    assert result['features'][1]['geometry'] == {'x': 1002.0, 'y': 1998.0}
+    # z values are not quantized
+    assert result['features'][2]['geometry']['points'] == [[1000.0, 2000.0, 12.5], [1002.0, 1999.0, 13.5]]
+    assert result['features'][3] == {'attributes': {'OBJECTID': 4}}
+
+
+def test_dequantize_lower_left_rings_measure_like_the_original():
+    original = square(-8238000.0, 4970000.0, 500.0)
+    step = 10.0
+    origin = (-8300000.0, 4900000.0)
+    ring = []
+    previous = None
+    for x, y in original:
+        vertex = [round((x - origin[0]) / step), round((y - origin[1]) / step)]
+        ring.append(vertex if previous is None else [vertex[0] - previous[0], vertex[1] - previous[1]])
+        previous = vertex
+    data = {
+        'geometryType': 'esriGeometryPolygon',
+        'transform': {'originPosition': 'lowerLeft', 'scale': [step, step], 'translate': list(origin)},
+        'features': [{'attributes': {}, 'geometry': {'rings': [ring]}}],
+    }
+    dequantize(data)
+    assert data['features'][0]['geometry']['rings'] == [original]
+    add_measures(data)
+    assert data['features'][0]['attributes']['Area_m2'] == pytest.approx(250000.0)
+
+
+def test_dequantize_without_transform_is_unchanged():
+    data = {'features': [{'geometry': {'x': 1.5, 'y': 2.5}}]}
+    assert dequantize(data) == {'features': [{'geometry': {'x': 1.5, 'y': 2.5}}]}
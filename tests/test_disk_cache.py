@@ -0,0 +1,41 @@
+import os
+
+from disk_cache import DiskCache
+
+
+# Function to store an entry of size bytes under a key
+def store(cache, key, size):
+    return cache.store(key, [b'x' * size])
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    first = store(cache, 'aa01', 100)
+    second = store(cache, 'aa02', 100)
+    cache.lookup('aa01')
+    store(cache, 'aa03', 100)
+    assert os.path.exists(first)
+    assert not os.path.exists(second)
+
+
+def test_pinned_entry_is_not_evicted_until_released(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=250)
+    first = store(cache, 'aa01', 100)
+    store(cache, 'aa02', 100)
+    with cache.pinned('aa01'):
+        store(cache, 'aa03', 100)
+        store(cache, 'aa04', 100)
+        with open(first, 'rb') as f:
+            assert f.read() == b'x' * 100
+    assert cache.lookup('aa02') is None and cache.lookup('aa03') is None
+    # Once released, the entry is the least recently used again
+    store(cache, 'aa05', 100)
+    assert not os.path.exists(first)
+
+
+def test_entry_larger_than_the_budget_can_be_read_while_pinned(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=50)
+    with cache.pinned('aa01'):
+        path = store(cache, 'aa01', 100)
+        assert os.path.getsize(path) == 100
+    assert not os.path.exists(path)
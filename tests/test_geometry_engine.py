@@ -0,0 +1,142 @@
+import math
+
+import pytest
+
+import rest_engine
+from geometry_engine import add_measures, polygon_measures, polyline_lengths, spatial_reference_units
+
+# Known geometries in Esri JSON ring order: outer rings clockwise, holes counter-clockwise
+
+
+# Function to build a clockwise, closed square ring
+def square(x, y, size):
+    return [[x, y], [x, y + size], [x + size, y + size], [x + size, y], [x, y]]
+
+
+# Function to build a counter-clockwise, closed square ring (a hole)
+def square_hole(x, y, size):
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+def test_square_with_hole():
+    areas, perimeters = polygon_measures([{'rings': [square(0, 0, 100), square_hole(40, 40, 20)]}])
+    assert areas[0] == pytest.approx(100 * 100 - 20 * 20)
+    assert perimeters[0] == pytest.approx(4 * 100 + 4 * 20)
+
+
+def test_multipart_polygon():
+    areas, perimeters = polygon_measures([{'rings': [square(0, 0, 10), square(100, 100, 30)]}])
+    assert areas[0] == pytest.approx(10 * 10 + 30 * 30)
+    assert perimeters[0] == pytest.approx(4 * 10 + 4 * 30)
+
+
+def test_open_and_closed_rings_measure_the_same():
+    closed = square(5, 5, 50)
+    areas, perimeters = polygon_measures([{'rings': [closed]}, {'rings': [closed[:-1]]}])
+    assert areas[0] == pytest.approx(2500)
+    assert areas[1] == pytest.approx(areas[0])
+    assert perimeters[1] == pytest.approx(perimeters[0])
+
+
+def test_large_projected_coordinates_keep_precision():
+    areas, perimeters = polygon_measures([{'rings': [square(-8238000.25, 4970000.75, 1.5)]}])
+    assert areas[0] == pytest.approx(2.25, rel=1e-9)
+    assert perimeters[0] == pytest.approx(6.0, rel=1e-9)
+
+
+def test_polygons_in_a_batch_are_measured_apart():
+    areas, _ = polygon_measures([{'rings': [square(0, 0, 1)]}, None, {'rings': [square(0, 0, 2), square(10, 10, 3)]}])
+    assert areas[0] == pytest.approx(1)
+    assert math.isnan(areas[1])
+    assert areas[2] == pytest.approx(4 + 9)
+
+
+def test_polyline_length():
+    lengths = polyline_lengths([
+        {'paths': [[[0, 0], [3, 4]]]},
+        {'paths': [[[0, 0], [3, 4], [3, 10]], [[100, 100], [100, 105]]]},
+        {'paths': [[[0, 0, 7.5], [0, 2, 9.0]]]},
+    ])
+    assert lengths.tolist() == pytest.approx([5, 5 + 6 + 5, 2])
+
+
+def test_empty_geometries_are_nan():
+    polygons = [None, {}, {'rings': []}, {'rings': [[[1, 1]]]}]
+    areas, perimeters = polygon_measures(polygons)
+    assert all(math.isnan(value) for value in areas)
+    assert all(math.isnan(value) for value in perimeters)
+    assert all(math.isnan(value) for value in polyline_lengths([None, {'paths': []}, {'paths': [[[1, 1]]]}]))
+    areas, perimeters = polygon_measures([])
+    assert len(areas) == len(perimeters) == 0
+
+
+def test_add_measures_writes_attributes_in_meters():
+    data = {
+        'geometryType': 'esriGeometryPolygon',
+        'fields': [{'name': 'Area_m2', 'type': 'esriFieldTypeDouble'}],
+        'features': [
+            {'attributes': {}, 'geometry': {'rings': [square(0, 0, 100), square_hole(40, 40, 20)]}},
+            {'attributes': {}},
+            {'attributes': {}, 'geometry': {'curveRings': [[[0, 0], {'a': [[0, 0], [1, 1], 0, 1]}]]}},
+        ],
+    }
+    add_measures(data, unit_scale=0.3048)
+    assert [field['name'] for field in data['fields']] == ['Area_m2', 'Length_m']
+    assert data['features'][0]['attributes']['Area_m2'] == pytest.approx(9600 * 0.3048 ** 2)
+    assert data['features'][0]['attributes']['Length_m'] == pytest.approx(480 * 0.3048)
+    assert data['features'][1]['attributes'] == {'Area_m2': None, 'Length_m': None}
+    assert data['features'][2]['attributes'] == {'Area_m2': None, 'Length_m': None}
+
+
+def test_add_measures_never_writes_geodatabase_managed_fields():
+    data = {
+        'geometryType': 'esriGeometryPolyline',
+        'fields': [{'name': 'Shape_Length', 'type': 'esriFieldTypeDouble'}],
+        'features': [{'attributes': {'Shape_Length': 1.0}, 'geometry': {'paths': [[[0, 0], [3, 4]]]}}],
+    }
+    add_measures(data)
+    assert [field['name'] for field in data['fields']] == ['Shape_Length', 'Length_m']
+    assert data['features'][0]['attributes'] == {'Shape_Length': 1.0, 'Length_m': pytest.approx(5.0)}
+
+
+def test_add_measures_leaves_points_alone():
+    data = {'geometryType': 'esriGeometryPoint', 'features': [{'attributes': {}, 'geometry': {'x': 1, 'y': 2}}]}
+    assert add_measures(data) == {'geometryType': 'esriGeometryPoint', 'features': [{'attributes': {}, 'geometry': {'x': 1, 'y': 2}}]}
+
+
+@pytest.mark.parametrize('reference, expected', [
+    ({'wkid': 102100, 'latestWkid': 3857}, ('projected', 1.0)),
+    ({'wkid': 4326}, ('geographic', None)),
+    ({'wkid': 104199}, ('geographic', None)),
+    ({'wkt': 'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,298.257223563]],'
+             'PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]'}, ('geographic', None)),
+    ({'wkt': 'PROJCS["NAD_1983_StatePlane_New_York_Long_Island_FIPS_3104_Feet",GEOGCS["GCS_North_American_1983",'
+             'DATUM["D_North_American_1983",SPHEROID["GRS_1980",6378137.0,298.257222101]],PRIMEM["Greenwich",0.0],'
+             'UNIT["Degree",0.0174532925199433]],PROJECTION["Lambert_Conformal_Conic"],UNIT["Foot_US",0.3048006096012192]]'},
+     ('projected', 0.3048006096012192)),
+    ({}, (None, None)),
+    (None, (None, None)),
+])
+def test_spatial_reference_units(reference, expected):
+    assert spatial_reference_units(reference) == expected
+
+
+def test_measure_transform_uses_the_layer_spatial_reference():
+    polygon = {'geometryType': 'esriGeometryPolygon', 'features': [{'attributes': {}, 'geometry': {'rings': [square(0, 0, 10)]}}]}
+    # A geographic layer is not measured even if the service reports linear units
+    geographic = {'name': 'Parcels', 'extent': {'spatialReference': {'wkid': 4269}}}
+    assert rest_engine.make_measure_transform(geographic, 'esriMeters') is None
+
+    web_mercator = {'name': 'Parcels', 'extent': {'spatialReference': {'wkid': 102100, 'latestWkid': 3857}}}
+    transform = rest_engine.make_measure_transform(web_mercator, 'esriFeet')
+    assert transform(polygon)['features'][0]['attributes']['Area_m2'] == pytest.approx(100.0)
+
+
+def test_measure_transform_falls_back_to_service_units_and_skips_unknown_units():
+    polygon = {'geometryType': 'esriGeometryPolygon', 'features': [{'attributes': {}, 'geometry': {'rings': [square(0, 0, 10)]}}]}
+    transform = rest_engine.make_measure_transform({'name': 'Parcels'}, 'esriFeet')
+    assert transform(polygon)['features'][0]['attributes']['Area_m2'] == pytest.approx(100 * 0.3048 ** 2)
+    assert rest_engine.make_measure_transform({'name': 'Parcels'}, 'esriDecimalDegrees') is None
+    assert rest_engine.make_measure_transform({'name': 'Parcels'}, None) is None
+    assert rest_engine.make_measure_transform({'name': 'Parcels', 'spatialReference': {'wkid': 999999}}, 'esriUnknownUnits') is None
+
@@ -0,0 +1,91 @@
+import pytest
+
+import http_client
+
+
+# Stand-in for a response carrying only headers
+class HeaderResponse:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+@pytest.mark.parametrize('header, expected', [('2', 2.0), ('0', 0.0), ('-5', 0.0), ('999999', http_client.BACKOFF_MAX)])
+def test_retry_after_seconds(header, expected):
+    assert http_client._retry_delay(1, HeaderResponse({'Retry-After': header})) == expected
+
+
+def test_retry_after_date_in_the_past_retries_now():
+    assert http_client._retry_delay(1, HeaderResponse({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})) == 0
+
+
+@pytest.mark.parametrize('header', ['soon', 'Wed, 99 Foo 2015', '1.5 seconds'])
+def test_malformed_retry_after_falls_back_to_backoff(header):
+    for _ in range(20):
+        delay = http_client._retry_delay(3, HeaderResponse({'Retry-After': header}))
+        assert 0 <= delay <= http_client.BACKOFF_BASE * 2 ** 3
+
+
+# Stand-in for the shared session that plays back a script of responses and exceptions
+class ScriptedSession:
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return StatusResponse(outcome)
+
+
+class StatusResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {}
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def scripted(monkeypatch):
+    monkeypatch.setattr(http_client, '_retry_delay', lambda attempt, response=None: 0)
+
+    def install(*outcomes):
+        session = ScriptedSession(*outcomes)
+        monkeypatch.setattr(http_client, 'get_session', lambda: session)
+        return session
+    return install
+
+
+def test_get_is_retried_after_server_errors_and_timeouts(scripted):
+    session = scripted(502, http_client.requests.ReadTimeout(), 200)
+    assert http_client.get('http://example.test/a').status_code == 200
+    assert session.calls == 3
+
+
+@pytest.mark.parametrize('status', [500, 502, 503, 504])
+def test_post_is_not_retried_after_a_server_error(scripted, status):
+    session = scripted(status, 200)
+    assert http_client.post('http://example.test/addItem').status_code == status
+    assert session.calls == 1
+
+
+def test_post_is_not_retried_after_a_read_timeout(scripted):
+    session = scripted(http_client.requests.ReadTimeout(), 200)
+    with pytest.raises(http_client.requests.ReadTimeout):
+        http_client.post('http://example.test/commit')
+    assert session.calls == 1
+
+
+def test_post_is_retried_when_it_was_never_sent_or_throttled(scripted):
+    session = scripted(http_client.requests.ConnectTimeout(), 429, 200)
+    assert http_client.post('http://example.test/addItem').status_code == 200
+    assert session.calls == 3
+
+
+def test_post_marked_idempotent_is_retried(scripted):
+    session = scripted(502, http_client.requests.ReadTimeout(), 200)
+    assert http_client.post('http://example.test/addPart', idempotent=True).status_code == 200
+    assert session.calls == 3
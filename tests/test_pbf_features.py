@@ -0,0 +1,132 @@
+import json
+import os
+
+import pytest
+
+from geometry_engine import dequantize
+from pbf_features import decode_feature_collection, make_field_transform, supports_pbf
+
+# Each fixture is a f=pbf query response (<name>.pbf) with the f=json response to the same query (<name>.json).
+# PBF coordinates are quantized, so decoded vertices may differ from the JSON ones by half a quantization step.
+# The PBF bodies were assembled byte by byte from Esri's FeatureCollection.proto (proto3 defaults left off the
+# wire, packed lengths and coordinates, null values as empty messages), not with mock_arcgis_server's encoder;
+# responses recorded from a live service can be dropped in next to them under the same names.
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'pbf')
+
+# Quantization step of each feature fixture's PBF transform (x/y, and z where the layer has z values)
+FEATURE_FIXTURES = {
+    'points_wgs84': (1e-9, None),
+    'polylines_webmercator': (0.0001, None),
+    'polygons_webmercator': (0.0001, None),
+    'polygons_z': (0.000125, 0.0001),
+    'polygons_quantized': (10.0, None),
+}
+
+
+# Function to load a fixture pair as (pbf bytes, json dict)
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, f'{name}.pbf'), 'rb') as f:
+        pbf = f.read()
+    with open(os.path.join(FIXTURES, f'{name}.json')) as f:
+        return pbf, json.load(f)
+
+
+# Function to collect the vertices of an Esri JSON geometry as one list
+def vertices(geometry):
+    if 'x' in geometry:
+        return [[geometry['x'], geometry['y']] + ([geometry['z']] if 'z' in geometry else [])]
+    return [vertex for part in geometry.get('rings') or geometry.get('paths') or geometry.get('points') for vertex in part]
+
+
+# Function to compare a decoded geometry with the JSON one, vertex by vertex, within the quantization tolerance
+def assert_geometry_matches(decoded, expected, xy_step, z_step):
+    assert set(decoded) & {'x', 'rings', 'paths', 'points'} == set(expected) & {'x', 'rings', 'paths', 'points'}
+    for key in ('rings', 'paths'):
+        if key in expected:
+            assert [len(part) for part in decoded[key]] == [len(part) for part in expected[key]]
+    decoded_vertices = vertices(decoded)
+    expected_vertices = vertices(expected)
+    assert len(decoded_vertices) == len(expected_vertices)
+    for got, want in zip(decoded_vertices, expected_vertices):
+        assert len(got) == len(want)
+        assert got[0] == pytest.approx(want[0], abs=xy_step / 2 + 1e-9)
+        assert got[1] == pytest.approx(want[1], abs=xy_step / 2 + 1e-9)
+        if len(want) > 2:
+            assert got[2] == pytest.approx(want[2], abs=z_step / 2 + 1e-12)
+
+
+@pytest.mark.parametrize('name', sorted(FEATURE_FIXTURES))
+def test_feature_fixture_matches_json_response(name):
+    pbf, expected = load_fixture(name)
+    xy_step, z_step = FEATURE_FIXTURES[name]
+    decoded = decode_feature_collection(pbf)
+    # A quantized f=json response carries its own transform; decode it the way a quantized run does
+    expected = dequantize(expected)
+
+    assert decoded['objectIdFieldName'] == expected['objectIdFieldName']
+    assert decoded['geometryType'] == expected['geometryType']
+    assert decoded.get('globalIdFieldName') == expected.get('globalIdFieldName')
+    assert decoded.get('hasZ', False) == expected.get('hasZ', False)
+    assert decoded.get('exceededTransferLimit', False) == expected.get('exceededTransferLimit', False)
+    assert decoded['spatialReference'] == expected['spatialReference']
+    assert [(field['name'], field['type'], field['alias']) for field in decoded['fields']] == \
+        [(field['name'], field['type'], field['alias']) for field in expected['fields']]
+
+    assert len(decoded['features']) == len(expected['features'])
+    for got, want in zip(decoded['features'], expected['features']):
+        assert got['attributes'].keys() == want['attributes'].keys()
+        for field, value in want['attributes'].items():
+            if isinstance(value, float):
+                assert got['attributes'][field] == pytest.approx(value)
+            else:
+                assert got['attributes'][field] == value
+        assert ('geometry' in got) == ('geometry' in want)
+        if 'geometry' in want:
+            assert_geometry_matches(got['geometry'], want['geometry'], xy_step, z_step)
+
+
+def test_null_attributes_and_missing_geometry():
+    pbf, _ = load_fixture('polygons_webmercator')
+    feature = decode_feature_collection(pbf)['features'][2]
+    assert feature['attributes'] == {'OBJECTID': 103, 'PARCEL': None, 'Shape__Area': None, 'Shape__Length': None}
+    assert 'geometry' not in feature
+
+
+def test_polygon_hole_and_multipart_parts_are_kept_apart():
+    pbf, _ = load_fixture('polygons_webmercator')
+    with_hole, multipart, _ = decode_feature_collection(pbf)['features']
+    # Delta encoding runs on across the parts of a geometry; each part must still start where the JSON one does
+    assert with_hole['geometry']['rings'][1][0] == pytest.approx([-8238000.0 + 40, 4970000.0 + 40])
+    assert multipart['geometry']['rings'][1][0] == pytest.approx([-8238000.0 + 300.5, 4970000.0 + 0.25])
+
+
+def test_count_only():
+    pbf, expected = load_fixture('count_only')
+    assert decode_feature_collection(pbf) == expected
+
+
+def test_ids_only():
+    pbf, expected = load_fixture('ids_only')
+    assert decode_feature_collection(pbf) == expected
+
+
+def test_empty_response():
+    assert decode_feature_collection(b'') == {'features': []}
+
+
+def test_field_transform_restores_layer_field_definitions():
+    pbf, expected = load_fixture('points_wgs84')
+    transform = make_field_transform({'fields': expected['fields']})
+    decoded = transform(decode_feature_collection(pbf))
+    assert decoded['fields'] == expected['fields']
+
+
+def test_supports_pbf():
+    assert supports_pbf({'supportedQueryFormats': 'JSON, geoJSON, PBF'})
+    assert not supports_pbf({'supportedQueryFormats': 'JSON, geoJSON'})
+    assert not supports_pbf({})
+
+
+def test_fixture_steps_cover_every_feature_fixture():
+    names = {name[:-len('.pbf')] for name in os.listdir(FIXTURES) if name.endswith('.pbf')}
+    assert names - set(FEATURE_FIXTURES) == {'count_only', 'ids_only'}
@@ -0,0 +1,46 @@
+import pytest
+
+import rest_engine
+
+URL = 'https://example.com/arcgis/rest/services/Parcels/FeatureServer/0'
+
+# Layer metadata without an object ID field
+NO_OID_LAYER = {'name': 'Parcels', 'maxRecordCount': 100, 'fields': [{'name': 'NAME', 'type': 'esriFieldTypeString'}]}
+
+
+@pytest.fixture
+def warnings(monkeypatch):
+    messages = []
+    monkeypatch.setattr(rest_engine, 'log_message', lambda message, level='INFO': messages.append((level, message)))
+    return messages
+
+
+def test_layer_without_oid_field_is_paged_by_offset(monkeypatch):
+    monkeypatch.setattr(rest_engine, 'get_feature_count', lambda url, where, spatial=None: 250)
+    metadata = {**NO_OID_LAYER, 'advancedQueryCapabilities': {'supportsPagination': True}}
+    pages, page_size = rest_engine.build_pages(URL, {'where': '1=1'}, metadata)
+    assert page_size == 100
+    assert pages == [{'resultOffset': offset, 'resultRecordCount': 100} for offset in (0, 100, 200)]
+
+
+def test_layer_without_oid_field_or_pagination_warns_when_a_page_is_full(monkeypatch, warnings):
+    monkeypatch.setattr(rest_engine, 'query_json', lambda url, params: {'features': [{'attributes': {}}] * 100})
+    pages, page_size = rest_engine.build_pages(URL, {'where': '1=1'}, NO_OID_LAYER)
+    assert pages == [{}]
+    _, features = rest_engine.fetch_page(URL, {'where': '1=1'}, pages[0], None, page_size)
+    assert len(features) == 100
+    assert [level for level, _ in warnings] == ['WARNING']
+
+
+def test_truncated_page_that_cannot_be_continued_warns(monkeypatch, warnings):
+    monkeypatch.setattr(rest_engine, 'query_json',
+                        lambda url, params: {'features': [{'attributes': {}}] * 40, 'exceededTransferLimit': True})
+    _, features = rest_engine.fetch_page(URL, {'where': '1=1'}, {}, None, 100)
+    assert len(features) == 40
+    assert [level for level, _ in warnings] == ['WARNING']
+
+
+def test_short_unpaged_query_does_not_warn(monkeypatch, warnings):
+    monkeypatch.setattr(rest_engine, 'query_json', lambda url, params: {'features': [{'attributes': {}}] * 99})
+    rest_engine.fetch_page(URL, {'where': '1=1'}, {}, None, 100)
+    assert warnings == []
@@ -0,0 +1,94 @@
+import atexit
+import importlib
+import os
+import runpy
+import subprocess
+import sys
+import threading
+
+# Pre-warmed Python worker processes for the launcher.
+# Each worker starts ahead of time, imports the heavy libraries the tools use and then
+# waits for the path of a script on stdin. Running a script hands it to a waiting worker,
+# so a click only costs the script's own start-up; a fresh worker is started right away
+# to take the used one's place. A worker runs a single script, since the tools keep
+# their state (and their Tk window) in module globals.
+
+# Interpreter the workers run on
+PYTHON = "python"
+
+# Number of idle workers kept ready
+DEFAULT_POOL_SIZE = 2
+
+# Modules imported by a worker before it is handed a script; missing ones are skipped
+WARM_IMPORTS = ('arcpy', 'arcgis', 'arcgis.gis', 'numpy', 'requests', 'tkinter')
+
+
+# With capture_output the workers run unbuffered with stdout and stderr on one pipe, for streaming
+class WarmPool:
+    def __init__(self, size=DEFAULT_POOL_SIZE, capture_output=False):
+        self.size = max(0, size)
+        self.capture_output = capture_output
+        self._idle = []
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    # Function to start one idle worker
+    def _spawn(self):
+        if self.capture_output:
+            return subprocess.Popen([PYTHON, '-u', os.path.abspath(__file__)], stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        return subprocess.Popen([PYTHON, os.path.abspath(__file__)], stdin=subprocess.PIPE)
+
+    # Function to top the pool up to its size, dropping workers that died while idle
+    def fill(self):
+        with self._lock:
+            self._idle = [worker for worker in self._idle if worker.poll() is None]
+            while len(self._idle) < self.size:
+                self._idle.append(self._spawn())
+
+    # Function to run a script on a warm worker (or a new one if none is ready); returns its Popen
+    def run(self, script_path):
+        worker = None
+        with self._lock:
+            while self._idle and worker is None:
+                candidate = self._idle.pop(0)
+                if candidate.poll() is None:
+                    worker = candidate
+        if worker is None:
+            worker = self._spawn()
+        worker.stdin.write(f"{os.path.abspath(script_path)}\n".encode('utf-8'))
+        worker.stdin.close()
+        threading.Thread(target=self.fill, daemon=True).start()
+        return worker
+
+    # Function to let the idle workers exit (closing stdin ends their wait)
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            try:
+                worker.stdin.close()
+            except OSError:
+                pass
+
+
+# Function run inside a worker: warm up, wait for a script path, run it as __main__
+def worker_main():
+    for name in WARM_IMPORTS:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass
+    script_path = sys.stdin.readline().strip()
+    if not script_path:
+        return
+    # Same view of the script as `python script_path`: its folder first on sys.path, its path in argv
+    sys.path.insert(0, os.path.dirname(script_path))
+    sys.argv = [script_path]
+    runpy.run_path(script_path, run_name='__main__')
+
+
+if __name__ == '__main__':
+    # Drop this module's own folder from the path; the script's folder takes its place
+    sys.path.pop(0)
+    worker_main()